@@ -204,6 +204,61 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Number of scheduled wishes dispatched per batch (DB writes are bulk-flushed per batch)
+SCHEDULED_WISHES_BATCH_SIZE = int(os.getenv('SCHEDULED_WISHES_BATCH_SIZE', 100))
+
+# Seconds a worker may hold claimed wishes in Processing before they are reclaimed
+SCHEDULED_WISH_LEASE_SECONDS = int(os.getenv('SCHEDULED_WISH_LEASE_SECONDS', 600))
+
+# Concurrent SignalWire requests per SMS batch (pooled keep-alive connections)
+SMS_SEND_MAX_WORKERS = int(os.getenv('SMS_SEND_MAX_WORKERS', 8))
+
+# Shared cache (e.g. redis://redis-server:6379/2) so invalidations from Celery workers
+# reach the web process; falls back to Django's per-process local-memory cache
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+
+# Max seconds the birthday popup payload is cached (it is also invalidated on writes)
+BIRTHDAY_POPUP_CACHE_SECONDS = int(os.getenv('BIRTHDAY_POPUP_CACHE_SECONDS', 900))
+
+# Seconds the dashboard counters/charts on the index page are cached
+DASHBOARD_STATS_CACHE_SECONDS = int(os.getenv('DASHBOARD_STATS_CACHE_SECONDS', 60))
+
+# Patients requested per SMO API page during practice sync (each page is one bulk upsert)
+SMO_SYNC_PAGE_SIZE = int(os.getenv('SMO_SYNC_PAGE_SIZE', 500))
+
+# Where uploaded patient files are staged for the background import task; must be shared
+# between the web and Celery containers
+IMPORT_UPLOAD_DIR = os.getenv('IMPORT_UPLOAD_DIR', os.path.join(BASE_DIR, 'media', 'imports'))
+
+# Files imported per transaction by the background import task
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 200))
+
+# Seconds between SignalWire -> CommunicationLog mirror runs (messages_hub reads the mirror)
+SIGNALWIRE_MIRROR_INTERVAL_SECONDS = int(os.getenv('SIGNALWIRE_MIRROR_INTERVAL_SECONDS', 60))
+
+# Messages requested per SignalWire list page, and pages per leg (to/from) per mirror run
+SIGNALWIRE_MIRROR_PAGE_SIZE = int(os.getenv('SIGNALWIRE_MIRROR_PAGE_SIZE', 200))
+SIGNALWIRE_MIRROR_MAX_PAGES = int(os.getenv('SIGNALWIRE_MIRROR_MAX_PAGES', 10))
+
+# Outbound messages younger than this are left for the send path to log before mirroring
+SIGNALWIRE_MIRROR_SETTLE_SECONDS = int(os.getenv('SIGNALWIRE_MIRROR_SETTLE_SECONDS', 120))
+
+# Inbound SMS webhooks only append to the inbox; a worker logs them in batches of this size
+SMS_INBOX_BATCH_SIZE = int(os.getenv('SMS_INBOX_BATCH_SIZE', 500))
+
+# Seconds a burst of webhooks is collected before the inbox is drained
+SMS_INBOX_DRAIN_DELAY_SECONDS = int(os.getenv('SMS_INBOX_DRAIN_DELAY_SECONDS', 2))
+
+# Seconds a delivery receipt waits in the inbox for its message to be logged before it is dropped
+SMS_RECEIPT_RETRY_SECONDS = int(os.getenv('SMS_RECEIPT_RETRY_SECONDS', 3600))
+
 # Celery Beat Schedule
 from celery.schedules import crontab
 
@@ -212,4 +267,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'birthday.tasks.send_scheduled_wishes_task',
         'schedule': 120.0,  # 2 minutes (TEMP for testing, change to 900 for production)
     },
+    'mirror-signalwire-messages': {
+        'task': 'birthday.tasks.mirror_signalwire_messages_task',
+        'schedule': float(SIGNALWIRE_MIRROR_INTERVAL_SECONDS),
+    },
+    # Sweeps webhooks whose drain could not be queued (e.g. broker briefly down) and
+    # retries delivery receipts that arrived before their message was logged
+    'drain-sms-inbox-every-minute': {
+        'task': 'birthday.tasks.process_sms_inbox_task',
+        'schedule': 60.0,
+    },
 }
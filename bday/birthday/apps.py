@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BirthdayConfig(AppConfig):
     name = 'birthday'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,79 +1,131 @@
 from datetime import date, timedelta
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Exists, OuterRef
 
 from .models import Patient, PatientStatus, ScheduledWish
 
+POPUP_CACHE_KEY = "birthday_popup:{}"
+POPUP_LIMIT = 8
+
+
+def popup_cache_key(today):
+    return POPUP_CACHE_KEY.format(today.isoformat())
+
+
+def invalidate_birthday_popup():
+    """Drop the cached popup payload (called from model signals / bulk writes)."""
+    today = date.today()
+    # Also drop yesterday's key so a payload computed just before midnight cannot linger
+    cache.delete_many([popup_cache_key(today), popup_cache_key(today - timedelta(days=1))])
+
+
+def _empty_popup(today):
+    return {
+        "todays_birthdays_popup": [],
+        "todays_birthdays_popup_count": 0,
+        "todays_birthdays_popup_date": today.strftime("%Y-%m-%d"),
+        "is_tomorrow": False,
+    }
+
+
+def _get_birthday_data(target_date):
+    pending_wish_qs = ScheduledWish.objects.filter(
+        patient_id=OuterRef("pk"),
+        status="Pending",
+    )
+    sent_wish_qs = ScheduledWish.objects.filter(
+        patient_id=OuterRef("pk"),
+        status="Sent",
+    )
+    sent_activity_qs = PatientStatus.objects.filter(
+        patient_id=OuterRef("pk"),
+        activity_type__in=["Email Sent", "SMS Sent"],
+    )
+
+    birthdays = Patient.objects.filter(dob__month=target_date.month, dob__day=target_date.day)
+    rows = list(
+        birthdays.annotate(
+            has_pending_wish=Exists(pending_wish_qs),
+            has_sent_wish=Exists(sent_wish_qs),
+            has_sent_activity=Exists(sent_activity_qs),
+        )
+        .order_by("first_name", "last_name")
+        .values("pk", "first_name", "last_name", "dob", "has_pending_wish", "has_sent_wish", "has_sent_activity")[:POPUP_LIMIT]
+    )
+
+    # Plain dicts keep the cached payload small and picklable
+    for row in rows:
+        row["age_turning"] = target_date.year - row.pop("dob").year
+
+    # Only count when the preview is full; otherwise the preview is the whole list
+    count = len(rows) if len(rows) < POPUP_LIMIT else birthdays.count()
+    return rows, count
+
+
+def build_birthday_popup(today=None):
+    """Compute the popup payload: today's birthdays, or tomorrow's once today is handled."""
+    today = today or date.today()
+
+    # Try today first
+    todays_birthdays, total_today = _get_birthday_data(today)
+
+    # Check if today is "done"
+    is_today_done = total_today > 0 and all(
+        p["has_pending_wish"] or p["has_sent_wish"] or p["has_sent_activity"]
+        for p in todays_birthdays
+    )
+
+    # If today has no birthdays OR all today's are done, check tomorrow
+    if total_today == 0 or is_today_done:
+        tomorrow = today + timedelta(days=1)
+        tomorrows_birthdays, total_tomorrow = _get_birthday_data(tomorrow)
+
+        if total_tomorrow > 0:
+            return {
+                "todays_birthdays_popup": tomorrows_birthdays,
+                "todays_birthdays_popup_count": total_tomorrow,
+                "todays_birthdays_popup_date": today.strftime("%Y-%m-%d"),
+                "is_tomorrow": True,
+            }
+
+    # Default to today (even if empty, base.html handles count > 0)
+    return {
+        "todays_birthdays_popup": todays_birthdays,
+        "todays_birthdays_popup_count": total_today,
+        "todays_birthdays_popup_date": today.strftime("%Y-%m-%d"),
+        "is_tomorrow": False,
+    }
+
+
+def get_birthday_popup(today=None):
+    """Cached popup payload, keyed by date and invalidated by signals."""
+    today = today or date.today()
+    key = popup_cache_key(today)
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_birthday_popup(today)
+        cache.set(key, payload, settings.BIRTHDAY_POPUP_CACHE_SECONDS)
+    return payload
+
 
 def todays_birthdays_popup(request):
-    """Global context for a bottom-right popup with today's birthday actions."""
+    """
+    Global context for a bottom-right popup with today's birthday actions.
+
+    Never queries the database during page render: a warm cache is rendered inline,
+    otherwise base.html loads the popup from the birthday_popup_api endpoint.
+    """
+    today = date.today()
+    # AJAX/JSON responses never show the popup
+    if request.headers.get("x-requested-with") == "XMLHttpRequest":
+        return _empty_popup(today)
     try:
-        today = date.today()
-        
-        def get_birthday_data(target_date):
-            pending_wish_qs = ScheduledWish.objects.filter(
-                patient_id=OuterRef("pk"),
-                status="Pending",
-            )
-            sent_wish_qs = ScheduledWish.objects.filter(
-                patient_id=OuterRef("pk"),
-                status="Sent",
-            )
-            sent_activity_qs = PatientStatus.objects.filter(
-                patient_id=OuterRef("pk"),
-                activity_type__in=["Email Sent", "SMS Sent"],
-            )
-
-            patients = list(
-                Patient.objects.filter(dob__month=target_date.month, dob__day=target_date.day)
-                .annotate(
-                    has_pending_wish=Exists(pending_wish_qs),
-                    has_sent_wish=Exists(sent_wish_qs),
-                    has_sent_activity=Exists(sent_activity_qs),
-                )
-                .order_by("first_name", "last_name")[:8]
-            )
-            
-            for patient in patients:
-                patient.age_turning = target_date.year - patient.dob.year
-            
-            count = Patient.objects.filter(dob__month=target_date.month, dob__day=target_date.day).count()
-            return patients, count
-
-        # Try today first
-        todays_birthdays, total_today = get_birthday_data(today)
-        
-        # Check if today is "done"
-        is_today_done = total_today > 0 and all(
-            p.has_pending_wish or p.has_sent_wish or p.has_sent_activity 
-            for p in todays_birthdays
-        )
-        
-        # If today has no birthdays OR all today's are done, check tomorrow
-        if total_today == 0 or is_today_done:
-            tomorrow = today + timedelta(days=1)
-            tomorrows_birthdays, total_tomorrow = get_birthday_data(tomorrow)
-            
-            if total_tomorrow > 0:
-                return {
-                    "todays_birthdays_popup": tomorrows_birthdays,
-                    "todays_birthdays_popup_count": total_tomorrow,
-                    "todays_birthdays_popup_date": today.strftime("%Y-%m-%d"),
-                    "is_tomorrow": True,
-                }
-
-        # Default to today (even if empty, base.html handles count > 0)
-        return {
-            "todays_birthdays_popup": todays_birthdays,
-            "todays_birthdays_popup_count": total_today,
-            "todays_birthdays_popup_date": today.strftime("%Y-%m-%d"),
-            "is_tomorrow": False,
-        }
+        payload = cache.get(popup_cache_key(today))
     except Exception:
-        # Keep all pages usable even if DB is not ready (e.g., migrations/startup).
-        return {
-            "todays_birthdays_popup": [],
-            "todays_birthdays_popup_count": 0,
-            "todays_birthdays_popup_date": date.today().strftime("%Y-%m-%d"),
-            "is_tomorrow": False,
-        }
+        # Keep all pages usable even if the cache is unavailable.
+        payload = None
+    if payload is None:
+        return {**_empty_popup(today), "birthday_popup_lazy": True}
+    return payload
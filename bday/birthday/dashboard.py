@@ -0,0 +1,100 @@
+"""
+Dashboard statistics for views.index.
+
+All membership counters come from one conditional aggregate over
+Patient.with_plan_status() (after reading the plan duration) and the
+plan-transition chart/totals from one grouped PlanHistory query; the result is cached
+for DASHBOARD_STATS_CACHE_SECONDS.
+"""
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMonth
+
+from .models import Patient, PlanHistory
+
+DASHBOARD_STATS_CACHE_KEY = 'dashboard_stats:{}'
+CHART_MONTHS = 6
+TRANSITION_TYPES = ('Upgrade', 'Downgrade', 'Renewal')
+
+
+def _membership_counts(today):
+    # Same plan windows as the patient list labels (PracticeSettings.plan_duration_days)
+    active = Q(enrollment_date__isnull=False, plan_is_expired=False)
+    return Patient.objects.with_plan_status(today).aggregate(
+        total_patients=Count('pk'),
+        # Membership statistics
+        active_count=Count('pk', filter=active),
+        expiring_soon_count=Count('pk', filter=Q(plan_status_label='Expiring Soon')),
+        just_expired_count=Count('pk', filter=Q(plan_status_label='Just Expired')),
+        expired_total_count=Count('pk', filter=Q(plan_is_expired=True)),
+        proceed_count=Count('pk', filter=Q(patient_type='Proceed')),
+        regular_count=Count('pk', filter=Q(patient_type='Regular')),
+        # Card Types statistics (Active Plans only)
+        gold_count=Count('pk', filter=active & Q(membership_plan='Gold')),
+        silver_count=Count('pk', filter=active & Q(membership_plan='Silver')),
+        bronze_count=Count('pk', filter=active & Q(membership_plan='Bronze')),
+    )
+
+
+def _chart_months(today):
+    """First day of each of the last CHART_MONTHS calendar months, oldest first."""
+    year, month = today.year, today.month
+    months = []
+    for _ in range(CHART_MONTHS):
+        months.append(date(year, month, 1))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months[::-1]
+
+
+def _plan_transition_stats(today):
+    months = _chart_months(today)
+    per_month = {}
+    totals = dict.fromkeys(TRANSITION_TYPES, 0)
+
+    # One grouped query: monthly counts per change type (all-time totals are summed from it)
+    rows = (
+        PlanHistory.objects.filter(change_type__in=TRANSITION_TYPES)
+        .annotate(month=TruncMonth('created_at'))
+        .values('month', 'change_type')
+        .annotate(count=Count('pk'))
+        .order_by()
+    )
+    for row in rows:
+        totals[row['change_type']] += row['count']
+        month = row['month']
+        per_month[(month.year, month.month, row['change_type'])] = row['count']
+
+    def series(change_type):
+        return [per_month.get((m.year, m.month, change_type), 0) for m in months]
+
+    return {
+        'chart_labels': [m.strftime('%b') for m in months],
+        'chart_upgrades': series('Upgrade'),
+        'chart_downgrades': series('Downgrade'),
+        'chart_renewals': series('Renewal'),
+        # Total Transition Stats for Pie Chart
+        'total_up': totals['Upgrade'],
+        'total_down': totals['Downgrade'],
+        'total_ren': totals['Renewal'],
+    }
+
+
+def compute_dashboard_stats(today=None):
+    today = today or date.today()
+    stats = _membership_counts(today)
+    stats.update(_plan_transition_stats(today))
+    return stats
+
+
+def get_dashboard_stats(today=None):
+    """Cached dashboard counters and chart series for the given day."""
+    today = today or date.today()
+    key = DASHBOARD_STATS_CACHE_KEY.format(today.isoformat())
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_dashboard_stats(today)
+        cache.set(key, stats, settings.DASHBOARD_STATS_CACHE_SECONDS)
+    return stats
@@ -0,0 +1,514 @@
+"""
+Bulk patient file import.
+
+All uploaded files are parsed first, then matched against a preloaded in-memory index of
+existing patients (email, then phone, then name + DOB - the same precedence as the old
+per-file lookups). New patients, renewals and their activity rows are then written with
+bulk queries inside a single transaction.
+
+Large uploads run as an ImportJob: the request only stages the files in IMPORT_UPLOAD_DIR
+and a Celery task imports them in chunks, recording one ImportJobRow per file.
+"""
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from .forms import PatientForm
+from .models import ImportJobRow, Patient, clean_phone_number, plan_change_description, write_audit_records
+
+logger = logging.getLogger(__name__)
+
+# Patient columns needed to match import records against existing patients
+MATCH_COLUMNS = ('pk', 'email', 'phone', 'first_name', 'last_name', 'dob')
+
+
+class ImportResult:
+    def __init__(self):
+        self.success_count = 0
+        self.error_count = 0
+        self.duplicate_count = 0
+        self.errors = []
+        self.duplicates = []
+        # Per-file outcomes: (position, file name, outcome, reason, patient)
+        self.rows = []
+
+    def add_row(self, position, name, outcome, reason='', patient=None):
+        self.rows.append((position, name, outcome, reason, patient))
+
+    def add_error(self, position, name, reason):
+        self.error_count += 1
+        self.errors.append(f"{name}: {reason}")
+        self.add_row(position, name, 'error', reason)
+
+
+class _ImportMatchIndex:
+    """Existing (pk) and not-yet-saved (Patient instance) import targets by match key."""
+
+    def __init__(self):
+        self.by_email = {}
+        self.by_phone = {}
+        self.by_name_dob = {}
+
+    def add(self, target, email, phone, first_name, last_name, dob):
+        # setdefault keeps the lowest pk / earliest file, as .first() did
+        if email:
+            self.by_email.setdefault(email, target)
+        if phone:
+            self.by_phone.setdefault(phone, target)
+        if first_name and last_name and dob:
+            self.by_name_dob.setdefault((first_name.lower(), last_name.lower(), dob), target)
+
+    def match(self, email, phone, first_name, last_name, dob):
+        if email and email in self.by_email:
+            return self.by_email[email]
+        if phone and phone in self.by_phone:
+            return self.by_phone[phone]
+        # Fallback: Check for Name + DOB if no email/phone match found
+        if first_name and last_name and dob:
+            return self.by_name_dob.get((first_name.lower(), last_name.lower(), dob))
+        return None
+
+
+def parse_patient_file(file):
+    """
+    Parses the uploaded text file and returns a dictionary of patient data.
+    """
+    data = {}
+    content = file.read().decode('utf-8')
+    lines = content.splitlines()
+
+    # Mapping from file keys to model fields
+    field_map = {
+        'patient': 'first_name',
+        'middle_name': 'middle_name',
+        'last_name': 'last_name',
+        'dob': 'dob',
+        'PatientPhone': 'phone',
+        'PatientEmail': 'email',
+        'PUT_Address': 'address',
+        'PUT_City': 'city',
+        'PUT_State': 'state',
+        'PUT_ZipCode': 'zip_code',
+        'PUT_TodaysDate': 'enrollment_date',
+        # 'Result': 'payment_amount', # Removed as we use payment_method now
+    }
+    
+    membership_plan = None
+    payment_method = None
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+            
+        # Try to match key-value pair pattern: TYPE^KEY VALUE or just remaining text
+        parts = line.split(' ', 1)
+        if len(parts) < 2:
+            continue
+            
+        key_part = parts[0]
+        value = parts[1].strip()
+        
+        if '^' in key_part:
+            _, key = key_part.split('^', 1)
+        else:
+            continue # Skip lines that don't match format
+
+        # Handle specific fields
+        if key in field_map:
+            model_field = field_map[key]
+            
+            # Date conversion
+            if model_field in ['dob', 'enrollment_date']:
+                try:
+                    date_obj = datetime.strptime(value, '%m/%d/%Y')
+                    value = date_obj.strftime('%Y-%m-%d')
+                except ValueError:
+                    pass # Keep original string or handle error
+            
+            data[model_field] = value
+        
+        # Handle Radio Buttons
+        if key_part.startswith('RB^') and value == 'True':
+            # Membership Plan: e.g. PUT_BronzePlan_SFYS -> Bronze
+            if 'Plan_SFYS' in key:
+                plan_name = key.replace('PUT_', '').replace('Plan_SFYS', '').replace('_', ' ')
+                # Ensure it matches choices if possible, capitalize
+                membership_plan = plan_name.capitalize()
+            
+            # Payment Method: e.g. PUT_CreditCard_SFYS -> Credit Card
+            if 'CreditCard' in key:
+                payment_method = 'Credit Card'
+            elif 'Cash' in key: # Assuming PUT_Cash_SFYS
+                payment_method = 'Cash'
+
+    if membership_plan:
+        data['membership_plan'] = membership_plan
+        data['patient_type'] = 'Proceed'
+    else:
+        # Default Regular if no plan found
+        data['patient_type'] = 'Regular'
+        # Ensure membership_plan is not set to avoid validation errors if model enforced choices strictly (it allows blank though)
+
+    if payment_method:
+        data['payment_method'] = payment_method
+        
+    return data
+
+
+def parse_pasted_patient_data(text):
+    """
+    Parses pasted text content in specific User-provided format (Key:Value)
+    Supports both line-separated and comma-separated formats.
+    """
+    data = {}
+    
+    # Normalize separators: if many commas and few newlines, likely comma-separated export
+    if ',' in text and (text.count(',') > text.count('\n')):
+        # Split by comma, but be wary of commas in values (less likely in this specific export)
+        items = text.replace('\n', ',').split(',')
+    else:
+        items = text.splitlines()
+
+    membership_plan = None
+    payment_method = None
+    
+    for item in items:
+        if ':' not in item:
+            continue
+            
+        key, value = item.split(':', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        
+        if not value or value.lower() in ['none', 'null', '']:
+            continue
+            
+        # Full Name (Old format)
+        if key == 'name':
+            parts = value.split()
+            if len(parts) >= 2:
+                data['first_name'] = parts[0]
+                data['last_name'] = " ".join(parts[1:])
+            else:
+                data['first_name'] = value
+                data['last_name'] = ""
+        
+        # Split Name (New format)
+        elif key == 'first_name':
+            data['first_name'] = value
+        elif key == 'last_name':
+            data['last_name'] = value
+        elif key == 'middle_name':
+            data['middle_name'] = value
+            
+        # Email
+        elif key in ['email', 'email address']:
+            data['email'] = value
+            
+        # Phone
+        elif key in ['phone', 'phone number', 'mobile_number', 'mobile phone', 'mobile']:
+            data['phone'] = value
+            
+        # DOB
+        elif key in ['dob', 'date of birth', 'birth date', 'date_of_birth']:
+            # Handle multiple date formats
+            date_formats = ['%Y-%m-%d', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%Y']
+            for fmt in date_formats:
+                try:
+                    date_obj = datetime.strptime(value, fmt)
+                    data['dob'] = date_obj.strftime('%Y-%m-%d')
+                    break
+                except ValueError:
+                    continue
+        
+        # New Fields (Gender, Notes)
+        elif key == 'gender':
+            # Normalize to choices: Male, Female, Other
+            val_lower = value.lower()
+            if val_lower.startswith('f'): data['gender'] = 'Female'
+            elif val_lower.startswith('m'): data['gender'] = 'Male'
+            else: data['gender'] = 'Other'
+        elif key == 'notes':
+            data['notes'] = value
+                
+        # Address Fields
+        elif key == 'address':
+            data['address'] = value
+        elif key == 'city':
+            data['city'] = value
+        elif key == 'state':
+            data['state'] = value
+        elif key == 'zip code':
+            data['zip_code'] = value
+        
+        # Enrollment Date
+        elif key == 'todays date':
+            try:
+                date_obj = datetime.strptime(value, '%m/%d/%Y')
+                data['enrollment_date'] = date_obj.strftime('%Y-%m-%d')
+            except ValueError:
+                pass
+
+        # Membership and Payment checks (value is 'Yes' - old format)
+        elif str(value).lower() == 'yes':
+             if 'bronze plan' in key:
+                 membership_plan = 'Bronze'
+             elif 'silver plan' in key:
+                 membership_plan = 'Silver'
+             elif 'gold plan' in key:
+                 membership_plan = 'Gold'
+             elif 'cash' in key:
+                 payment_method = 'Cash'
+             elif 'credit' in key:
+                 payment_method = 'Credit Card'
+                 
+    if membership_plan:
+        data['membership_plan'] = membership_plan
+        data['patient_type'] = 'Proceed'
+    else:
+        # Default Regular if no plan found but allow logic to proceed
+        if 'patient_type' not in data:
+            data['patient_type'] = 'Regular'
+
+    if payment_method:
+        data['payment_method'] = payment_method
+        
+    return data
+
+
+def _to_date(value):
+    """Parse a YYYY-MM-DD string the way the DateField does (raising ValidationError)."""
+    return Patient._meta.get_field('dob').to_python(value) if value else None
+
+
+def _match_keys(patient_data):
+    try:
+        dob = _to_date(patient_data.get('dob'))
+    except ValidationError:
+        # Unparseable DOBs cannot match; PatientForm reports them for new patients
+        dob = None
+    return (
+        patient_data.get('email'),
+        clean_phone_number(patient_data.get('phone', '')),
+        patient_data.get('first_name'),
+        patient_data.get('last_name'),
+        dob,
+    )
+
+
+def import_patient_files(files, parse):
+    """
+    Import uploaded patient files (`parse(file)` -> dict of Patient fields).
+    Errors and duplicates are reported per file exactly as the one-file-at-a-time import did.
+    """
+    result = ImportResult()
+
+    # 1. Parse everything up front
+    parsed = []
+    for position, file in enumerate(files):
+        try:
+            parsed.append((position, file.name, parse(file)))
+        except Exception as e:
+            result.add_error(position, file.name, str(e))
+
+    # 2. Preload the match index and the existing patients the files can match
+    index = _ImportMatchIndex()
+    for pk, email, phone, first_name, last_name, dob in (
+        Patient.objects.order_by('pk').values_list(*MATCH_COLUMNS).iterator(chunk_size=5000)
+    ):
+        index.add(pk, email, phone, first_name, last_name, dob)
+
+    records = []
+    matched_pks = set()
+    for position, name, patient_data in parsed:
+        keys = _match_keys(patient_data)
+        records.append((position, name, patient_data, keys))
+        target = index.match(*keys)
+        if target is not None:
+            matched_pks.add(target)
+    existing = Patient.objects.in_bulk(matched_pks)
+
+    # 3. Resolve every record in file order
+    new_patients = []
+    renewed = {}
+    audit_records = []
+    update_fields = set()
+
+    for position, name, patient_data, keys in records:
+        email = keys[0]
+        try:
+            target = index.match(*keys)
+            if isinstance(target, int):
+                target = existing[target]
+
+            if target is not None:
+                display_name = f"{target.first_name} {target.last_name}"
+                update_desc = plan_change_description(target.membership_plan, patient_data.get('membership_plan'))
+                # Convert existing date for comparison if it's a date object
+                existing_enrollment_date = str(target.enrollment_date) if target.enrollment_date else None
+                new_enrollment_date = patient_data.get('enrollment_date')
+
+                # If enrollment date is different, update the patient (Renewal/Update)
+                if new_enrollment_date and new_enrollment_date != existing_enrollment_date:
+                    values = dict(patient_data)
+                    for date_field in ('dob', 'enrollment_date'):
+                        if date_field in values:
+                            values[date_field] = _to_date(values[date_field])
+                    if 'phone' in values:
+                        values['phone'] = clean_phone_number(values['phone'])
+
+                    for key, val in values.items():
+                        setattr(target, key, val)
+                    # Log update activity (written in bulk below)
+                    audit_records.extend(target.pop_audit_records(
+                        note=f"Patient automatically updated during import. New Enrollment Date: {new_enrollment_date}",
+                    ))
+                    if target.pk:
+                        renewed[target.pk] = target
+                        update_fields.update(values)
+                    index.add(target, target.email, target.phone, target.first_name, target.last_name, target.dob)
+                    result.success_count += 1
+                    result.add_row(position, name, 'updated', update_desc, target)
+                else:
+                    # Truly a duplicate (same enrollment date or no new date)
+                    result.duplicate_count += 1
+                    result.duplicates.append(f"<strong>{display_name}</strong> - Email: {email or 'N/A'}")
+                    result.add_row(position, name, 'duplicate', f"Matches {display_name} (same enrollment date)", target)
+                continue
+
+            # Create a form with the parsed data to validate it
+            patient_form = PatientForm(data=patient_data)
+            if patient_form.is_valid():
+                new_patient = patient_form.save(commit=False)
+                new_patient.phone = clean_phone_number(new_patient.phone)
+                new_patients.append(new_patient)
+                audit_records.extend(new_patient.pop_audit_records(note=f"Patient imported via file: {name}"))
+                index.add(
+                    new_patient, new_patient.email, new_patient.phone,
+                    new_patient.first_name, new_patient.last_name, new_patient.dob,
+                )
+                result.success_count += 1
+                result.add_row(position, name, 'created', '', new_patient)
+            else:
+                # Collect formatted errors
+                err_msg = []
+                for field, error_list in patient_form.errors.items():
+                    err_msg.append(f"{field}: {', '.join(error_list)}")
+                result.add_error(position, name, '; '.join(err_msg))
+        except Exception as e:
+            result.add_error(position, name, str(e))
+
+    # 4. Write everything in one transaction
+    with transaction.atomic():
+        if new_patients:
+            Patient.objects.bulk_create(new_patients)
+        if renewed:
+            now = timezone.now()
+            for patient in renewed.values():
+                patient.updated_at = now
+            Patient.objects.bulk_update(list(renewed.values()), sorted(update_fields | {'updated_at'}))
+        write_audit_records(audit_records)
+
+    result.rows.sort(key=lambda row: row[0])
+    return result
+
+
+def import_storage():
+    return FileSystemStorage(location=settings.IMPORT_UPLOAD_DIR)
+
+
+def stage_import_files(job, uploaded_files):
+    """Copy the request's uploaded files to shared storage for the import task."""
+    storage = import_storage()
+    staged = []
+    for position, upload in enumerate(uploaded_files):
+        path = storage.save(f"{job.pk}/{position:05d}.txt", upload)
+        staged.append({'path': path, 'name': upload.name})
+    job.files = staged
+    job.total = len(staged)
+    job.save(update_fields=['files', 'total'])
+
+
+class StagedFile:
+    """A staged upload, readable by parse_patient_file() under its original name."""
+
+    def __init__(self, storage, path, name):
+        self.storage = storage
+        self.path = path
+        self.name = name
+
+    def read(self):
+        with self.storage.open(self.path, 'rb') as fh:
+            return fh.read()
+
+
+def run_import_job(job, chunk_size=None):
+    """Import a job's staged files chunk by chunk, recording progress and per-file rows."""
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    storage = import_storage()
+
+    job.status = 'Running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    try:
+        for start in range(0, len(job.files), chunk_size):
+            chunk = [StagedFile(storage, f['path'], f['name']) for f in job.files[start:start + chunk_size]]
+            # Each chunk commits on its own, so later chunks match patients created by earlier ones
+            result = import_patient_files(chunk, parse_patient_file)
+
+            rows = [
+                ImportJobRow(
+                    job=job,
+                    position=start + position,
+                    file_name=name[:255],
+                    outcome=outcome,
+                    reason=reason,
+                    patient=patient if patient is not None and patient.pk else None,
+                )
+                for position, name, outcome, reason, patient in result.rows
+            ]
+            ImportJobRow.objects.bulk_create(rows)
+
+            job.processed += len(chunk)
+            job.duplicates += result.duplicate_count
+            job.errors += result.error_count
+            job.created += sum(1 for row in rows if row.outcome == 'created')
+            job.updated += sum(1 for row in rows if row.outcome == 'updated')
+            job.save(update_fields=['processed', 'created', 'updated', 'duplicates', 'errors'])
+
+        job.status = 'Completed'
+        job.message = (
+            f"Imported {job.created + job.updated} patient(s): {job.created} created, {job.updated} updated, "
+            f"{job.duplicates} duplicate(s), {job.errors} error(s)."
+        )
+    except Exception as e:
+        # Keep the staged uploads so the failure can be inspected and the files re-imported
+        logger.exception("Import job %s failed; staged files kept in %s", job.pk, storage.path(str(job.pk)))
+        job.status = 'Failed'
+        job.message = f"{e} (staged files of job #{job.pk} kept for inspection)"
+    else:
+        for staged in job.files:
+            storage.delete(staged['path'])
+
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def fail_unqueued_import_job(job):
+    """Mark a job whose task could not be queued as Failed and drop its staged files."""
+    storage = import_storage()
+    for staged in job.files:
+        storage.delete(staged['path'])
+    job.status = 'Failed'
+    job.message = "The import could not be queued (task queue unavailable). Please upload the files again."
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'message', 'finished_at'])
+    return job
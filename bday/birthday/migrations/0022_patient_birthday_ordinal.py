@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:46
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractDay, ExtractMonth
+
+
+def backfill_birthday_ordinal(apps, schema_editor):
+    Patient = apps.get_model('birthday', 'Patient')
+    Patient.objects.update(birthday_ordinal=ExtractMonth('dob') * 100 + ExtractDay('dob'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0021_alter_communicationlog_patient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='birthday_ordinal',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='communicationlog',
+            name='gateway_number',
+            field=models.CharField(blank=True, help_text='SignalWire number used for this SMS', max_length=30, null=True),
+        ),
+        migrations.RunPython(backfill_birthday_ordinal, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0022_patient_birthday_ordinal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='communicationlog',
+            index=models.Index(fields=['channel', 'created_at'], name='cl_channel_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientstatus',
+            index=models.Index(fields=['patient', 'activity_type', 'created_at'], name='ps_patient_act_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientstatus',
+            index=models.Index(condition=models.Q(('activity_type__in', ['Email Sent', 'SMS Sent'])), fields=['patient', 'created_at'], name='ps_outreach_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledwish',
+            index=models.Index(fields=['patient', 'status'], name='sw_patient_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledwish',
+            index=models.Index(fields=['status', 'scheduled_for'], name='sw_status_sched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledwish',
+            index=models.Index(condition=models.Q(('status', 'Pending')), fields=['scheduled_for'], name='sw_pending_sched_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0023_outreach_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledwish',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledwish',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='scheduledwish',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Processing', 'Processing'), ('Sent', 'Sent'), ('Failed', 'Failed')], default='Pending', max_length=20),
+        ),
+    ]
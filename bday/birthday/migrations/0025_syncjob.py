@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0024_scheduledwish_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('practices', 'Sync Practices'), ('practice_patients', 'Sync Practice Patients'), ('bulk_sync', 'Import Selected Patients')], max_length=30)),
+                ('client_id', models.CharField(blank=True, default='', max_length=50)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('payload', models.JSONField(blank=True, default=list)),
+                ('fetched', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('errors', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True, default='')),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('practice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='birthday.practice')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
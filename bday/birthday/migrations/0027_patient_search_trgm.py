@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Must match birthday.search.PatientSearchDocument
+SEARCH_DOCUMENT = (
+    "lower(first_name || ' ' || last_name || ' ' || email || ' ' || COALESCE(city, '') || ' ' || phone)"
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    # pg_trgm GIN indexes only exist on PostgreSQL; other backends keep the icontains search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS patient_search_trgm '
+        f'ON birthday_patient USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS patient_phone_trgm '
+        'ON birthday_patient USING gin (phone gin_trgm_ops)'
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS patient_search_trgm')
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS patient_phone_trgm')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('birthday', '0026_importjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
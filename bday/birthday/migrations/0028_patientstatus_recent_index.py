@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0027_patient_search_trgm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patientstatus',
+            index=models.Index(fields=['patient', '-created_at'], name='ps_patient_recent_idx'),
+        ),
+    ]
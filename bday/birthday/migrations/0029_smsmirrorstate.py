@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0028_patientstatus_recent_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsMirrorState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway_number', models.CharField(max_length=30, unique=True)),
+                ('high_water_mark', models.DateTimeField(blank=True, help_text='Newest message date mirrored so far', null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('messages_created', models.PositiveIntegerField(default=0, help_text='Rows added by the last run')),
+                ('messages_updated', models.PositiveIntegerField(default=0, help_text='Statuses refreshed by the last run')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='communicationlog',
+            index=models.Index(fields=['external_message_id'], name='cl_external_id_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:20
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def _to_e164(number):
+    # Frozen copy of birthday.models.to_e164
+    if not number:
+        return ''
+    raw = str(number).strip()
+    digits = ''.join(ch for ch in raw if ch.isdigit())
+    if len(digits) == 10:
+        return f'+1{digits}'
+    if len(digits) == 11 and digits.startswith('1'):
+        return f'+{digits}'
+    return raw if raw.startswith('+') else f'+{digits}' if digits else raw
+
+
+def _backfill(queryset, source, target):
+    batch = []
+    for obj in queryset.only('pk', source).iterator(chunk_size=BATCH_SIZE):
+        setattr(obj, target, _to_e164(getattr(obj, source)))
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            queryset.model.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        queryset.model.objects.bulk_update(batch, [target])
+
+
+def backfill_phone_e164(apps, schema_editor):
+    Patient = apps.get_model('birthday', 'Patient')
+    CommunicationLog = apps.get_model('birthday', 'CommunicationLog')
+    _backfill(Patient.objects.exclude(phone=''), 'phone', 'phone_e164')
+    _backfill(CommunicationLog.objects.filter(channel='SMS').exclude(recipient=''), 'recipient', 'counterparty_e164')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0029_smsmirrorstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communicationlog',
+            name='counterparty_e164',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='communicationlog',
+            index=models.Index(fields=['counterparty_e164', 'created_at'], name='cl_counterparty_created_idx'),
+        ),
+        migrations.RunPython(backfill_phone_e164, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_sms_threads(apps, schema_editor):
+    # One pass over the SMS log in time order; existing history counts as read
+    CommunicationLog = apps.get_model('birthday', 'CommunicationLog')
+    SmsThread = apps.get_model('birthday', 'SmsThread')
+    threads = {}
+    logs = (
+        CommunicationLog.objects.filter(channel='SMS').exclude(counterparty_e164='')
+        .only('patient_id', 'direction', 'body', 'counterparty_e164', 'created_at')
+        .order_by('created_at', 'pk')
+    )
+    for log in logs.iterator(chunk_size=2000):
+        thread = threads.get(log.counterparty_e164)
+        if thread is None:
+            thread = threads[log.counterparty_e164] = SmsThread(phone_e164=log.counterparty_e164)
+        body = log.body or ''
+        thread.message_count += 1
+        thread.last_message_at = log.created_at
+        thread.last_preview = body[:90] + ('...' if len(body) > 90 else '')
+        thread.last_direction = log.direction
+        if log.patient_id:
+            thread.patient_id = log.patient_id
+    SmsThread.objects.bulk_create(threads.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0030_phone_e164'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='communicationlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SmsThread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_e164', models.CharField(max_length=20, unique=True)),
+                ('last_message_at', models.DateTimeField()),
+                ('last_preview', models.CharField(blank=True, default='', max_length=100)),
+                ('last_direction', models.CharField(blank=True, choices=[('Outbound', 'Outbound'), ('Inbound', 'Inbound')], default='', max_length=20)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('unread_count', models.PositiveIntegerField(default=0, help_text='Inbound messages since the thread was last opened')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_threads', to='birthday.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-last_message_at', '-id'], name='smsthread_recent_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_sms_threads, migrations.RunPython.noop),
+    ]
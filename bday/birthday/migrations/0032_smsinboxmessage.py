@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0031_smsthread'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsInboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0032_smsinboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smsinboxmessage',
+            name='kind',
+            field=models.CharField(choices=[('message', 'Inbound message'), ('status', 'Delivery receipt')], default='message', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='communicationlog',
+            name='status',
+            field=models.CharField(choices=[('Sent', 'Sent'), ('Failed', 'Failed'), ('Pending', 'Pending'), ('Queued', 'Queued'), ('Delivered', 'Delivered'), ('Undelivered', 'Undelivered')], default='Pending', max_length=20),
+        ),
+    ]
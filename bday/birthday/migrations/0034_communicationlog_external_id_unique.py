@@ -0,0 +1,50 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:37
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def remove_duplicate_messages(apps, schema_editor):
+    # Keep the first row per SID and take the extra rows back out of their threads
+    CommunicationLog = apps.get_model('birthday', 'CommunicationLog')
+    SmsThread = apps.get_model('birthday', 'SmsThread')
+    duplicated = (
+        CommunicationLog.objects.exclude(external_message_id__isnull=True).exclude(external_message_id='')
+        .order_by().values('external_message_id').annotate(rows=Count('pk')).filter(rows__gt=1)
+        .values_list('external_message_id', flat=True)
+    )
+    kept, extra = set(), []
+    logs = (
+        CommunicationLog.objects.filter(external_message_id__in=list(duplicated))
+        .only('pk', 'channel', 'external_message_id', 'counterparty_e164').order_by('pk')
+    )
+    for log in logs:
+        if log.external_message_id in kept:
+            extra.append(log)
+        kept.add(log.external_message_id)
+    removed = {}
+    for log in extra:
+        if log.channel == 'SMS' and log.counterparty_e164:
+            removed[log.counterparty_e164] = removed.get(log.counterparty_e164, 0) + 1
+    CommunicationLog.objects.filter(pk__in=[log.pk for log in extra]).delete()
+    for phone, count in removed.items():
+        SmsThread.objects.filter(phone_e164=phone, message_count__gte=count).update(message_count=F('message_count') - count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0033_sms_delivery_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_messages, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='communicationlog',
+            name='cl_external_id_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='communicationlog',
+            constraint=models.UniqueConstraint(condition=models.Q(('external_message_id__isnull', False), models.Q(('external_message_id', ''), _negated=True)), fields=('external_message_id',), name='cl_external_id_unique'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('birthday', '0034_communicationlog_external_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='smsmirrorstate',
+            name='backfill_after',
+            field=models.DateTimeField(blank=True, help_text='Lower bound of the backfill (empty: the whole history)', null=True),
+        ),
+        migrations.AddField(
+            model_name='smsmirrorstate',
+            name='backfill_before',
+            field=models.DateTimeField(blank=True, help_text='Older messages still to mirror: those sent before this date', null=True),
+        ),
+    ]
@@ -1,4 +1,11 @@
-from django.db import models
+import calendar
+from datetime import date, timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import DEFERRED, Case, F, Q, Value, When
+from django.db.models.functions import ExtractDay, ExtractMonth
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 def clean_phone_number(phone):
     """Standardize phone number to 10 digits."""
@@ -11,6 +18,214 @@ def clean_phone_number(phone):
         cleaned = cleaned[1:]
     return cleaned[:10]
 
+
+def to_e164(number):
+    """Normalize phone numbers to E.164 format (+1XXXXXXXXXX)."""
+    if not number:
+        return ''
+    raw = str(number).strip()
+    digits = ''.join(ch for ch in raw if ch.isdigit())
+    if len(digits) == 10:
+        return f'+1{digits}'
+    if len(digits) == 11 and digits.startswith('1'):
+        return f'+{digits}'
+    return raw if raw.startswith('+') else f'+{digits}' if digits else raw
+
+
+def birthday_ordinal(dob):
+    """Encode a date of birth as month*100+day (e.g. Feb 29 -> 229)."""
+    if not dob:
+        return None
+    if isinstance(dob, str):
+        dob = date.fromisoformat(dob)
+    return dob.month * 100 + dob.day
+
+def birthday_for_year(dob, year):
+    """Birthday in the given year; Feb 29 falls back to Mar 1 in non-leap years."""
+    try:
+        return date(year, dob.month, dob.day)
+    except ValueError:  # Leap year Feb 29
+        return date(year, 3, 1)
+
+def _effective_ordinal(year):
+    """Ordinal expression with Feb 29 shifted to Mar 1 when `year` is not a leap year."""
+    if calendar.isleap(year):
+        return F('birthday_ordinal')
+    return Case(
+        When(birthday_ordinal=229, then=Value(301)),
+        default=F('birthday_ordinal'),
+        output_field=models.IntegerField(),
+    )
+
+def _ordinal_range_q(year, low, high):
+    """Match birthdays falling between two ordinals (inclusive) of the given year."""
+    q = Q(birthday_ordinal__gte=low, birthday_ordinal__lte=high)
+    if not calendar.isleap(year):
+        if low <= 301 <= high:
+            q |= Q(birthday_ordinal=229)
+        else:
+            q &= ~Q(birthday_ordinal=229)
+    return q
+
+
+PLAN_RANKS = {'Bronze': 1, 'Silver': 2, 'Gold': 3}
+PLAN_FIELDS = ('membership_plan', 'enrollment_date')
+# Bookkeeping columns that never warrant a 'Details Updated' activity
+UNAUDITED_FIELDS = ('birthday_ordinal', 'phone_e164', 'created_at', 'updated_at')
+
+def plan_change_description(old_plan, new_plan):
+    # Determine if plan was upgraded, downgraded or renewed
+    old_rank = PLAN_RANKS.get(old_plan, 0)
+    new_rank = PLAN_RANKS.get(new_plan, 0)
+    if new_rank > old_rank:
+        return f"Plan upgraded from {old_plan} to {new_plan}"
+    if new_rank < old_rank:
+        return f"Plan downgraded from {old_plan} to {new_plan}"
+    return f"Plan renewed to {new_plan}"
+
+def write_audit_records(records):
+    """Insert the rows returned by Patient.audit_records() with one query per model."""
+    by_model = {}
+    for record in records:
+        by_model.setdefault(type(record), []).append(record)
+    for model, objs in by_model.items():
+        model.objects.bulk_create(objs)
+
+
+def current_plan_duration_days():
+    """PracticeSettings.plan_duration_days, without creating the settings row on read."""
+    return PracticeSettings.objects.values_list('plan_duration_days', flat=True).first() or 365
+
+
+def plan_status_label(is_expired, days_left, overdue_days):
+    if is_expired:
+        # expired for less than 30 days
+        return 'Just Expired' if overdue_days <= 30 else 'Expired'
+    return 'Expiring Soon' if days_left <= 30 else 'Active'
+
+
+class DaysSince(models.Func):
+    """Whole days from a date column to a fixed date (`today - expression`), as an integer."""
+    output_field = models.IntegerField()
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+
+    def __init__(self, expression, today):
+        super().__init__(Value(today, output_field=models.DateField()), expression)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)', arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+
+def _invalidate_birthday_popup():
+    # bulk_create()/bulk_update() bypass the model signals in birthday.signals
+    from .context_processors import invalidate_birthday_popup
+    transaction.on_commit(invalidate_birthday_popup)
+
+
+class PatientQuerySet(models.QuerySet):
+    def upcoming_birthdays(self, today=None):
+        """
+        Order patients by their next birthday (today first), entirely in SQL.
+        Slice the result for the next N birthdays.
+        """
+        today = today or date.today()
+        today_ordinal = birthday_ordinal(today)
+        return self.annotate(
+            _ordinal_this_year=_effective_ordinal(today.year),
+            _ordinal_next_year=_effective_ordinal(today.year + 1),
+        ).annotate(
+            birthday_sort_key=Case(
+                When(_ordinal_this_year__gte=today_ordinal, then=F('_ordinal_this_year')),
+                default=F('_ordinal_next_year') + Value(10000),
+                output_field=models.IntegerField(),
+            )
+        ).order_by('birthday_sort_key', 'first_name', 'last_name')
+
+    def birthdays_between(self, start_date, end_date):
+        """Patients whose birthday falls within [start_date, end_date] (at most one year apart)."""
+        start_ordinal = birthday_ordinal(start_date)
+        end_ordinal = birthday_ordinal(end_date)
+        if start_date.year == end_date.year:
+            q = _ordinal_range_q(start_date.year, start_ordinal, end_ordinal)
+        else:
+            # Window crosses the year boundary: tail of the start year + head of the end year
+            q = (_ordinal_range_q(start_date.year, start_ordinal, 1231) |
+                 _ordinal_range_q(end_date.year, 101, end_ordinal))
+        return self.filter(q)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.birthday_ordinal = birthday_ordinal(obj.dob)
+            obj.phone_e164 = to_e164(obj.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields:
+            # Upserts refresh the derived columns along with their sources, as save() does
+            derived = {'dob': 'birthday_ordinal', 'phone': 'phone_e164'}
+            kwargs['update_fields'] = list(update_fields) + [
+                derived[f] for f in update_fields if f in derived and derived[f] not in update_fields
+            ]
+        created = super().bulk_create(objs, *args, **kwargs)
+        _invalidate_birthday_popup()
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'dob' in fields:
+            for obj in objs:
+                obj.birthday_ordinal = birthday_ordinal(obj.dob)
+            fields = list(fields) + ['birthday_ordinal']
+        if 'phone' in fields:
+            for obj in objs:
+                obj.phone_e164 = to_e164(obj.phone)
+            fields = list(fields) + ['phone_e164']
+        updated = super().bulk_update(objs, fields, *args, **kwargs)
+        if {'dob', 'first_name', 'last_name'} & set(fields):
+            _invalidate_birthday_popup()
+        return updated
+
+    def with_plan_status(self, today=None, duration_days=None):
+        """
+        Annotate the plan_progress numbers in SQL: plan_elapsed_days, plan_days_left,
+        plan_is_expired and plan_status_label ('No Plan', 'Active', 'Expiring Soon',
+        'Just Expired', 'Expired'), using PracticeSettings.plan_duration_days.
+        """
+        today = today or date.today()
+        duration = duration_days or current_plan_duration_days()
+        # Enrollment dates before this are expired (elapsed > duration)
+        expired_before = today - timedelta(days=duration)
+        return self.annotate(
+            plan_duration_days=Value(duration, output_field=models.IntegerField()),
+            plan_elapsed_days=DaysSince('enrollment_date', today),
+            plan_days_left=Case(
+                When(enrollment_date__isnull=True, then=Value(0)),
+                When(enrollment_date__lt=expired_before, then=Value(0)),
+                default=Value(duration) - F('plan_elapsed_days'),
+                output_field=models.IntegerField(),
+            ),
+            plan_is_expired=Case(
+                When(enrollment_date__lt=expired_before, then=Value(True)),
+                default=Value(False),
+                output_field=models.BooleanField(),
+            ),
+            plan_status_label=Case(
+                When(enrollment_date__isnull=True, then=Value('No Plan')),
+                When(enrollment_date__lt=expired_before - timedelta(days=30), then=Value('Expired')),
+                When(enrollment_date__lt=expired_before, then=Value('Just Expired')),
+                When(enrollment_date__lte=expired_before + timedelta(days=30), then=Value('Expiring Soon')),
+                default=Value('Active'),
+                output_field=models.CharField(),
+            ),
+        )
+
+    def sync_birthday_ordinals(self):
+        """Recompute the stored ordinal in SQL (for rows written via update())."""
+        return self.update(birthday_ordinal=ExtractMonth('dob') * 100 + ExtractDay('dob'))
+
+
 class Practice(models.Model):
     external_id = models.IntegerField(unique=True, verbose_name="SMO Practice ID")
     client_id = models.CharField(max_length=50, default="1", verbose_name="SMO Client ID")
@@ -30,7 +245,11 @@ class Patient(models.Model):
     middle_name = models.CharField(max_length=100, blank=True, null=True, verbose_name="Middle Name")
     last_name = models.CharField(max_length=100, verbose_name="Last Name")
     dob = models.DateField(verbose_name="Date of Birth")
+    # month*100+day of dob, kept in sync on save so birthday lookups can use an index
+    birthday_ordinal = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
     phone = models.CharField(max_length=20, verbose_name="Phone Number")
+    # Kept in sync with phone on save()/bulk writes; exact-match key for SMS lookups
+    phone_e164 = models.CharField(max_length=20, blank=True, default='', db_index=True, editable=False)
     email = models.EmailField(verbose_name="Email Address")
     address = models.TextField(blank=True, null=True, verbose_name="Street Address")
     city = models.CharField(max_length=100, blank=True, null=True, verbose_name="City")
@@ -79,10 +298,14 @@ class Patient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @property
+    objects = PatientQuerySet.as_manager()
+
+    @cached_property
     def plan_progress(self):
-        """Calculate the progress of the 1-year plan with descriptive labels."""
-        from datetime import date
+        """
+        Progress of the membership plan with descriptive labels, computed once per instance.
+        Uses the plan length annotated by PatientQuerySet.with_plan_status() when present.
+        """
         if not self.enrollment_date:
             return {
                 'percentage': 0, 
@@ -91,97 +314,148 @@ class Patient(models.Model):
                 'status': 'secondary',
                 'label': 'No Plan'
             }
-        
-        today = date.today()
-        elapsed = (today - self.enrollment_date).days
-        total_days = 365
-        
+
+        total_days = self.__dict__.get('plan_duration_days') or current_plan_duration_days()
+        elapsed = (date.today() - self.enrollment_date).days
+
         percentage = min(max(int((elapsed / total_days) * 100), 0), 100)
         is_expired = elapsed > total_days
         days_left = max(total_days - elapsed, 0)
-        
-        from datetime import timedelta
-        expiry_date = self.enrollment_date + timedelta(days=365)
-        
-        # Determine status, color and label
-        if is_expired:
-            status = 'danger'
-            # expired for less than 30 days
-            if (elapsed - total_days) <= 30:
-                label = 'Just Expired'
-            else:
-                label = 'Expired'
-        elif days_left <= 30:
-            status = 'warning'
-            label = 'Expiring Soon'
-        else:
-            status = 'success'
-            label = 'Active'
-            
+        overdue_days = max(elapsed - total_days, 0)
+
         return {
             'percentage': percentage,
             'is_expired': is_expired,
             'days_left': days_left,
-            'status': status,
-            'label': label,
+            'status': 'danger' if is_expired else 'warning' if days_left <= 30 else 'success',
+            'label': plan_status_label(is_expired, days_left, overdue_days),
             'elapsed_days': elapsed,
-            'overdue_days': max(elapsed - total_days, 0),
-            'expiry_date': expiry_date
+            'overdue_days': overdue_days,
+            'expiry_date': self.enrollment_date + timedelta(days=total_days)
         }
 
-    def save(self, *args, **kwargs):
-        # Standardize phone
-        if self.phone:
-            self.phone = clean_phone_number(self.phone)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
 
-        # Track state before save
-        is_new = self.pk is None
-        old_instance = None
-        if not is_new:
-            try:
-                old_instance = Patient.objects.get(pk=self.pk)
-            except Patient.DoesNotExist:
-                pass
-        
-        # Save record
-        super().save(*args, **kwargs)
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is not None:
+            concrete = {f.name for f in self._meta.concrete_fields} | {f.attname for f in self._meta.concrete_fields}
+            fields = [name for name in fields if name in concrete]
+        self._remember_loaded_values(fields)
 
-        # Log initial creation
-        if is_new:
-            PatientStatus.objects.create(
-                patient=self,
-                activity_type='Added',
-                description="Patient registered in directory"
-            )
+    def _remember_loaded_values(self, fields=None):
+        """Snapshot field values as stored, so changes are detected without re-fetching the row."""
+        if fields is None or not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+            attnames = [f.attname for f in self._meta.concrete_fields]
+        else:
+            attnames = [self._meta.get_field(name).attname for name in fields]
+        for attname in attnames:
+            value = self.__dict__.get(attname, DEFERRED)
+            if value is not DEFERRED:
+                self._loaded_values[attname] = value
+
+    def changed_fields(self, fields=None):
+        """Attnames changed since the instance was loaded or last saved (all of them if it never was)."""
+        if fields is None:
+            attnames = [f.attname for f in self._meta.concrete_fields]
+        else:
+            attnames = [self._meta.get_field(name).attname for name in fields]
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set(attnames)
+        return {
+            attname for attname in attnames
+            if attname in self.__dict__ and (attname not in loaded or loaded[attname] != self.__dict__[attname])
+        }
+
+    def audit_records(self, note=None, fields=None):
+        """
+        Unsaved PatientStatus/PlanHistory rows describing this instance's pending changes.
+
+        save() writes them itself; bulk writers call pop_audit_records() per instance and pass
+        the combined list to write_audit_records(). `note` is the 'Added'/'Details Updated'
+        description, or the full_content of a plan change. With `fields` (an update_fields
+        list) only those fields are considered, so saves that skip the plan fields never
+        run plan-change detection.
+        """
+        if self._state.adding and not hasattr(self, '_loaded_values'):
+            return [PatientStatus(patient=self, activity_type='Added', description=note or "Patient registered in directory")]
+
+        records = []
+        changed = self.changed_fields(fields)
+        if changed & set(PLAN_FIELDS):
+            old_plan, old_enrollment_date = self._stored_plan()
+            plan_changed = old_plan != self.membership_plan
+            date_changed = old_enrollment_date != self.enrollment_date
 
-        # Log change if plan or enrollment date changed
-        if old_instance:
-            tier_map = {'Gold': 3, 'Silver': 2, 'Bronze': 1, None: 0, '': 0}
-            old_val = tier_map.get(old_instance.membership_plan, 0)
-            new_val = tier_map.get(self.membership_plan, 0)
-            
-            plan_changed = old_instance.membership_plan != self.membership_plan
-            date_changed = old_instance.enrollment_date != self.enrollment_date
-            
             if plan_changed or (date_changed and self.membership_plan):
                 if plan_changed:
-                    change_type = 'Upgrade' if new_val > old_val else 'Downgrade'
+                    change_type = 'Upgrade' if PLAN_RANKS.get(self.membership_plan, 0) > PLAN_RANKS.get(old_plan, 0) else 'Downgrade'
                 else:
                     change_type = 'Renewal'
-                
-                PlanHistory.objects.create(
+                records.append(PlanHistory(
                     patient=self,
-                    old_plan=old_instance.membership_plan or 'None',
+                    old_plan=old_plan or 'None',
                     new_plan=self.membership_plan or 'None',
-                    change_type=change_type
-                )
-                
+                    change_type=change_type,
+                ))
                 # Also log to general status
-                PatientStatus.objects.create(
+                records.append(PatientStatus(
                     patient=self,
-                    activity_type='Plan Updated' if plan_changed else 'Plan Renewed',
-                    description=f"{change_type}: {old_instance.membership_plan or 'None'} → {self.membership_plan or 'None'}"
-                )
+                    activity_type='Plan Updated',
+                    description=plan_change_description(old_plan, self.membership_plan),
+                    full_content=note,
+                ))
+                return records
+
+        if note and changed - set(PLAN_FIELDS) - set(UNAUDITED_FIELDS):
+            records.append(PatientStatus(patient=self, activity_type='Details Updated', description=note))
+        return records
+
+    def _stored_plan(self):
+        loaded = getattr(self, '_loaded_values', {})
+        if all(field in loaded for field in PLAN_FIELDS):
+            return tuple(loaded[field] for field in PLAN_FIELDS)
+        # Instance built by hand or with deferred plan fields: read just those columns
+        stored = Patient.objects.filter(pk=self.pk).values_list(*PLAN_FIELDS).first()
+        return stored or (None, None)
+
+    def pop_audit_records(self, note=None):
+        """audit_records() for a bulk writer; the changes count as logged from now on."""
+        records = self.audit_records(note)
+        self._remember_loaded_values()
+        return records
+
+    def save(self, *args, audit=True, audit_note=None, **kwargs):
+        """
+        Pass audit=False to skip the activity log (the caller records it, e.g. in bulk);
+        audit_note describes the change in the log (see audit_records()).
+        """
+        # Standardize phone
+        if self.phone:
+            self.phone = clean_phone_number(self.phone)
+
+        # Keep the indexed birthday ordinal and E.164 phone in sync with dob/phone
+        self.birthday_ordinal = birthday_ordinal(self.dob)
+        self.phone_e164 = to_e164(self.phone)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = {'dob': 'birthday_ordinal', 'phone': 'phone_e164'}
+            kwargs['update_fields'] = set(update_fields) | {derived[f] for f in update_fields if f in derived}
+
+        records = self.audit_records(audit_note, update_fields) if audit else []
+
+        # Save record
+        super().save(*args, **kwargs)
+        write_audit_records(records)
+        self._remember_loaded_values(kwargs.get('update_fields'))
+        # Enrollment or plan may have changed
+        self.__dict__.pop('plan_progress', None)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -219,9 +493,52 @@ class MessageTemplate(models.Model):
     def __str__(self):
         return self.name
 
+class ScheduledWishQuerySet(models.QuerySet):
+    def claimable(self, now, lease_now=None):
+        """
+        Pending wishes due by `now`, plus Processing wishes whose lease had expired
+        at `lease_now` (defaults to `now`).
+        """
+        return self.filter(
+            Q(status='Pending', scheduled_for__lte=now) |
+            Q(status='Processing', lease_expires_at__lt=lease_now or now)
+        )
+
+    def claim_due(self, now, limit, lease_seconds, worker=''):
+        """
+        Atomically claim up to `limit` due wishes for one worker.
+        Rows locked by another worker are skipped (SELECT ... FOR UPDATE SKIP LOCKED),
+        and claimed rows move to Processing with a lease expiry so a crashed
+        worker's wishes are picked up again once the lease runs out.
+        `now` is only the due cutoff: leases are granted and checked against the
+        current time, so a long-running task never hands out already-expired leases.
+        Returns the list of claimed wish ids.
+        """
+        with transaction.atomic():
+            claimed_at = timezone.now()
+            wish_ids = list(
+                self.claimable(now, claimed_at)
+                .select_for_update(skip_locked=True)
+                .order_by('scheduled_for', 'pk')
+                .values_list('pk', flat=True)[:limit]
+            )
+            if not wish_ids:
+                return []
+            # Re-check the claim condition so backends without row locks can't double-claim
+            self.claimable(now, claimed_at).filter(pk__in=wish_ids).update(
+                status='Processing',
+                lease_expires_at=claimed_at + timedelta(seconds=lease_seconds),
+                claimed_by=worker[:100],
+                updated_at=claimed_at,
+            )
+            return list(self.filter(pk__in=wish_ids, status='Processing', claimed_by=worker[:100])
+                        .values_list('pk', flat=True))
+
+
 class ScheduledWish(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
+        ('Processing', 'Processing'),
         ('Sent', 'Sent'),
         ('Failed', 'Failed'),
     ]
@@ -238,6 +555,10 @@ class ScheduledWish(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
     sent_at = models.DateTimeField(blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
+
+    # Dispatch lease: set while a worker holds the wish in Processing
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    claimed_by = models.CharField(max_length=100, blank=True, null=True)
     
     # Email specific options
     custom_subject = models.CharField(max_length=200, blank=True, null=True, verbose_name="Custom Subject")
@@ -248,11 +569,19 @@ class ScheduledWish(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ScheduledWishQuerySet.as_manager()
+
     def __str__(self):
         return f"Wish for {self.patient} on {self.scheduled_for.date()}"
     
     class Meta:
         ordering = ['scheduled_for']
+        indexes = [
+            models.Index(fields=['patient', 'status'], name='sw_patient_status_idx'),
+            models.Index(fields=['status', 'scheduled_for'], name='sw_status_sched_idx'),
+            # Due-wish polling only ever looks at Pending rows
+            models.Index(fields=['scheduled_for'], condition=Q(status='Pending'), name='sw_pending_sched_idx'),
+        ]
 
 class SavedRecipient(models.Model):
     """Store saved CC/BCC recipients for quick selection."""
@@ -298,6 +627,17 @@ class PatientStatus(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Patient Statuses"
+        indexes = [
+            models.Index(fields=['patient', 'activity_type', 'created_at'], name='ps_patient_act_created_idx'),
+            # Latest-first timeline per patient (patient_list preview, history endpoint)
+            models.Index(fields=['patient', '-created_at'], name='ps_patient_recent_idx'),
+            # Outreach lookups (has this patient been emailed/texted?)
+            models.Index(
+                fields=['patient', 'created_at'],
+                condition=Q(activity_type__in=['Email Sent', 'SMS Sent']),
+                name='ps_outreach_idx',
+            ),
+        ]
 
 
 class PlanHistory(models.Model):
@@ -446,6 +786,60 @@ class CampaignExecution(models.Model):
         ordering = ['-executed_at']
 
 
+# SignalWire message status -> CommunicationLog.status
+SMS_STATUS_BY_REMOTE = {
+    'accepted': 'Queued',
+    'scheduled': 'Queued',
+    'queued': 'Queued',
+    'sending': 'Queued',
+    'sent': 'Sent',
+    'delivered': 'Delivered',
+    'undelivered': 'Undelivered',
+    'failed': 'Failed',
+    'receiving': 'Sent',
+    'received': 'Sent',
+}
+# Delivery receipts can arrive out of order; a log never moves back to a lower rank
+SMS_STATUS_RANKS = {'Pending': 0, 'Queued': 0, 'Sent': 1, 'Delivered': 2, 'Undelivered': 2, 'Failed': 2}
+
+
+class CommunicationLogQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.counterparty_e164 = obj.counterparty_phone()
+        created = super().bulk_create(objs, *args, **kwargs)
+        SmsThread.objects.record_messages(created)
+        return created
+
+    def bulk_create_new(self, objs, attempts=3):
+        """
+        bulk_create the rows whose external_message_id is not logged yet and return
+        the rows actually inserted. If another writer logs one of the SIDs between the
+        check and the insert, the unique constraint rejects the batch and it is retried
+        without the SIDs that were taken.
+        """
+        for attempt in range(attempts):
+            sids = {obj.external_message_id for obj in objs if obj.external_message_id}
+            if sids:
+                logged = set(self.filter(external_message_id__in=sids).values_list('external_message_id', flat=True))
+                objs = [obj for obj in objs if obj.external_message_id not in logged]
+            if not objs:
+                return []
+            try:
+                with transaction.atomic():
+                    return self.bulk_create(objs)
+            except IntegrityError:
+                if attempt == attempts - 1:
+                    raise
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if {'channel', 'recipient'} & set(fields):
+            for obj in objs:
+                obj.counterparty_e164 = obj.counterparty_phone()
+            fields = list(fields) + ['counterparty_e164']
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class CommunicationLog(models.Model):
     """Detailed log of all communications sent."""
     CHANNEL_CHOICES = [
@@ -456,6 +850,10 @@ class CommunicationLog(models.Model):
         ('Sent', 'Sent'),
         ('Failed', 'Failed'),
         ('Pending', 'Pending'),
+        # SMS delivery receipts (see SMS_STATUS_BY_REMOTE)
+        ('Queued', 'Queued'),
+        ('Delivered', 'Delivered'),
+        ('Undelivered', 'Undelivered'),
     ]
     DIRECTION_CHOICES = [
         ('Outbound', 'Outbound'),
@@ -471,14 +869,32 @@ class CommunicationLog(models.Model):
     subject = models.CharField(max_length=200, blank=True, null=True)
     body = models.TextField()
     recipient = models.CharField(max_length=200)  # Email or phone number
+    # E.164 form of an SMS recipient (the patient's side in both directions); thread key
+    counterparty_e164 = models.CharField(max_length=20, blank=True, default='', editable=False)
     external_message_id = models.CharField(max_length=100, blank=True, null=True)
     gateway_number = models.CharField(max_length=30, blank=True, null=True, help_text="SignalWire number used for this SMS")
     
     sent_at = models.DateTimeField(blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
-    
-    created_at = models.DateTimeField(auto_now_add=True)
-    
+
+    # Not auto_now_add so mirrored messages can keep their SignalWire timestamp
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = CommunicationLogQuerySet.as_manager()
+
+    def counterparty_phone(self):
+        return to_e164(self.recipient) if self.channel == 'SMS' else ''
+
+    def save(self, *args, **kwargs):
+        self.counterparty_e164 = self.counterparty_phone()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'channel', 'recipient'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'counterparty_e164'}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            SmsThread.objects.record_messages([self])
+
     def __str__(self):
         return f"{self.channel} to {self.patient} - {self.status}"
     
@@ -486,6 +902,136 @@ class CommunicationLog(models.Model):
         ordering = ['-created_at']
         verbose_name = "Communication Log"
         verbose_name_plural = "Communication Logs"
+        indexes = [
+            models.Index(fields=['channel', 'created_at'], name='cl_channel_created_idx'),
+            models.Index(fields=['counterparty_e164', 'created_at'], name='cl_counterparty_created_idx'),
+        ]
+        constraints = [
+            # One row per provider message; also serves the SID lookups of the mirror and inbox
+            models.UniqueConstraint(
+                fields=['external_message_id'],
+                condition=Q(external_message_id__isnull=False) & ~Q(external_message_id=''),
+                name='cl_external_id_unique',
+            ),
+        ]
+
+
+def message_preview(body, length=90):
+    body = body or ''
+    return body[:length] + ('...' if len(body) > length else '')
+
+
+class SmsThreadQuerySet(models.QuerySet):
+    def record_messages(self, logs):
+        """
+        Fold newly logged SMS into their threads, creating threads as needed.
+        Runs a fixed number of queries per batch; rows are locked so concurrent
+        writers don't lose counts.
+        """
+        by_phone = {}
+        for log in logs:
+            if log.channel == 'SMS' and log.counterparty_e164:
+                by_phone.setdefault(log.counterparty_e164, []).append(log)
+        if not by_phone:
+            return
+
+        with transaction.atomic():
+            self.bulk_create([
+                SmsThread(phone_e164=phone, last_message_at=min(log.created_at for log in phone_logs))
+                for phone, phone_logs in by_phone.items()
+            ], ignore_conflicts=True)
+            threads = list(self.select_for_update().filter(phone_e164__in=list(by_phone)))
+            for thread in threads:
+                thread.add_messages(by_phone[thread.phone_e164])
+            self.bulk_update(threads, [
+                'patient', 'last_message_at', 'last_preview', 'last_direction', 'message_count', 'unread_count',
+            ])
+
+
+class SmsThread(models.Model):
+    """
+    One SMS conversation per counterparty number, maintained as CommunicationLog rows
+    are written (see SmsThreadQuerySet.record_messages) so the messages hub sidebar
+    never has to aggregate the log.
+    """
+    phone_e164 = models.CharField(max_length=20, unique=True)
+    patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name='sms_threads')
+    last_message_at = models.DateTimeField()
+    last_preview = models.CharField(max_length=100, blank=True, default='')
+    last_direction = models.CharField(max_length=20, choices=CommunicationLog.DIRECTION_CHOICES, blank=True, default='')
+    message_count = models.PositiveIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0, help_text="Inbound messages since the thread was last opened")
+
+    objects = SmsThreadQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_message_at', '-id'], name='smsthread_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"SMS thread with {self.display_name}"
+
+    def add_messages(self, logs):
+        self.message_count += len(logs)
+        self.unread_count += sum(1 for log in logs if log.direction == 'Inbound')
+        for log in sorted(logs, key=lambda log: log.created_at):
+            if log.patient_id:
+                self.patient_id = log.patient_id
+            if log.created_at >= self.last_message_at or not self.last_preview:
+                self.last_message_at = max(self.last_message_at, log.created_at)
+                self.last_preview = message_preview(log.body)
+                self.last_direction = log.direction
+
+    @property
+    def key(self):
+        return f"p:{self.patient_id}" if self.patient_id else f"n:{self.phone_e164}"
+
+    @property
+    def display_name(self):
+        if self.patient_id:
+            return f"{self.patient.first_name} {self.patient.last_name}".strip()
+        return self.phone_e164
+
+    def get_absolute_url(self):
+        from urllib.parse import quote_plus
+        from django.urls import reverse
+        if self.patient_id:
+            return f"{reverse('messages_hub')}?patient={self.patient_id}"
+        return f"{reverse('messages_hub')}?phone={quote_plus(self.phone_e164)}"
+
+
+class SmsInboxMessage(models.Model):
+    """Raw SignalWire webhook payload waiting to be applied by birthday.sms_inbox."""
+    KIND_CHOICES = [
+        ('message', 'Inbound message'),
+        ('status', 'Delivery receipt'),
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='message')
+    payload = models.JSONField()
+    received_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.payload.get('MessageSid', self.pk)}"
+
+
+class SmsMirrorState(models.Model):
+    """Progress of the SignalWire message mirror (birthday.sms_mirror), one row per gateway number."""
+    gateway_number = models.CharField(max_length=30, unique=True)
+    high_water_mark = models.DateTimeField(blank=True, null=True, help_text="Newest message date mirrored so far")
+    backfill_before = models.DateTimeField(
+        blank=True, null=True, help_text="Older messages still to mirror: those sent before this date"
+    )
+    backfill_after = models.DateTimeField(
+        blank=True, null=True, help_text="Lower bound of the backfill (empty: the whole history)"
+    )
+    last_run_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    messages_created = models.PositiveIntegerField(default=0, help_text="Rows added by the last run")
+    messages_updated = models.PositiveIntegerField(default=0, help_text="Statuses refreshed by the last run")
+
+    def __str__(self):
+        return f"SMS mirror for {self.gateway_number} up to {self.high_water_mark}"
 
 
 class PracticeSettings(models.Model):
@@ -585,3 +1131,145 @@ class ServicePricing(models.Model):
         ordering = ['category', 'display_order', 'name']
         verbose_name = "Service Pricing"
         verbose_name_plural = "Service Pricing"
+
+
+class SyncJob(models.Model):
+    """Background SMO sync run (executed by a Celery task) and its progress counters."""
+    KIND_CHOICES = [
+        ('practices', 'Sync Practices'),
+        ('practice_patients', 'Sync Practice Patients'),
+        ('bulk_sync', 'Import Selected Patients'),
+    ]
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Completed', 'Completed'),
+        ('Failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    practice = models.ForeignKey(Practice, on_delete=models.CASCADE, null=True, blank=True, related_name='sync_jobs')
+    client_id = models.CharField(max_length=50, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+
+    # Input for bulk_sync jobs (the selected SMO records)
+    payload = models.JSONField(default=list, blank=True)
+
+    # Progress counters, updated as the job runs
+    fetched = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+
+    message = models.TextField(blank=True, default='')
+    result = models.JSONField(default=dict, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} - {self.status}"
+
+    @property
+    def is_finished(self):
+        return self.status in ('Completed', 'Failed')
+
+    def set_progress(self, **counters):
+        """Persist counter changes without touching the rest of the row."""
+        for field, value in counters.items():
+            setattr(self, field, value)
+        SyncJob.objects.filter(pk=self.pk).update(**counters)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'status': self.status,
+            'is_finished': self.is_finished,
+            'fetched': self.fetched,
+            'created': self.created,
+            'updated': self.updated,
+            'errors': self.errors,
+            'message': self.message,
+            'result': self.result,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class ImportJob(models.Model):
+    """Background patient file import (executed by a Celery task) with per-file outcomes."""
+    STATUS_CHOICES = SyncJob.STATUS_CHOICES
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+
+    # Uploaded files staged in IMPORT_UPLOAD_DIR: [{'path': ..., 'name': ...}]
+    files = models.JSONField(default=list, blank=True)
+
+    # Progress counters, updated after each chunk of files
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    duplicates = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+
+    message = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.total} files) - {self.status}"
+
+    @property
+    def is_finished(self):
+        return self.status in ('Completed', 'Failed')
+
+    @property
+    def percent(self):
+        return int(self.processed * 100 / self.total) if self.total else 100
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'status': self.status,
+            'is_finished': self.is_finished,
+            'total': self.total,
+            'processed': self.processed,
+            'percent': self.percent,
+            'created': self.created,
+            'updated': self.updated,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'message': self.message,
+        }
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class ImportJobRow(models.Model):
+    """Outcome of one file in an ImportJob."""
+    OUTCOME_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('duplicate', 'Duplicate'),
+        ('error', 'Error'),
+    ]
+
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name='rows')
+    position = models.IntegerField()
+    file_name = models.CharField(max_length=255)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    reason = models.TextField(blank=True, default='')
+    patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['position']
@@ -0,0 +1,206 @@
+"""
+Keyset (cursor) pagination for the long list views.
+
+Pages are fetched with `WHERE (k1, k2, ...) > (cursor values) ORDER BY k1, k2, ... LIMIT n`
+instead of COUNT(*) + OFFSET, so page N costs the same as page 1. Ordering keys must
+be non-null and end with a unique column (the primary key). Totals are optional and
+approximate on PostgreSQL (the planner's row estimate).
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates to milliseconds; keyset comparisons need the exact value
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, position):
+    payload = json.dumps({'v': values, 'p': position}, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return payload['v'], int(payload['p'])
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def _key_field(queryset, name):
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    try:
+        return queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return queryset.model._meta.pk if name == 'pk' else None
+
+
+def _to_python(field, value):
+    if value is None or field is None:
+        return value
+    return field.to_python(value)
+
+
+def _after(keys, values, backwards):
+    """Lexicographic (k1, k2, ...) > / < values, honouring each key's direction."""
+    condition = Q()
+    for i, (name, descending) in enumerate(keys):
+        lookup = 'lt' if descending != backwards else 'gt'
+        equal_prefix = {prior: values[j] for j, (prior, _) in enumerate(keys[:i])}
+        condition |= Q(**{f'{name}__{lookup}': values[i]}, **equal_prefix)
+    return condition
+
+
+def approximate_count(queryset):
+    """(count, is_estimate): the planner's estimate on PostgreSQL, an exact COUNT elsewhere."""
+    if connection.vendor == 'postgresql':
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        if isinstance(plan, list):
+            plan = plan[0]
+        return int(plan['Plan']['Plan Rows']), True
+    return queryset.count(), False
+
+
+class KeysetPage:
+    """One page of rows plus the cursors around it; iterable like a Paginator page."""
+
+    def __init__(self, object_list, ordering, position, has_next, has_previous, per_page, total=None, total_is_estimate=False):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.position = position
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.per_page = per_page
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+        self._base_query = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def start_index(self):
+        return self.position + 1 if self.object_list else 0
+
+    @property
+    def end_index(self):
+        return self.position + len(self.object_list)
+
+    def _cursor_values(self, obj):
+        return [getattr(obj, name) for name, _ in self.ordering]
+
+    @property
+    def next_cursor(self):
+        if not (self.has_next and self.object_list):
+            return None
+        return encode_cursor(self._cursor_values(self.object_list[-1]), self.end_index)
+
+    @property
+    def previous_cursor(self):
+        if not (self.has_previous and self.object_list):
+            return None
+        return encode_cursor(self._cursor_values(self.object_list[0]), self.position)
+
+    def with_query(self, params):
+        """Keep the request's other GET parameters on the next/previous links."""
+        params = params.copy()
+        for name in ('after', 'before', 'page'):
+            params.pop(name, None)
+        self._base_query = params.urlencode()
+        return self
+
+    def _link(self, name, cursor):
+        query = f'{name}={cursor}' if cursor else ''
+        return '&'.join(part for part in (self._base_query, query) if part)
+
+    @property
+    def first_query(self):
+        return self._base_query
+
+    @property
+    def next_query(self):
+        return self._link('after', self.next_cursor)
+
+    @property
+    def previous_query(self):
+        return self._link('before', self.previous_cursor)
+
+    def as_dict(self):
+        return {
+            'has_next': self.has_next,
+            'has_previous': self.has_previous,
+            'next_cursor': self.next_cursor,
+            'previous_cursor': self.previous_cursor,
+            'start_index': self.start_index,
+            'end_index': self.end_index,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate,
+        }
+
+
+def keyset_paginate(queryset, ordering, per_page, after=None, before=None, with_total=False):
+    """
+    Page `queryset` by `ordering` (e.g. ['-updated_at', '-pk']) starting after/before a cursor
+    from a previous page. Invalid cursors restart at the first page.
+    """
+    keys = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+    backwards = bool(before) and not after
+    cursor = after or before
+
+    position = 0
+    rows = queryset
+    if cursor:
+        try:
+            values, position = decode_cursor(cursor)
+            if len(values) != len(keys):
+                raise InvalidCursor('cursor does not match the ordering')
+            values = [_to_python(_key_field(queryset, name), value) for (name, _), value in zip(keys, values)]
+            rows = rows.filter(_after(keys, values, backwards))
+        except (InvalidCursor, ValueError, ValidationError):
+            cursor, backwards, position = None, False, 0
+            rows = queryset
+
+    if backwards:
+        rows = rows.order_by(*[name if descending else f'-{name}' for name, descending in keys])
+    else:
+        rows = rows.order_by(*ordering)
+
+    # One extra row tells whether there is a further page in this direction
+    object_list = list(rows[:per_page + 1])
+    more = len(object_list) > per_page
+    object_list = object_list[:per_page]
+
+    if backwards:
+        object_list.reverse()
+        position = max(position - len(object_list), 0)
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, bool(cursor)
+
+    total, is_estimate = approximate_count(queryset) if with_total else (None, False)
+    return KeysetPage(object_list, keys, position, has_next, has_previous, per_page, total, is_estimate)
@@ -0,0 +1,117 @@
+"""
+Placeholder rendering for MessageTemplate subjects/bodies and HTML -> SMS text conversion.
+
+Template text is compiled once into a str.format_map() pattern (literal braces escaped),
+so rendering a personalised message is a single C-level format call.
+"""
+import html
+import re
+from datetime import date, timedelta
+from functools import lru_cache
+
+from .models import birthday_for_year
+
+PLACEHOLDERS = (
+    'first_name',
+    'last_name',
+    'age_turning',
+    'plan',
+    'expiry_date',
+    'practice_name',
+)
+
+_PLACEHOLDER_RE = re.compile(r'\{(' + '|'.join(PLACEHOLDERS) + r')\}')
+
+# HTML -> SMS text conversion
+_BLOCK_BREAK_RE = re.compile(r'</p>', re.IGNORECASE)
+_LINE_BREAK_RE = re.compile(r'<br\s*/?>|</div>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^<]+?>')
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+
+
+class CompiledTemplate:
+    """A template string pre-split into a format_map() pattern."""
+    __slots__ = ('text', 'pattern', 'placeholders')
+
+    def __init__(self, text):
+        self.text = text
+        parts = []
+        placeholders = set()
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(text):
+            parts.append(_escape_braces(text[position:match.start()]))
+            parts.append('{' + match.group(1) + '}')
+            placeholders.add(match.group(1))
+            position = match.end()
+        parts.append(_escape_braces(text[position:]))
+        self.pattern = ''.join(parts)
+        self.placeholders = frozenset(placeholders)
+
+    def render(self, context):
+        if not self.placeholders:
+            return self.text
+        return self.pattern.format_map(context)
+
+
+def _escape_braces(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+@lru_cache(maxsize=2048)
+def compile_text(text):
+    """Compile (and cache) arbitrary template text, e.g. a wish's custom body."""
+    return CompiledTemplate(text or '')
+
+
+def get_template_renderer(template, field='body'):
+    """
+    Compiled renderer for a MessageTemplate field. The bounded compile_text() cache
+    is keyed by the text itself, so edits to the template are picked up automatically.
+    """
+    return compile_text(getattr(template, field))
+
+
+class PlaceholderContext(dict):
+    """Placeholder values for one patient; derived values are computed on first use."""
+
+    def __init__(self, patient, practice_name='', plan_duration_days=365, today=None):
+        super().__init__(
+            first_name=patient.first_name or '',
+            last_name=patient.last_name or '',
+            practice_name=practice_name or '',
+        )
+        self.patient = patient
+        self.plan_duration_days = plan_duration_days
+        self.today = today or date.today()
+
+    def __missing__(self, key):
+        patient = self.patient
+        if key == 'age_turning':
+            value = ''
+            if patient.dob:
+                bday = birthday_for_year(patient.dob, self.today.year)
+                value = str(bday.year - patient.dob.year + (1 if bday < self.today else 0))
+        elif key == 'plan':
+            value = patient.membership_plan or ''
+        elif key == 'expiry_date':
+            value = ''
+            if patient.enrollment_date:
+                expiry = patient.enrollment_date + timedelta(days=self.plan_duration_days)
+                value = expiry.strftime('%b %d, %Y')
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
+def render_text(text, context):
+    """Render arbitrary template text with a PlaceholderContext."""
+    return compile_text(text).render(context)
+
+
+def html_to_sms_text(body):
+    """Convert an HTML message body into plain SMS text."""
+    text = _BLOCK_BREAK_RE.sub('\n\n', body or '')
+    text = _LINE_BREAK_RE.sub('\n', text)
+    text = html.unescape(_TAG_RE.sub('', text))
+    return _EXTRA_NEWLINES_RE.sub('\n\n', text).strip()
@@ -1,5 +1,5 @@
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models import BooleanField, Case, Exists, OuterRef, Prefetch, Q, Value, When
 from django.utils import timezone
 from datetime import timedelta, datetime, date
 from django.http import HttpResponse, JsonResponse
@@ -10,9 +10,8 @@ from django.conf import settings
 from django.core.mail import get_connection, EmailMessage
 from email.utils import formataddr
 
-from .models import PatientStatus, ScheduledWish, Patient
+from .models import PatientStatus, ScheduledWish, Patient, birthday_for_year
 from xhtml2pdf import pisa
-import io
 import os
 
 def report_dashboard(request):
@@ -49,93 +48,82 @@ def get_report_data(period='weekly'):
         end_date = today
         title = "Monthly Birthday Report"
     
-    all_patients = Patient.objects.all()
-    upcoming_list = []
-    
-    for p in all_patients:
-        if not p.dob: continue
-        
-        # Determine birthday for this calendar year
-        try:
-            bday_this_year = date(today.year, p.dob.month, p.dob.day)
-        except ValueError: # Leap year Feb 29
-            bday_this_year = date(today.year, 3, 1)
-            
-        # If the range spans across a year boundary, we might need to check next year's bday too
-        try:
-            bday_next_year = date(today.year + 1, p.dob.month, p.dob.day)
-        except ValueError:
-            bday_next_year = date(today.year + 1, 3, 1)
-
-        # Check if either birthday falls within start_date and end_date
-        target_bday = None
-        if start_date <= bday_this_year <= end_date:
-            target_bday = bday_this_year
-        elif start_date <= bday_next_year <= end_date:
-            target_bday = bday_next_year
-            
-        if target_bday:
-            p.bday_this_year = target_bday
-            p.age_turning = target_bday.year - p.dob.year
-
-            if p.patient_type == 'Proceed' and p.enrollment_date and p.enrollment_date >= today - timedelta(days=365):
-                p.status_label = 'Active'
-                p.status_class = 'success'
-            elif p.patient_type == 'Proceed':
-                p.status_label = 'Not Active'
-                p.status_class = 'danger'
-            else:
-                p.status_label = 'Not Regd'
-                p.status_class = 'warning'
-            
-            # Check for outreach from the start of the period up to now
-            # This ensures manual markings today for past reports are captured
-            p.email_done = PatientStatus.objects.filter(
-                patient=p,
-                activity_type='Email Sent',
-                created_at__gte=timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
-            ).exists()
-            
-            p.sms_done = PatientStatus.objects.filter(
-                patient=p,
-                activity_type='SMS Sent',
-                created_at__gte=timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
-            ).exists()
-
-            # Check for recent outreach (last 14 days) for the overall Status badge
-            recent_activity = PatientStatus.objects.filter(
-                patient=p,
-                activity_type__in=['Email Sent', 'SMS Sent'],
-                created_at__gte=timezone.now() - timedelta(days=14)
-            ).order_by('-created_at').first()
-            p.last_outreach = recent_activity
-            upcoming_list.append(p)
-            
-    # Sort by the actual birthday date in the range
-    upcoming_list.sort(key=lambda x: x.bday_this_year)
+    active_cutoff = today - timedelta(days=365)
+    expiring_cutoff = today - timedelta(days=335)
+    period_start = timezone.make_aware(datetime.combine(start_date, datetime.min.time()))
+
+    is_active = Q(patient_type='Proceed', enrollment_date__gte=active_cutoff)
+
+    # Check for outreach from the start of the period up to now
+    # This ensures manual markings today for past reports are captured
+    email_done_qs = PatientStatus.objects.filter(
+        patient_id=OuterRef('pk'),
+        activity_type='Email Sent',
+        created_at__gte=period_start,
+    )
+    sms_done_qs = PatientStatus.objects.filter(
+        patient_id=OuterRef('pk'),
+        activity_type='SMS Sent',
+        created_at__gte=period_start,
+    )
+
+    # Latest recent outreach (last 14 days) for the overall Status badge.
+    # A sliced Prefetch is resolved with a single windowed (ROW_NUMBER) query.
+    latest_outreach = Prefetch(
+        'activities',
+        queryset=PatientStatus.objects.filter(
+            activity_type__in=['Email Sent', 'SMS Sent'],
+            created_at__gte=timezone.now() - timedelta(days=14),
+        ).order_by('-created_at')[:1],
+        to_attr='latest_outreach',
+    )
+
+    # Birthday window, outreach flags and plan buckets are all resolved in SQL
+    upcoming_list = list(
+        Patient.objects.birthdays_between(start_date, end_date)
+        .upcoming_birthdays(start_date)
+        .annotate(
+            email_done=Exists(email_done_qs),
+            sms_done=Exists(sms_done_qs),
+            is_proceed_active=Case(When(is_active, then=True), default=False, output_field=BooleanField()),
+            is_proceed_inactive=Case(
+                When(Q(patient_type='Proceed') & ~is_active, then=True),
+                default=False, output_field=BooleanField(),
+            ),
+            is_expiring_soon=Case(
+                When(is_active & Q(enrollment_date__lt=expiring_cutoff), then=True),
+                default=False, output_field=BooleanField(),
+            ),
+            status_label=Case(
+                When(is_active, then=Value('Active')),
+                When(patient_type='Proceed', then=Value('Not Active')),
+                default=Value('Not Regd'),
+            ),
+            status_class=Case(
+                When(is_active, then=Value('success')),
+                When(patient_type='Proceed', then=Value('danger')),
+                default=Value('warning'),
+            ),
+        )
+        .prefetch_related(latest_outreach)
+    )
+
+    for p in upcoming_list:
+        # The window may span a year boundary, so pick whichever birthday falls inside it
+        p.bday_this_year = birthday_for_year(p.dob, start_date.year)
+        if not start_date <= p.bday_this_year <= end_date:
+            p.bday_this_year = birthday_for_year(p.dob, end_date.year)
+        p.age_turning = p.bday_this_year.year - p.dob.year
+        p.last_outreach = p.latest_outreach[0] if p.latest_outreach else None
     
     # Summary stats based on the patients in this specific report
     total_birthdays = len(upcoming_list)
     email_outreach = sum(1 for p in upcoming_list if p.email_done)
     sms_outreach = sum(1 for p in upcoming_list if p.sms_done)
 
-    proceed_active = [
-        p for p in upcoming_list
-        if p.patient_type == 'Proceed'
-        and p.enrollment_date
-        and p.enrollment_date >= today - timedelta(days=365)
-    ]
-    proceed_inactive = [
-        p for p in upcoming_list
-        if p.patient_type == 'Proceed'
-        and (not p.enrollment_date or p.enrollment_date < today - timedelta(days=365))
-    ]
-    expiring_soon = [
-        p for p in upcoming_list
-        if p.patient_type == 'Proceed'
-        and p.enrollment_date
-        and today - timedelta(days=365) <= p.enrollment_date < today - timedelta(days=335)
-    ]
+    proceed_active = [p for p in upcoming_list if p.is_proceed_active]
+    proceed_inactive = [p for p in upcoming_list if p.is_proceed_inactive]
+    expiring_soon = [p for p in upcoming_list if p.is_expiring_soon]
     not_registered = [p for p in upcoming_list if p.patient_type != 'Proceed']
 
     return {
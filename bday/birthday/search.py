@@ -0,0 +1,73 @@
+"""
+Patient directory search.
+
+On PostgreSQL the query is matched against one lower-cased "search document"
+(name, email, city, phone) backed by the pg_trgm GIN index from migration 0027, and
+results are ranked by trigram word similarity. Other backends (SQLite in development)
+keep the plain icontains filters.
+"""
+from django.db import connection
+from django.db.models import F, Func, Q, TextField, Value
+from django.db.models.functions import Coalesce, Concat
+
+from .models import clean_phone_number
+
+# Shortest digit run treated as a phone number fragment
+MIN_PHONE_DIGITS = 3
+
+
+class PatientSearchDocument(Func):
+    """
+    lower(first_name || ' ' || last_name || ' ' || email || ' ' || COALESCE(city, '') || ' ' || phone)
+
+    Must stay identical to the patient_search_trgm index expression (migration 0027),
+    otherwise PostgreSQL cannot use the index.
+    """
+    template = 'lower(%(expressions)s)'
+    arg_joiner = " || ' ' || "
+    output_field = TextField()
+
+    def __init__(self):
+        super().__init__(F('first_name'), F('last_name'), F('email'), Coalesce(F('city'), Value('')), F('phone'))
+
+
+def phone_digits(query):
+    """Digits of a phone-like query, normalised like stored numbers ('' if too short)."""
+    digits = ''.join(filter(str.isdigit, query))
+    if len(digits) < MIN_PHONE_DIGITS:
+        return ''
+    return clean_phone_number(digits) if len(digits) == 11 else digits
+
+
+def search_patients(queryset, query):
+    """
+    Filter `queryset` to patients matching `query`.
+    Returns (queryset, ranked); ranked querysets carry a `search_rank` annotation.
+    """
+    query = query.strip()
+    if not query:
+        return queryset, False
+    digits = phone_digits(query)
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        condition = Q(search_document__contains=query.lower())
+        if digits:
+            # "(555) 123-4567" finds 5551234567; phones are stored as bare digits
+            condition |= Q(phone__contains=digits)
+        queryset = queryset.annotate(search_document=PatientSearchDocument()).filter(condition)
+        return queryset.annotate(search_rank=TrigramWordSimilarity(Value(query.lower()), 'search_document')), True
+
+    condition = (
+        Q(first_name__icontains=query) |
+        Q(last_name__icontains=query) |
+        Q(full_name__icontains=query) |
+        Q(email__icontains=query) |
+        Q(phone__icontains=query) |
+        Q(city__icontains=query)
+    )
+    if digits:
+        condition |= Q(phone__contains=digits)
+    queryset = queryset.annotate(full_name=Concat('first_name', Value(' '), 'last_name')).filter(condition)
+    return queryset, False
@@ -0,0 +1,29 @@
+"""
+Model signal receivers that keep cached, derived data in sync with writes.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .context_processors import invalidate_birthday_popup
+from .models import Patient, PatientStatus, ScheduledWish
+
+# Patient fields shown in the birthday popup
+POPUP_PATIENT_FIELDS = ('dob', 'first_name', 'last_name')
+
+
+@receiver(post_save, sender=Patient)
+def patient_saved(sender, instance, created, **kwargs):
+    # Patient.save() refreshes its change tracking only after post_save has been sent
+    if created or instance.changed_fields(POPUP_PATIENT_FIELDS):
+        transaction.on_commit(invalidate_birthday_popup)
+
+
+@receiver(post_save, sender=ScheduledWish)
+@receiver(post_save, sender=PatientStatus)
+@receiver(post_delete, sender=ScheduledWish)
+@receiver(post_delete, sender=PatientStatus)
+@receiver(post_delete, sender=Patient)
+def popup_source_changed(sender, **kwargs):
+    # After commit, so a concurrent request cannot re-cache the pre-write state
+    transaction.on_commit(invalidate_birthday_popup)
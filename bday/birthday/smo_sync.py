@@ -0,0 +1,424 @@
+"""
+Incremental SMO patient sync.
+
+Patients are pulled from the SMO API one page at a time and each page is upserted with a
+single bulk INSERT ... ON CONFLICT (external_id), so memory stays bounded by the page size
+and a practice sync costs a handful of queries per page instead of two per patient.
+PatientMatchIndex deduplicates previewed/selected records against existing patients.
+"""
+import logging
+import os
+from datetime import datetime
+from urllib.parse import urljoin
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Patient, PatientStatus, Practice, clean_phone_number
+
+logger = logging.getLogger(__name__)
+
+# Selected records processed between progress updates of a bulk sync job
+PROGRESS_EVERY = 50
+
+# Fields refreshed on existing patients; dob only when the API sent a parseable one
+SYNC_UPDATE_FIELDS = ['practice', 'first_name', 'last_name', 'email', 'phone', 'patient_type', 'updated_at']
+
+
+def _norm(value):
+    return (value or '').strip().lower()
+
+
+class PatientMatchIndex:
+    """
+    In-memory lookup of existing patients for deduplicating SMO records.
+
+    Loads the matching columns once and resolves each record with dict lookups, using the
+    same precedence as the old per-record query cascade: external ID, email + first name,
+    phone + first/last name, then first/last name + DOB. When several patients share a key
+    the lowest pk wins, as .first() did.
+    """
+    COLUMNS = ('pk', 'external_id', 'email', 'first_name', 'last_name', 'phone', 'dob')
+
+    def __init__(self):
+        self.by_external_id = {}
+        self.by_email_name = {}
+        self.by_phone_name = {}
+        self.by_name_dob = {}
+
+    @classmethod
+    def load(cls, queryset=None):
+        index = cls()
+        queryset = Patient.objects.all() if queryset is None else queryset
+        for row in queryset.order_by('pk').values_list(*cls.COLUMNS).iterator(chunk_size=5000):
+            index.add(*row)
+        return index
+
+    def add(self, pk, external_id, email, first_name, last_name, phone, dob):
+        first, last = _norm(first_name), _norm(last_name)
+        if external_id:
+            self.by_external_id.setdefault(str(external_id), pk)
+        self.by_email_name.setdefault((_norm(email), first), pk)
+        self.by_phone_name.setdefault((phone or '', first, last), pk)
+        if dob:
+            self.by_name_dob.setdefault((first, last, dob), pk)
+
+    def add_patient(self, patient):
+        self.add(*(getattr(patient, column) for column in self.COLUMNS))
+
+    def match(self, external_id=None, email='', first_name='', last_name='', phone='', dob=None):
+        """Return (patient pk, reason) for the first rule that matches, else (None, '')."""
+        first, last = _norm(first_name), _norm(last_name)
+        email = _norm(email)
+
+        # 1. Match by External ID
+        if external_id and external_id in self.by_external_id:
+            return self.by_external_id[external_id], "ID Match"
+        # 2. Match by Email + Name (Prevents mixing family members sharing an email)
+        if email and (email, first) in self.by_email_name:
+            return self.by_email_name[(email, first)], "Email + Name Match"
+        # 3. Match by Name + Phone
+        if phone and first and last and (phone, first, last) in self.by_phone_name:
+            return self.by_phone_name[(phone, first, last)], "Phone + Name Match"
+        # 4. Match by Name + DOB (Very reliable fallback)
+        if dob and first and last and (first, last, dob) in self.by_name_dob:
+            return self.by_name_dob[(first, last, dob)], "Name + DOB Match"
+        return None, ''
+
+
+def get_smo_config():
+    return {
+        'API_KEY': os.getenv('SMO_API_KEY'),
+        'BASE_URL': os.getenv('SMO_BASE_URL', 'https://smo.dentalhub.cloud'),
+        'CLIENT_ID': os.getenv('SMO_CLIENT_ID', '1'),
+    }
+
+
+def practice_patients_url(practice, config=None):
+    config = config or get_smo_config()
+    client_id = practice.client_id or config['CLIENT_ID']
+    return f"{config['BASE_URL']}/review/api/clients/{client_id}/practices/{practice.external_id}/patients"
+
+
+def _next_page(data, batch, page, page_size):
+    """
+    Work out how to fetch the page after `page`: a URL from `next`, a page number from
+    page-count metadata / `has_more`, or None when the listing is exhausted.
+    """
+    if not isinstance(data, dict):
+        return None
+    if 'next' in data:
+        return ('url', data['next']) if data['next'] else None
+    total_pages = data.get('total_pages') or data.get('num_pages')
+    if total_pages is not None:
+        return ('page', page + 1) if page < int(total_pages) else None
+    if 'has_more' in data:
+        return ('page', page + 1) if data['has_more'] else None
+    # No paging metadata: keep going only while pages come back full
+    return ('page', page + 1) if len(batch) >= page_size else None
+
+
+def iter_patient_pages(practice, updated_since=None, page_size=None, session=None, config=None):
+    """Yield the practice's SMO patient records one page (list of dicts) at a time."""
+    config = config or get_smo_config()
+    page_size = page_size or settings.SMO_SYNC_PAGE_SIZE
+    session = session or requests.Session()
+    headers = {"X-API-Key": config['API_KEY']}
+    url = practice_patients_url(practice, config)
+
+    params = {'page': 1, 'page_size': page_size}
+    if updated_since:
+        params['updated_since'] = updated_since.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    page = 1
+    previous_first_id = None
+    while url:
+        response = session.get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        batch = data.get("patients", []) if isinstance(data, dict) else data
+
+        # Guard against APIs that ignore paging and return the same list every time
+        first_id = batch[0].get('id') if batch else None
+        if not batch or (page > 1 and first_id == previous_first_id):
+            return
+        previous_first_id = first_id
+        yield batch
+
+        next_page = _next_page(data, batch, page, page_size)
+        if next_page is None:
+            return
+        kind, value = next_page
+        if kind == 'url':
+            url, params = urljoin(url, value), None
+        else:
+            page = value
+            params = {**params, 'page': page}
+
+
+def _parse_dob(value):
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def upsert_patient_page(practice, records):
+    """
+    Upsert one page of SMO records keyed on external_id.
+    Returns (created, updated, skipped) counts.
+    """
+    rows = {}
+    for p_data in records:
+        if p_data.get('id') is None:
+            continue
+        # Last occurrence wins if the API repeats a record within a page
+        rows[str(p_data['id'])] = Patient(
+            external_id=str(p_data['id']),
+            practice=practice,
+            first_name=p_data.get('first_name') or '',
+            last_name=p_data.get('last_name') or '',
+            email=p_data.get('email') or '',
+            phone=clean_phone_number(p_data.get('phone') or ''),
+            patient_type='Regular',
+            dob=_parse_dob(p_data.get('dob')),
+        )
+    skipped = len(records) - len(rows)
+    if not rows:
+        return 0, 0, skipped
+
+    existing = set(
+        Patient.objects.filter(external_id__in=list(rows)).values_list('external_id', flat=True)
+    )
+    now = timezone.now()
+    with_dob, without_dob = [], []
+    for ext_id, patient in rows.items():
+        patient.created_at = patient.updated_at = now
+        if patient.dob:
+            with_dob.append(patient)
+        elif ext_id in existing:
+            without_dob.append(patient)
+        else:
+            # New patients need a date of birth
+            skipped += 1
+
+    with transaction.atomic():
+        if with_dob:
+            Patient.objects.bulk_create(
+                with_dob,
+                update_conflicts=True,
+                unique_fields=['external_id'],
+                update_fields=SYNC_UPDATE_FIELDS + ['dob'],
+            )
+        if without_dob:
+            pks = dict(
+                Patient.objects.filter(external_id__in=[p.external_id for p in without_dob])
+                .values_list('external_id', 'pk')
+            )
+            for patient in without_dob:
+                patient.pk = pks[patient.external_id]
+            Patient.objects.bulk_update(without_dob, SYNC_UPDATE_FIELDS)
+
+        # Activity log for newly registered patients, written once for the whole page
+        new_ids = [p.external_id for p in with_dob if p.external_id not in existing]
+        if new_ids:
+            PatientStatus.objects.bulk_create([
+                PatientStatus(patient_id=pk, activity_type='Added', description="Patient registered in directory")
+                for pk in Patient.objects.filter(external_id__in=new_ids).values_list('pk', flat=True)
+            ])
+
+    created = len(new_ids)
+    return created, len(with_dob) + len(without_dob) - created, skipped
+
+
+def sync_practice_patients(practice, page_size=None, session=None, full=False, progress=None):
+    """
+    Stream and upsert the practice's patients. Only records changed since the last sync are
+    requested unless `full` is set; `progress(result)` is called after each page.
+    Returns {'fetched', 'created', 'updated', 'skipped', 'pages'}.
+    """
+    started_at = timezone.now()
+    updated_since = None if full else practice.last_sync
+    result = {'fetched': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'pages': 0}
+
+    for records in iter_patient_pages(practice, updated_since=updated_since, page_size=page_size, session=session):
+        created, updated, skipped = upsert_patient_page(practice, records)
+        result['created'] += created
+        result['updated'] += updated
+        result['skipped'] += skipped
+        result['fetched'] += len(records)
+        result['pages'] += 1
+        if progress:
+            progress(result)
+        logger.info("SMO sync %s page %s: %s created, %s updated", practice.name, result['pages'], created, updated)
+
+    # Records changed while the sync was running are picked up by the next incremental sync
+    practice.last_sync = started_at
+    practice.save(update_fields=['last_sync'])
+    return result
+
+
+def sync_practices(client_id, session=None, config=None):
+    """Upsert the client's practices from SMO. Returns (count, debug_info)."""
+    config = config or get_smo_config()
+    session = session or requests.Session()
+    headers = {"X-API-Key": config['API_KEY']}
+    url = f"{config['BASE_URL']}/review/api/clients/{client_id}/practices"
+
+    response = session.get(url, headers=headers, timeout=15)
+    response.raise_for_status()
+    data = response.json()
+    practices_data = data.get("practices", []) if isinstance(data, dict) else data
+
+    count = 0
+    debug_info = ""
+    for p_data in practices_data:
+        p_name = p_data.get('name') or p_data.get('practice_name') or p_data.get('display_name') or 'Unknown Practice'
+        p_loc = p_data.get('location') or p_data.get('city') or p_data.get('office_location') or ''
+        p_ext_id = p_data.get('id') or p_data.get('pk')
+
+        if not p_ext_id:
+            continue
+
+        if p_name == 'Unknown Practice' and p_data:
+            debug_info = f" Keys found: {list(p_data.keys())}"
+
+        Practice.objects.update_or_create(
+            external_id=str(p_ext_id),
+            defaults={
+                'name': p_name,
+                'location': p_loc,
+                'client_id': str(client_id),
+            }
+        )
+        count += 1
+    return count, debug_info
+
+
+def bulk_sync_patients(practice, selected_patients, progress=None):
+    """
+    Create or update the SMO records selected in the preview, matching existing patients
+    with PatientMatchIndex. `progress(created, updated, skipped)` is called periodically.
+    Returns {'created_patients': [...], 'updated_patients': [...], 'skipped': n}.
+    """
+    updated_list = []
+    created_list = []
+    skipped = 0
+
+    # Existing patients are loaded once and matched in memory
+    match_index = PatientMatchIndex.load()
+
+    for position, p_data in enumerate(selected_patients, start=1):
+        if progress and position % PROGRESS_EVERY == 0:
+            progress(len(created_list), len(updated_list), skipped)
+
+        # 1. Normalize and Extract data
+        api_id = p_data.get('id') or p_data.get('patient_id')
+        api_ext_id = str(api_id) if api_id else None
+
+        p_fname = (p_data.get('first_name') or '').strip()
+        p_mname = (p_data.get('middle_name') or '').strip()
+        p_lname = (p_data.get('last_name') or '').strip()
+        p_email = (p_data.get('email') or p_data.get('email_address') or '').strip()
+        p_phone = clean_phone_number(p_data.get('phone') or p_data.get('mobile') or p_data.get('phone_number') or '')
+        p_dob_str = p_data.get('date_of_birth') or p_data.get('dob') or p_data.get('birth_date') or ''
+        p_gender = p_data.get('gender') or p_data.get('sex') or ''
+
+        full_name = f"{p_fname} {p_lname}".strip()
+
+        # Final safety check: a name and a DOB are required (the database requires dob)
+        p_dob = _parse_dob(p_dob_str)
+        if (not p_fname and not p_lname) or not p_dob:
+            skipped += 1
+            continue
+
+        # 2. Match with Existing Record (external ID, email + name, phone + name)
+        matched_pk, _ = match_index.match(
+            external_id=api_ext_id if api_ext_id != 'None' else None,
+            email=p_email, first_name=p_fname, last_name=p_lname, phone=p_phone,
+        )
+        existing_patient = Patient.objects.filter(pk=matched_pk).first() if matched_pk else None
+
+        # 3. Prepare the update data
+        defaults = {
+            'practice': practice,
+            'first_name': p_fname,
+            'middle_name': p_mname,  # Crucial: Sync middle name to avoid 'Timothy John John Chisser'
+            'last_name': p_lname,
+            'email': p_email,
+            'phone': p_phone,
+            'gender': p_gender if p_gender in ['Male', 'Female', 'Other'] else 'Other',
+            'patient_type': 'Regular',
+            'dob': p_dob,
+        }
+
+        # 4. Save
+        if existing_patient:
+            # Update existing record
+            for attr, value in defaults.items():
+                setattr(existing_patient, attr, value)
+            if api_ext_id and api_ext_id != 'None':
+                existing_patient.external_id = api_ext_id
+            existing_patient.save()
+            match_index.add_patient(existing_patient)
+            updated_list.append({'name': full_name, 'id': existing_patient.pk})
+        else:
+            # Create new record
+            new_patient = Patient.objects.create(external_id=api_ext_id if api_ext_id != 'None' else None, **defaults)
+            match_index.add_patient(new_patient)
+            created_list.append({'name': full_name, 'id': new_patient.pk})
+
+    practice.last_sync = timezone.now()
+    practice.save(update_fields=['last_sync'])
+    return {'created_patients': created_list, 'updated_patients': updated_list, 'skipped': skipped}
+
+
+def run_sync_job(job):
+    """Execute a SyncJob, recording progress and the final outcome on the row."""
+    job.status = 'Running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    try:
+        if job.kind == 'practices':
+            count, debug_info = sync_practices(job.client_id or get_smo_config()['CLIENT_ID'])
+            job.fetched = job.created = count
+            job.message = f"Successfully synced {count} practices for Client ID {job.client_id}.{debug_info}"
+
+        elif job.kind == 'practice_patients':
+            def page_done(result):
+                job.set_progress(fetched=result['fetched'], created=result['created'], updated=result['updated'], errors=result['skipped'])
+
+            result = sync_practice_patients(job.practice, progress=page_done)
+            page_done(result)
+            job.message = f"Practice {job.practice.name}: Created {result['created']}, Updated {result['updated']} patients."
+
+        elif job.kind == 'bulk_sync':
+            job.fetched = len(job.payload)
+
+            def batch_done(created, updated, skipped):
+                job.set_progress(created=created, updated=updated, errors=skipped)
+
+            result = bulk_sync_patients(job.practice, job.payload, progress=batch_done)
+            batch_done(len(result['created_patients']), len(result['updated_patients']), result['skipped'])
+            job.result = result
+            job.message = f"Sync Complete: {job.updated} updated, {job.created} created."
+
+        else:
+            raise ValueError(f"Unknown sync job kind: {job.kind}")
+
+        job.status = 'Completed'
+    except Exception as e:
+        logger.exception("Sync job %s failed", job.pk)
+        job.status = 'Failed'
+        job.message = str(e)
+
+    job.finished_at = timezone.now()
+    job.save()
+    return job
@@ -0,0 +1,148 @@
+"""
+SignalWire webhook inbox.
+
+signalwire_sms_webhook and signalwire_status_webhook only append the raw POST payload
+to SmsInboxMessage and answer SignalWire. A Celery task drains the inbox in batches:
+- inbound messages: patients are resolved with one phone_e164__in query per batch and
+  the messages are bulk-inserted into CommunicationLog, including messages from numbers
+  that match no patient;
+- delivery receipts: the most advanced status per message SID is applied to
+  CommunicationLog.status with one bulk_update per batch.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SMS_STATUS_BY_REMOTE, SMS_STATUS_RANKS, CommunicationLog, Patient, SmsInboxMessage, to_e164
+
+logger = logging.getLogger(__name__)
+
+# Set while a drain is queued, so a burst of webhooks queues a single task
+DRAIN_SCHEDULED_KEY = 'sms_inbox:drain_scheduled'
+
+
+def schedule_inbox_drain():
+    if not cache.add(DRAIN_SCHEDULED_KEY, 1, timeout=60):
+        return
+    from .tasks import process_sms_inbox_task
+    try:
+        process_sms_inbox_task.apply_async(countdown=settings.SMS_INBOX_DRAIN_DELAY_SECONDS)
+    except Exception as e:
+        # The beat sweep drains the inbox once the broker is back
+        cache.delete(DRAIN_SCHEDULED_KEY)
+        logger.warning(f"Unable to queue SMS inbox drain: {e}")
+
+
+def enqueue_inbound_sms(payload, kind='message'):
+    """Store one webhook payload (a dict of its POST fields) and queue a drain."""
+    message = SmsInboxMessage.objects.create(kind=kind, payload=payload)
+    transaction.on_commit(schedule_inbox_drain)
+    return message
+
+
+def enqueue_delivery_receipt(payload):
+    return enqueue_inbound_sms(payload, kind='status')
+
+
+def _inbound_logs(batch):
+    """CommunicationLog rows for a batch of inbox messages, one per SID."""
+    payloads = []
+    seen = set()
+    for message in batch:
+        payload = {key: (value or '').strip() for key, value in message.payload.items()}
+        sid = payload.get('MessageSid', '')
+        if not payload.get('From') or not payload.get('Body') or (sid and sid in seen):
+            continue
+        seen.add(sid)
+        payloads.append((payload, message.received_at))
+
+    phones = {to_e164(payload['From']) for payload, _ in payloads}
+    patients = {patient.phone_e164: patient for patient in Patient.objects.filter(phone_e164__in=phones)}
+
+    return [
+        CommunicationLog(
+            patient=patients.get(to_e164(payload['From'])),
+            channel='SMS',
+            direction='Inbound',
+            status='Sent',
+            body=payload['Body'],
+            recipient=payload['From'],
+            external_message_id=payload.get('MessageSid') or None,
+            gateway_number=payload.get('To') or os.getenv('TWILIO_PHONE_NUMBER'),
+            created_at=received_at,
+        )
+        for payload, received_at in payloads
+    ]
+
+
+def _apply_delivery_receipts(receipts, retry_after):
+    """
+    Apply the most advanced status per SID with one bulk_update.
+    Returns (logs updated, receipts to keep): receipts for messages that are not logged
+    yet (e.g. a wish batch still sending) stay in the inbox until `retry_after`.
+    """
+    latest = {}
+    for receipt in receipts:
+        sid = (receipt.payload.get('MessageSid') or '').strip()
+        status = SMS_STATUS_BY_REMOTE.get((receipt.payload.get('MessageStatus') or '').strip().lower())
+        if not sid or not status:
+            continue
+        if sid not in latest or SMS_STATUS_RANKS[status] >= SMS_STATUS_RANKS[latest[sid][0]]:
+            latest[sid] = (status, (receipt.payload.get('ErrorCode') or '').strip())
+    if not latest:
+        return 0, []
+
+    logs = list(
+        CommunicationLog.objects.filter(external_message_id__in=list(latest))
+        .only('pk', 'external_message_id', 'status', 'error_message')
+    )
+    changed = []
+    for log in logs:
+        status, error_code = latest[log.external_message_id]
+        if status != log.status and SMS_STATUS_RANKS[status] >= SMS_STATUS_RANKS.get(log.status, 0):
+            log.status = status
+            if error_code:
+                log.error_message = f'SignalWire error {error_code}'
+            changed.append(log)
+    CommunicationLog.objects.bulk_update(changed, ['status', 'error_message'])
+
+    unmatched = set(latest) - {log.external_message_id for log in logs}
+    keep = [
+        receipt for receipt in receipts
+        if (receipt.payload.get('MessageSid') or '').strip() in unmatched and receipt.received_at > retry_after
+    ]
+    return len(changed), keep
+
+
+def process_sms_inbox(batch_size=None):
+    """
+    Apply every waiting webhook, batch_size rows per transaction.
+    Rows are claimed with SKIP LOCKED on PostgreSQL, so concurrent drains split the work.
+    """
+    batch_size = batch_size or settings.SMS_INBOX_BATCH_SIZE
+    retry_after = timezone.now() - timedelta(seconds=settings.SMS_RECEIPT_RETRY_SECONDS)
+    processed = logged = delivery_updates = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                SmsInboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            # The mirror task may have logged a message before its webhook was drained
+            logs = CommunicationLog.objects.bulk_create_new(_inbound_logs([row for row in batch if row.kind == 'message']))
+            updated, keep = _apply_delivery_receipts([row for row in batch if row.kind == 'status'], retry_after)
+            done = [row.pk for row in batch if row not in keep]
+            SmsInboxMessage.objects.filter(pk__in=done).delete()
+        processed += len(done)
+        logged += len(logs)
+        delivery_updates += updated
+    return {'processed': processed, 'logged': logged, 'delivery_updates': delivery_updates}
@@ -0,0 +1,213 @@
+"""
+Local mirror of the SignalWire message list.
+
+A periodic task pages the Compatibility API's Messages list for both legs of the
+practice number, starting from the day of the last high-water mark, and upserts the
+messages into CommunicationLog keyed by external_message_id. messages_hub then reads
+only from the local table instead of calling SignalWire on every page view.
+"""
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SMS_STATUS_BY_REMOTE, SMS_STATUS_RANKS, CommunicationLog, Patient, SmsMirrorState, to_e164
+from .utils import MessageListTruncated, get_sms_client, parse_signalwire_message
+
+logger = logging.getLogger(__name__)
+
+def local_status(remote_status):
+    return SMS_STATUS_BY_REMOTE.get((remote_status or '').lower(), 'Sent')
+
+
+def counterparty_number(message):
+    """The other party of a mirrored message (the patient's side)."""
+    return message['to_number'] if message['direction'] == 'Outbound' else message['from_number']
+
+
+def store_messages(messages, settle_before):
+    """
+    Insert messages not seen before and refresh the status of known ones.
+    Outbound messages newer than `settle_before` are left for the next run, so the send
+    path gets to log them (with their campaign/patient) first.
+    Returns (created, updated, newest message date or None).
+    """
+    by_sid = {
+        message['sid']: message for message in messages
+        if message['sid'] and not (message['direction'] == 'Outbound' and message['created_at'] > settle_before)
+    }
+    if not by_sid:
+        return 0, 0, None
+
+    existing = CommunicationLog.objects.filter(external_message_id__in=list(by_sid)).only('pk', 'external_message_id', 'status')
+    changed, seen = [], set()
+    for log in existing:
+        seen.add(log.external_message_id)
+        status = local_status(by_sid[log.external_message_id]['status'])
+        if log.status != status and SMS_STATUS_RANKS[status] >= SMS_STATUS_RANKS.get(log.status, 0):
+            log.status = status
+            changed.append(log)
+
+    new = [message for sid, message in by_sid.items() if sid not in seen]
+    phones = {counterparty_number(message) for message in new} - {''}
+    patients = {patient.phone_e164: patient for patient in Patient.objects.filter(phone_e164__in=phones)} if phones else {}
+
+    logs = [
+        CommunicationLog(
+            patient=patients.get(counterparty_number(message)),
+            channel='SMS',
+            direction=message['direction'],
+            status=local_status(message['status']),
+            body=message['body'],
+            recipient=counterparty_number(message),
+            external_message_id=message['sid'],
+            gateway_number=message['gateway_number'],
+            sent_at=message['created_at'],
+            created_at=message['created_at'],
+        )
+        for message in new
+    ]
+    with transaction.atomic():
+        # The inbox drain may log the same inbound messages concurrently
+        inserted = CommunicationLog.objects.bulk_create_new(logs) if logs else []
+        if changed:
+            CommunicationLog.objects.bulk_update(changed, ['status'])
+
+    return len(inserted), len(changed), max(message['created_at'] for message in by_sid.values())
+
+
+def _mirror_pass(client, sw_number, params, max_pages, settle_before):
+    """
+    Page both legs of the practice number with `params` and store what comes back.
+    Returns (created, updated, newest, stopped_at): stopped_at is the oldest message
+    date reached on a leg cut short by max_pages (the latest such date over both legs),
+    or None when every leg was read to the end.
+    """
+    created = updated = 0
+    newest = stopped_at = None
+    for leg in ({'To': sw_number}, {'From': sw_number}):
+        oldest = None
+        try:
+            for page in client.iter_message_pages({**params, **leg}, max_pages=max_pages):
+                messages = [parse_signalwire_message(message, sw_number) for message in page]
+                page_created, page_updated, page_newest = store_messages(messages, settle_before)
+                created += page_created
+                updated += page_updated
+                if page_newest and (newest is None or page_newest > newest):
+                    newest = page_newest
+                if messages:
+                    page_oldest = min(message['created_at'] for message in messages)
+                    oldest = page_oldest if oldest is None else min(oldest, page_oldest)
+        except MessageListTruncated:
+            if oldest and (stopped_at is None or oldest > stopped_at):
+                stopped_at = oldest
+    return created, updated, newest, stopped_at
+
+
+def _utc_day(moment):
+    return moment.astimezone(dt_timezone.utc).date()
+
+
+def mirror_signalwire_messages(client=None, max_pages=None):
+    """
+    Pull messages sent to/from the practice number since the last high-water mark.
+
+    Pages come newest first, so a run cut short by max_pages (e.g. the first run over a
+    long history) still moves the mark to the newest message, and records in
+    backfill_before how far back it got. Later runs then also page the older messages
+    (DateSent<) down to backfill_after (the previous mark; None for the whole history),
+    max_pages per run, until the gap is closed. A failed run keeps the mark and the
+    backfill cursor, so it is retried from the same point.
+
+    The gateway's SmsMirrorState row stays locked for the whole run, so a run started
+    meanwhile by any worker is skipped instead of racing it for the mark.
+    """
+    client = client or get_sms_client()
+    if not client.is_configured:
+        return {'status': 'skipped', 'error': 'SignalWire credentials missing'}
+
+    sw_number = to_e164(client.from_number)
+    SmsMirrorState.objects.get_or_create(gateway_number=sw_number)
+    with transaction.atomic():
+        state = SmsMirrorState.objects.select_for_update(skip_locked=True).filter(gateway_number=sw_number).first()
+        if state is None:
+            return {'status': 'skipped', 'error': 'SignalWire mirror already running'}
+        return _mirror_locked(client, state, sw_number, max_pages)
+
+
+def _mirror_locked(client, state, sw_number, max_pages):
+    """One mirror run over the locked `state` row (see mirror_signalwire_messages)."""
+    max_pages = max_pages or settings.SIGNALWIRE_MIRROR_MAX_PAGES
+    settle_before = timezone.now() - timedelta(seconds=settings.SIGNALWIRE_MIRROR_SETTLE_SECONDS)
+
+    params = {'PageSize': settings.SIGNALWIRE_MIRROR_PAGE_SIZE}
+    if state.high_water_mark:
+        # DateSent filters by whole (UTC) days; messages held back by the settle window
+        # may be older than the mark, so start from whichever is earlier
+        since = min(state.high_water_mark, settle_before)
+        params['DateSent>='] = _utc_day(since).isoformat()
+
+    created = updated = 0
+    mark, backfill_before, backfill_after = state.high_water_mark, state.backfill_before, state.backfill_after
+    error = ''
+    failed = False
+    try:
+        created, updated, newest, stopped_at = _mirror_pass(client, sw_number, params, max_pages, settle_before)
+        if newest and (mark is None or newest > mark):
+            mark = newest
+        if stopped_at:
+            # Messages between the old mark and stopped_at were skipped; a backfill
+            # already in progress is widened rather than replaced
+            if backfill_before is None:
+                backfill_after = state.high_water_mark
+            backfill_before = max(backfill_before, stopped_at) if backfill_before else stopped_at
+            logger.warning(f'SignalWire mirror stopped at {max_pages} pages; backfilling before {stopped_at}')
+        elif backfill_before:
+            # The cursor's own day is paged again (DateSent< is whole days); rows already
+            # mirrored are only status-refreshed
+            backfill_params = {
+                'PageSize': settings.SIGNALWIRE_MIRROR_PAGE_SIZE,
+                'DateSent<': (_utc_day(backfill_before) + timedelta(days=1)).isoformat(),
+            }
+            if backfill_after:
+                backfill_params['DateSent>='] = _utc_day(backfill_after).isoformat()
+            older_created, older_updated, _, stopped_at = _mirror_pass(
+                client, sw_number, backfill_params, max_pages, settle_before
+            )
+            created += older_created
+            updated += older_updated
+            if stopped_at is None:
+                backfill_before = backfill_after = None
+            elif _utc_day(stopped_at) < _utc_day(backfill_before):
+                backfill_before = stopped_at
+            else:
+                # A single day holds more than max_pages of messages; move past it
+                day_start = datetime.combine(_utc_day(backfill_before), time.min, tzinfo=dt_timezone.utc)
+                backfill_before = day_start - timedelta(microseconds=1)
+                error = f'More than {max_pages} pages of messages on {day_start.date()}; the oldest of them were skipped'
+                logger.warning(error)
+    except Exception as exc:
+        failed = True
+        error = f'Unable to mirror SignalWire messages: {exc}'
+        logger.error(error)
+    else:
+        state.high_water_mark = mark
+        state.backfill_before = backfill_before
+        state.backfill_after = backfill_after
+
+    state.last_run_at = timezone.now()
+    state.last_error = error
+    state.messages_created = created
+    state.messages_updated = updated
+    state.save()
+
+    return {
+        'status': 'failed' if failed else 'success',
+        'created': created,
+        'updated': updated,
+        'high_water_mark': state.high_water_mark.isoformat() if state.high_water_mark else None,
+        'backfill_before': state.backfill_before.isoformat() if state.backfill_before else None,
+        'error': error or None,
+    }
@@ -3,168 +3,227 @@ Celery tasks for birthday wishes application.
 """
 import pytz
 import os
+import socket
 from datetime import datetime
 from celery import shared_task
 from django.core.mail import EmailMessage
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from email.utils import formataddr
 from .reports import send_daily_summary_report
+from .context_processors import invalidate_birthday_popup
+from .rendering import PlaceholderContext, get_template_renderer, html_to_sms_text, render_text
+from .utils import send_email_batch, send_sms_batch
+
+
+DEFAULT_WISH_BATCH_SIZE = 100
+DEFAULT_WISH_LEASE_SECONDS = 600
+
+
+def _flush_wish_batch(wishes, activities, logs):
+    """Write one chunk of processed wishes and their activity/log rows."""
+    from birthday.models import ScheduledWish, PatientStatus, CommunicationLog
+
+    # Processed wishes leave the Processing state, so their lease is released
+    for wish in wishes:
+        wish.lease_expires_at = None
+
+    with transaction.atomic():
+        if wishes:
+            ScheduledWish.objects.bulk_update(
+                wishes, ['status', 'sent_at', 'error_message', 'lease_expires_at', 'updated_at']
+            )
+        if activities:
+            PatientStatus.objects.bulk_create(activities)
+        if logs:
+            # Skips SIDs the SignalWire mirror already picked up from a slow batch
+            CommunicationLog.objects.bulk_create_new(logs)
+        # bulk writes bypass model signals; wish/activity state feeds the birthday popup
+        transaction.on_commit(invalidate_birthday_popup)
+
+
+def _mark_wish_failed(wish, channel, error_msg, logs, gateway_number):
+    """Flag a wish as failed and queue the failed SMS log row where applicable."""
+    from birthday.models import CommunicationLog
+
+    wish.status = 'Failed'
+    wish.error_message = error_msg
+    wish.updated_at = timezone.now()
+    if channel == 'SMS':
+        logs.append(CommunicationLog(
+            patient=wish.patient,
+            channel='SMS',
+            direction='Outbound',
+            status='Failed',
+            body=wish.custom_body or (wish.template.body if wish.template else ''),
+            recipient=wish.patient.phone or '',
+            error_message=error_msg,
+            gateway_number=gateway_number
+        ))
 
 
 @shared_task
-def send_scheduled_wishes_task():
+def send_scheduled_wishes_task(batch_size=None):
     """
     Task to process and send all pending scheduled wishes.
     This runs periodically via Celery Beat.
+
+    Wishes are claimed in chunks of `batch_size` (default SCHEDULED_WISHES_BATCH_SIZE)
+    under a Processing lease, so several workers can run this task at once;
+    status updates and activity/log rows are written in bulk at the end of each chunk.
     """
-    from birthday.models import ScheduledWish, PatientStatus, CommunicationLog
+    from birthday.models import ScheduledWish, PatientStatus, CommunicationLog, PracticeSettings
     
+    batch_size = batch_size or getattr(settings, 'SCHEDULED_WISHES_BATCH_SIZE', DEFAULT_WISH_BATCH_SIZE)
+
     # Get California timezone
     ca_tz = pytz.timezone('America/Los_Angeles')
     now = datetime.now(ca_tz)
     
     print(f'[{now.strftime("%Y-%m-%d %H:%M:%S %Z")}] Starting scheduled wishes processing... (v1.1.0)')
     
-    # Get all pending wishes whose scheduled time has passed
-    pending_wishes = ScheduledWish.objects.filter(
-        status='Pending',
-        scheduled_for__lte=now
-    )
-    
-    total = pending_wishes.count()
-    if total == 0:
-        print('No pending wishes to send at this time.')
-        return {'sent': 0, 'failed': 0, 'total': 0}
-    
-    print(f'Found {total} wish(es) to process.')
-    
     sent_count = 0
     failed_count = 0
+    total = 0
     processed_patient_ids = []
+    gateway_number = getattr(settings, 'TWILIO_PHONE_NUMBER', None) or os.getenv('TWILIO_PHONE_NUMBER')
+    lease_seconds = getattr(settings, 'SCHEDULED_WISH_LEASE_SECONDS', DEFAULT_WISH_LEASE_SECONDS)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    practice = PracticeSettings.get_settings()
     
-    for wish in pending_wishes:
-        patient = wish.patient
-        processed_patient_ids.append(patient.id)
-        
-        # Check if patient accepts communications
-        if not patient.accepts_marketing:
-            wish.status = 'Failed'
-            wish.error_message = f'Patient opted out. Reason: {patient.unsubscribe_reason}'
-            wish.save()
-            failed_count += 1
-            continue
-
-        template = wish.template
-        if not template:
-            wish.status = 'Failed'
-            wish.error_message = 'Missing template'
-            wish.save()
-            failed_count += 1
-            continue
-
-        # --- ROUTING ENGINE v1.1.0 ---
-        # We strictly honor the wish.channel field.
-        channel = str(getattr(wish, 'channel', 'Email')).strip()
-        
-        # Print to terminal with high visibility
-        print("="*60)
-        print(f"CORE ENGINE v1.1.0: PROCESSING WISH #{wish.id}")
-        print(f"CHANNEL: {channel} | PATIENT: {patient.first_name} {patient.last_name}")
-        print("="*60)
-
-        try:
-            subject = wish.custom_subject or (template.subject if template else 'Happy Birthday!')
-            body = wish.custom_body or (template.body if template else '')
+    while True:
+        # Claim the next chunk of due wishes (including expired leases); rows held
+        # by other workers are skipped, so concurrent runs never share a wish.
+        wish_ids = ScheduledWish.objects.claim_due(now, batch_size, lease_seconds, worker)
+        if not wish_ids:
+            break
+        total += len(wish_ids)
+        print(f'Claimed {len(wish_ids)} wish(es) to process.')
+
+        chunk = ScheduledWish.objects.filter(pk__in=wish_ids).select_related('patient', 'template')
+
+        wishes_to_update = []
+        activities = []
+        logs = []
+        sms_queue = []
+        email_queue = []
+
+        for wish in chunk:
+            patient = wish.patient
+            processed_patient_ids.append(patient.id)
+            wishes_to_update.append(wish)
             
-            # Placeholder replacement
-            subject = subject.replace('{first_name}', patient.first_name).replace('{last_name}', patient.last_name)
-            body = body.replace('{first_name}', patient.first_name).replace('{last_name}', patient.last_name)
-
-            if channel == 'SMS':
-                print(f"ACTION [v1.1.0]: ROUTING TO SIGNALWIRE SMS ENGINE")
-                if not patient.phone:
-                    raise ValueError("Patient missing phone number for SMS")
-
-                # Send SMS Logic
-                from birthday.utils import send_sms
-                import re, html
-                
-                # HTML to Text conversion
-                text_content = body.replace('</p>', '\n\n').replace('<br>', '\n').replace('<br/>', '\n').replace('<br />', '\n').replace('</div>', '\n')
-                clean_body = html.unescape(re.sub('<[^<]+?>', '', text_content))
-                clean_body = re.sub(r'\n{3,}', '\n\n', clean_body).strip()
-                
-                success, result = send_sms(patient.phone, clean_body)
-                
-                if success:
-                    wish.status = 'Sent'
-                    wish.sent_at = timezone.now()
-                    wish.save()
-                    
-                    PatientStatus.objects.create(
-                        patient=patient,
-                        activity_type='SMS Sent',
-                        description=f'Scheduled Birthday SMS sent',
-                        full_content=clean_body
-                    )
-                    CommunicationLog.objects.create(
-                        patient=patient,
-                        channel='SMS',
-                        direction='Outbound',
-                        status='Sent',
-                        body=clean_body,
-                        recipient=patient.phone,
-                        external_message_id=result,
-                        gateway_number=getattr(settings, 'TWILIO_PHONE_NUMBER', None) or os.getenv('TWILIO_PHONE_NUMBER'),
-                        sent_at=timezone.now()
-                    )
-                    sent_count += 1
-                    print(f"RESULT: SMS SUCCESS (SID: {result})")
-                else:
-                    raise Exception(f"SignalWire Error: {result}")
+            # Check if patient accepts communications
+            if not patient.accepts_marketing:
+                wish.status = 'Failed'
+                wish.error_message = f'Patient opted out. Reason: {patient.unsubscribe_reason}'
+                wish.updated_at = timezone.now()
+                failed_count += 1
+                continue
+
+            template = wish.template
+            if not template:
+                wish.status = 'Failed'
+                wish.error_message = 'Missing template'
+                wish.updated_at = timezone.now()
+                failed_count += 1
+                continue
+
+            # --- ROUTING ENGINE v1.1.0 ---
+            # We strictly honor the wish.channel field.
+            channel = str(getattr(wish, 'channel', 'Email')).strip()
             
-            elif channel == 'Email':
-                print(f"ACTION [v1.1.0]: ROUTING TO DJANGO EMAIL ENGINE")
-                if not patient.email:
-                    raise ValueError("Patient missing email address")
-
-                # HTML Email Logic
-                from django.core.mail import EmailMessage
-                html_body = body
-                if '<p>' in html_body or '<br>' in html_body:
-                    html_body = html_body.replace('<p>', '<p style="margin:0;padding:0;">')
-                else:
-                    html_body = html_body.replace('\n', '<br>')
-                
-                # Signature is already baked into custom_body in views.py
-                # This prevents double signatures.
-                
-                cc_list = [e.strip() for e in (wish.cc_recipients or '').split(',') if e.strip()]
-                bcc_list = [e.strip() for e in (wish.bcc_recipients or '').split(',') if e.strip()]
-                
-                email = EmailMessage(
-                    subject=subject,
-                    body=html_body,
-                    from_email=formataddr((settings.EMAIL_FROM_NAME, settings.DEFAULT_FROM_EMAIL)),
-                    to=[patient.email],
-                    cc=cc_list,
-                    bcc=bcc_list,
+            # Print to terminal with high visibility
+            print("="*60)
+            print(f"CORE ENGINE v1.1.0: PROCESSING WISH #{wish.id}")
+            print(f"CHANNEL: {channel} | PATIENT: {patient.first_name} {patient.last_name}")
+            print("="*60)
+
+            try:
+                # Placeholder replacement (templates are compiled once and cached)
+                context = PlaceholderContext(
+                    patient,
+                    practice_name=practice.practice_name,
+                    plan_duration_days=practice.plan_duration_days,
                 )
-                email.content_subtype = 'html'
-                email.send(fail_silently=False)
+                if wish.custom_subject:
+                    subject = render_text(wish.custom_subject, context)
+                elif template.subject:
+                    subject = get_template_renderer(template, 'subject').render(context)
+                else:
+                    subject = 'Happy Birthday!'
+                if wish.custom_body:
+                    body = render_text(wish.custom_body, context)
+                else:
+                    body = get_template_renderer(template).render(context)
+
+                if channel == 'SMS':
+                    print(f"ACTION [v1.1.0]: ROUTING TO SIGNALWIRE SMS ENGINE")
+                    if not patient.phone:
+                        raise ValueError("Patient missing phone number for SMS")
+
+                    clean_body = html_to_sms_text(body)
+                    
+                    # Queued: the chunk's SMS are sent together over the pooled client below
+                    sms_queue.append((wish, clean_body))
+            
+                elif channel == 'Email':
+                    print(f"ACTION [v1.1.0]: ROUTING TO DJANGO EMAIL ENGINE")
+                    if not patient.email:
+                        raise ValueError("Patient missing email address")
+
+                    # HTML Email Logic
+                    html_body = body
+                    if '<p>' in html_body or '<br>' in html_body:
+                        html_body = html_body.replace('<p>', '<p style="margin:0;padding:0;">')
+                    else:
+                        html_body = html_body.replace('\n', '<br>')
+                    
+                    # Signature is already baked into custom_body in views.py
+                    # This prevents double signatures.
+                    
+                    cc_list = [e.strip() for e in (wish.cc_recipients or '').split(',') if e.strip()]
+                    bcc_list = [e.strip() for e in (wish.bcc_recipients or '').split(',') if e.strip()]
+                    
+                    email = EmailMessage(
+                        subject=subject,
+                        body=html_body,
+                        from_email=formataddr((settings.EMAIL_FROM_NAME, settings.DEFAULT_FROM_EMAIL)),
+                        to=[patient.email],
+                        cc=cc_list,
+                        bcc=bcc_list,
+                    )
+                    email.content_subtype = 'html'
+                    
+                    # Queued: the chunk's emails share one SMTP connection below
+                    email_queue.append((wish, email, subject, body, html_body))
                 
+                else:
+                    raise ValueError(f"Unknown channel detected: {channel}")
+
+            except Exception as e:
+                error_msg = str(e)
+                print(f"CRITICAL ERROR [v1.1.0]: {error_msg}")
+                _mark_wish_failed(wish, channel, error_msg, logs, gateway_number)
+                failed_count += 1
+
+        # Send the chunk's emails over a single SMTP connection
+        email_results = send_email_batch([email for _, email, _, _, _ in email_queue])
+        for (wish, email, subject, body, html_body), (success, error) in zip(email_queue, email_results):
+            patient = wish.patient
+            if success:
                 wish.status = 'Sent'
                 wish.sent_at = timezone.now()
-                wish.save()
+                wish.updated_at = wish.sent_at
                 
-                PatientStatus.objects.create(
+                activities.append(PatientStatus(
                     patient=patient,
                     activity_type='Email Sent',
                     description=f'Scheduled Birthday Wish: {subject}',
                     full_content=body
-                )
-                CommunicationLog.objects.create(
+                ))
+                logs.append(CommunicationLog(
                     patient=patient,
                     channel='Email',
                     direction='Outbound',
@@ -173,32 +232,54 @@ def send_scheduled_wishes_task():
                     body=html_body,
                     recipient=patient.email,
                     sent_at=timezone.now()
-                )
+                ))
                 sent_count += 1
-                print("RESULT: EMAIL SUCCESS")
-            
+                print(f"RESULT: EMAIL SUCCESS FOR WISH #{wish.id}")
             else:
-                raise ValueError(f"Unknown channel detected: {channel}")
-
-        except Exception as e:
-            error_msg = str(e)
-            print(f"CRITICAL ERROR [v1.1.0]: {error_msg}")
-            wish.status = 'Failed'
-            wish.error_message = error_msg
-            wish.save()
-            if channel == 'SMS':
-                CommunicationLog.objects.create(
+                print(f"CRITICAL ERROR [v1.1.0]: WISH #{wish.id}: {error}")
+                _mark_wish_failed(wish, 'Email', error, logs, gateway_number)
+                failed_count += 1
+
+        # Send the chunk's SMS concurrently; results come back in queue order
+        sms_results = send_sms_batch([(wish.patient.phone, clean_body) for wish, clean_body in sms_queue])
+        for (wish, clean_body), (success, result) in zip(sms_queue, sms_results):
+            patient = wish.patient
+            if success:
+                wish.status = 'Sent'
+                wish.sent_at = timezone.now()
+                wish.updated_at = wish.sent_at
+                
+                activities.append(PatientStatus(
+                    patient=patient,
+                    activity_type='SMS Sent',
+                    description=f'Scheduled Birthday SMS sent',
+                    full_content=clean_body
+                ))
+                logs.append(CommunicationLog(
                     patient=patient,
                     channel='SMS',
                     direction='Outbound',
-                    status='Failed',
-                    body=wish.custom_body or (wish.template.body if wish.template else ''),
-                    recipient=patient.phone or '',
-                    error_message=error_msg,
-                    gateway_number=getattr(settings, 'TWILIO_PHONE_NUMBER', None) or os.getenv('TWILIO_PHONE_NUMBER')
-                )
-            failed_count += 1
+                    status='Sent',
+                    body=clean_body,
+                    recipient=patient.phone,
+                    external_message_id=result,
+                    gateway_number=gateway_number,
+                    sent_at=timezone.now()
+                ))
+                sent_count += 1
+                print(f"RESULT: SMS SUCCESS FOR WISH #{wish.id} (SID: {result})")
+            else:
+                error_msg = f"SignalWire Error: {result}"
+                print(f"CRITICAL ERROR [v1.1.0]: WISH #{wish.id}: {error_msg}")
+                _mark_wish_failed(wish, 'SMS', error_msg, logs, gateway_number)
+                failed_count += 1
+
+        _flush_wish_batch(wishes_to_update, activities, logs)
     
+    if total == 0:
+        print('No pending wishes to send at this time.')
+        return {'sent': 0, 'failed': 0, 'total': 0}
+
     print(f'Done processing {total} wishes. Sent: {sent_count}, Failed: {failed_count}')
     
     # Trigger the CEO summary report immediately for the patients just processed
@@ -207,3 +288,63 @@ def send_scheduled_wishes_task():
         send_daily_summary_report(patient_ids=processed_patient_ids)
         
     return {'sent': sent_count, 'failed': failed_count, 'total': total}
+
+
+@shared_task
+def run_sync_job_task(job_id):
+    """Run an SMO SyncJob (practice list, practice patients or selected-patient import)."""
+    from birthday.models import SyncJob
+    from birthday.smo_sync import run_sync_job
+
+    job = SyncJob.objects.select_related('practice').filter(pk=job_id).first()
+    if job is None or job.is_finished:
+        print(f'Sync job #{job_id} not found or already finished.')
+        return None
+
+    run_sync_job(job)
+    print(f'Sync job #{job.pk} {job.status}: {job.message}')
+    return job.as_dict()
+
+
+@shared_task
+def run_import_job_task(job_id):
+    """Import the patient files staged for an ImportJob."""
+    from birthday.importer import run_import_job
+    from birthday.models import ImportJob
+
+    job = ImportJob.objects.filter(pk=job_id).first()
+    if job is None or job.is_finished:
+        print(f'Import job #{job_id} not found or already finished.')
+        return None
+
+    run_import_job(job)
+    print(f'Import job #{job.pk} {job.status}: {job.message}')
+    return job.as_dict()
+
+
+@shared_task
+def mirror_signalwire_messages_task():
+    """Copy new SignalWire messages into CommunicationLog (scheduled by Celery Beat)."""
+    from birthday.sms_mirror import mirror_signalwire_messages
+
+    # Overlapping runs are skipped by the row lock on SmsMirrorState
+    result = mirror_signalwire_messages()
+    print(f"SignalWire mirror {result['status']}: {result.get('created', 0)} new, {result.get('updated', 0)} updated")
+    return result
+
+
+@shared_task
+def process_sms_inbox_task():
+    """Apply the SignalWire webhooks (inbound messages, delivery receipts) waiting in the inbox."""
+    from django.core.cache import cache
+    from birthday.sms_inbox import DRAIN_SCHEDULED_KEY, process_sms_inbox
+
+    # Webhooks arriving from now on schedule the next drain
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    result = process_sms_inbox()
+    if result['processed']:
+        print(
+            f"SMS inbox drained: {result['processed']} webhooks, {result['logged']} messages logged, "
+            f"{result['delivery_updates']} delivery statuses updated"
+        )
+    return result
@@ -1,10 +1,41 @@
+import importlib
+import json
 import os
+import smtplib
+import tempfile
+import threading
+from datetime import date, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
 
+from django.apps import apps as django_apps
+from django.db import connection
+from django.db.models import Exists, OuterRef
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Patient, PatientStatus, ScheduledWish
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+
+from .context_processors import get_birthday_popup, popup_cache_key, todays_birthdays_popup
+from .dashboard import compute_dashboard_stats, get_dashboard_stats
+from .importer import import_patient_files, parse_patient_file, run_import_job, stage_import_files
+from .models import CommunicationLog, CommunicationLogQuerySet, ImportJob, MessageTemplate, Patient, PatientStatus, PlanHistory, Practice, PracticeSettings, ScheduledWish, SmsInboxMessage, SmsMirrorState, SmsThread, SyncJob, write_audit_records
+from .rendering import PlaceholderContext, get_template_renderer, html_to_sms_text, render_text
+from .reports import get_report_data
+from .search import PatientSearchDocument, phone_digits
+from .smo_sync import PatientMatchIndex, bulk_sync_patients, sync_practice_patients
+from .sms_inbox import enqueue_delivery_receipt, enqueue_inbound_sms, process_sms_inbox
+from .sms_mirror import mirror_signalwire_messages
+from .tasks import mirror_signalwire_messages_task, run_import_job_task, run_sync_job_task, send_scheduled_wishes_task
+from .utils import SignalWireSMSClient, send_email_batch, signalwire_signature
 
 
 class DailyReportApiTests(TestCase):
@@ -133,6 +164,1883 @@ class DailyReportApiTests(TestCase):
         self.assertEqual(yesterday_response.json()['report']['summary']['total_sent'], 1)
 
 
+class BirthdayOrdinalTests(TestCase):
+    def _patient(self, first_name, dob):
+        return Patient.objects.create(
+            first_name=first_name,
+            last_name='Test',
+            dob=dob,
+            phone='5550001111',
+            email=f'{first_name.lower()}@example.com',
+        )
+
+    def test_ordinal_maintained_on_save(self):
+        patient = self._patient('Ann', '1990-07-04')
+        self.assertEqual(patient.birthday_ordinal, 704)
+
+        patient.dob = date(1990, 12, 25)
+        patient.save(update_fields=['dob'])
+        patient.refresh_from_db()
+        self.assertEqual(patient.birthday_ordinal, 1225)
+
+    def test_bulk_create_and_sql_resync_set_ordinal(self):
+        Patient.objects.bulk_create([
+            Patient(first_name='Bulk', last_name='Test', dob=date(1985, 3, 9), phone='1', email='b@example.com'),
+        ])
+        self.assertEqual(Patient.objects.get(first_name='Bulk').birthday_ordinal, 309)
+
+        Patient.objects.update(birthday_ordinal=None)
+        Patient.objects.sync_birthday_ordinals()
+        self.assertEqual(Patient.objects.get(first_name='Bulk').birthday_ordinal, 309)
+
+    def test_upsert_of_dob_refreshes_ordinal(self):
+        Patient.objects.create(first_name='Ups', last_name='Test', dob=date(1985, 3, 9), external_id='smo-1')
+        Patient.objects.bulk_create(
+            [Patient(first_name='Ups', last_name='Test', dob=date(1985, 11, 2), external_id='smo-1')],
+            update_conflicts=True, unique_fields=['external_id'], update_fields=['dob'],
+        )
+        self.assertEqual(Patient.objects.get(external_id='smo-1').birthday_ordinal, 1102)
+
+    def test_upcoming_birthdays_wraps_year(self):
+        self._patient('Jan', date(1980, 1, 5))
+        self._patient('Dec', date(1980, 12, 30))
+        self._patient('Nov', date(1980, 11, 1))
+
+        names = [p.first_name for p in Patient.objects.upcoming_birthdays(date(2025, 12, 1))]
+        self.assertEqual(names, ['Dec', 'Jan', 'Nov'])
+
+    def test_feb_29_follows_mar_1_in_non_leap_years(self):
+        self._patient('Leap', date(2000, 2, 29))
+        self._patient('March', date(1990, 3, 2))
+
+        names = [p.first_name for p in Patient.objects.upcoming_birthdays(date(2025, 2, 28))]
+        self.assertEqual(names, ['Leap', 'March'])
+
+        window = Patient.objects.birthdays_between(date(2025, 3, 1), date(2025, 3, 1))
+        self.assertEqual([p.first_name for p in window], ['Leap'])
+        window = Patient.objects.birthdays_between(date(2024, 3, 1), date(2024, 3, 1))
+        self.assertEqual(list(window), [])
+        window = Patient.objects.birthdays_between(date(2024, 2, 29), date(2024, 2, 29))
+        self.assertEqual([p.first_name for p in window], ['Leap'])
+
+    def test_birthdays_between_crosses_year_boundary(self):
+        self._patient('Dec', date(1980, 12, 30))
+        self._patient('Jan', date(1980, 1, 2))
+        self._patient('Feb', date(1980, 2, 2))
+
+        window = Patient.objects.birthdays_between(date(2025, 12, 25), date(2026, 1, 5))
+        self.assertEqual(sorted(p.first_name for p in window), ['Dec', 'Jan'])
+
+
+class OutreachIndexPlanTests(TestCase):
+    """The hot outreach lookups should be answered from the composite/partial indexes."""
+
+    def assertUsesIndex(self, queryset, index_names):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_patient_status_outreach_lookup(self):
+        sent_activity_qs = PatientStatus.objects.filter(
+            patient_id=OuterRef('pk'),
+            activity_type__in=['Email Sent', 'SMS Sent'],
+        )
+        self.assertUsesIndex(
+            Patient.objects.annotate(has_sent_activity=Exists(sent_activity_qs)),
+            ['ps_patient_act_created_idx', 'ps_outreach_idx'],
+        )
+        self.assertUsesIndex(
+            PatientStatus.objects.filter(patient_id=1, activity_type='Email Sent', created_at__gte=timezone.now()),
+            ['ps_patient_act_created_idx'],
+        )
+
+    def test_scheduled_wish_lookups(self):
+        pending_wish_qs = ScheduledWish.objects.filter(patient_id=OuterRef('pk'), status='Pending')
+        self.assertUsesIndex(
+            Patient.objects.annotate(has_pending_wish=Exists(pending_wish_qs)),
+            ['sw_patient_status_idx', 'sw_pending_sched_idx'],
+        )
+        self.assertUsesIndex(
+            ScheduledWish.objects.filter(status='Pending', scheduled_for__lte=timezone.now()),
+            ['sw_status_sched_idx', 'sw_pending_sched_idx'],
+        )
+
+    def test_communication_log_channel_lookup(self):
+        self.assertUsesIndex(
+            CommunicationLog.objects.filter(channel='SMS', created_at__gte=timezone.now()),
+            ['cl_channel_created_idx'],
+        )
+
+
+class BirthdayReportDataTests(TestCase):
+    def _patient(self, index, **kwargs):
+        today = date.today()
+        defaults = {
+            'first_name': f'Patient{index}',
+            'last_name': 'Report',
+            'dob': (today - timezone.timedelta(days=index + 1)).replace(year=1992),
+            'phone': '5550002222',
+            'email': f'report{index}@example.com',
+        }
+        defaults.update(kwargs)
+        return Patient.objects.create(**defaults)
+
+    def test_query_count_is_independent_of_patient_count(self):
+        self._patient(0)
+        with self.assertNumQueries(2):
+            context = get_report_data('monthly')
+        self.assertEqual(context['total_birthdays'], 1)
+
+        for index in range(1, 8):
+            patient = self._patient(index)
+            PatientStatus.objects.create(patient=patient, activity_type='Email Sent')
+            PatientStatus.objects.create(patient=patient, activity_type='SMS Sent')
+        with self.assertNumQueries(2):
+            context = get_report_data('monthly')
+        self.assertEqual(context['total_birthdays'], 8)
+        self.assertEqual(context['email_sent'], 7)
+        self.assertEqual(context['sms_sent'], 7)
+
+    def test_outreach_flags_and_buckets(self):
+        today = date.today()
+        active = self._patient(1, patient_type='Proceed', enrollment_date=today - timezone.timedelta(days=340))
+        lapsed = self._patient(2, patient_type='Proceed', enrollment_date=today - timezone.timedelta(days=400))
+        no_date = self._patient(3, patient_type='Proceed')
+        regular = self._patient(4)
+        outreach = PatientStatus.objects.create(patient=active, activity_type='SMS Sent')
+
+        context = get_report_data('monthly')
+        by_id = {p.id: p for p in context['patients']}
+
+        self.assertEqual([p.id for p in context['proceed_active']], [active.id])
+        self.assertEqual([p.id for p in context['expiring_soon']], [active.id])
+        self.assertEqual(sorted(p.id for p in context['proceed_inactive']), sorted([lapsed.id, no_date.id]))
+        self.assertEqual([p.id for p in context['not_registered']], [regular.id])
+        self.assertEqual(by_id[active.id].status_label, 'Active')
+        self.assertEqual(by_id[lapsed.id].status_class, 'danger')
+        self.assertEqual(by_id[regular.id].status_label, 'Not Regd')
+        self.assertTrue(by_id[active.id].sms_done)
+        self.assertFalse(by_id[active.id].email_done)
+        self.assertEqual(by_id[active.id].last_outreach, outreach)
+        self.assertIsNone(by_id[regular.id].last_outreach)
+        # Ordered by the birthday date inside the window
+        bdays = [p.bday_this_year for p in context['patients']]
+        self.assertEqual(bdays, sorted(bdays))
+
+
+class SendScheduledWishesTaskTests(TestCase):
+    def setUp(self):
+        self.template = MessageTemplate.objects.create(
+            name='Birthday Email',
+            type='Email',
+            subject='Happy Birthday {first_name}!',
+            body='Dear {first_name} {last_name}, have a great day.',
+        )
+        self.due = timezone.now() - timezone.timedelta(minutes=5)
+
+    def _wish(self, index, **patient_kwargs):
+        patient = Patient.objects.create(
+            first_name=f'Wish{index}',
+            last_name='Patient',
+            dob='1990-06-15',
+            phone='5550003333',
+            email=f'wish{index}@example.com',
+            **patient_kwargs,
+        )
+        return ScheduledWish.objects.create(
+            patient=patient, template=self.template, channel='Email', scheduled_for=self.due,
+        )
+
+    def test_batches_sends_and_bulk_writes(self):
+        wishes = [self._wish(index) for index in range(5)]
+        opted_out = self._wish(5, accepts_marketing=False, unsubscribe_reason='Moved away')
+        no_template = self._wish(6)
+        no_template.template = None
+        no_template.save()
+
+        result = send_scheduled_wishes_task(batch_size=2)
+
+        self.assertEqual(result, {'sent': 5, 'failed': 2, 'total': 7})
+        for wish in wishes:
+            wish.refresh_from_db()
+            self.assertEqual(wish.status, 'Sent')
+            self.assertIsNotNone(wish.sent_at)
+        opted_out.refresh_from_db()
+        self.assertEqual(opted_out.status, 'Failed')
+        self.assertIn('Moved away', opted_out.error_message)
+        no_template.refresh_from_db()
+        self.assertEqual(no_template.error_message, 'Missing template')
+
+        self.assertEqual(PatientStatus.objects.filter(activity_type='Email Sent').count(), 5)
+        self.assertEqual(CommunicationLog.objects.filter(channel='Email', status='Sent').count(), 5)
+        wish_emails = [m for m in mail.outbox if m.to[0].startswith('wish')]
+        self.assertEqual(len(wish_emails), 5)
+        self.assertEqual(wish_emails[0].subject, 'Happy Birthday Wish0!')
+
+    def test_no_pending_wishes(self):
+        self.assertEqual(send_scheduled_wishes_task(), {'sent': 0, 'failed': 0, 'total': 0})
+
+
+class StubSignalWireHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the SignalWire Messages.json endpoint."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        to_number = form['To'][0]
+        self.server.received.append(form)
+        if to_number.endswith('0000'):
+            status, payload = 400, {'message': 'Invalid To number'}
+        else:
+            status, payload = 201, {'sid': f'SM{to_number[1:]}'}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # Messages list: serve the page registered for the request's Page parameter
+        query = parse_qs(self.path.partition('?')[2])
+        self.server.listed.append(query)
+        pages = self.server.older_pages if 'DateSent<' in query else self.server.pages
+        data = json.dumps(pages[int(query.get('Page', ['0'])[0])]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSignalWireMixin:
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubSignalWireHandler)
+        self.server.received = []
+        self.server.listed = []
+        self.server.pages = {}
+        self.server.older_pages = {}  # served to backfill requests (DateSent<)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.space_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.original_env = {
+            key: os.environ.get(key)
+            for key in ('SIGNALWIRE_PROJECT_ID', 'SIGNALWIRE_API_TOKEN', 'SIGNALWIRE_SPACE_URL', 'TWILIO_PHONE_NUMBER')
+        }
+        os.environ.update({
+            'SIGNALWIRE_PROJECT_ID': 'project',
+            'SIGNALWIRE_API_TOKEN': 'token',
+            'SIGNALWIRE_SPACE_URL': self.space_url,
+            'TWILIO_PHONE_NUMBER': '5559990000',
+        })
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for key, value in self.original_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        super().tearDown()
+
+
+class SignalWireSMSClientTests(StubSignalWireMixin, TestCase):
+    def test_send_batch_returns_results_in_input_order(self):
+        client = SignalWireSMSClient(max_workers=4)
+        numbers = [f'55512340{index:02d}' for index in range(1, 21)] + ['5551230000']
+
+        results = client.send_batch([(number, f'Hello {number}') for number in numbers])
+        client.close()
+
+        self.assertEqual(len(self.server.received), len(numbers))
+        self.assertEqual(results[:-1], [(True, f'SM1{number}') for number in numbers[:-1]])
+        self.assertEqual(results[-1], (False, 'Invalid To number'))
+
+    def test_send_batch_empty(self):
+        self.assertEqual(SignalWireSMSClient().send_batch([]), [])
+
+    def test_iter_message_pages_follows_next_page_uri(self):
+        client = SignalWireSMSClient()
+        next_uri = '/api/laml/2010-04-01/Accounts/project/Messages.json?To=%2B15559990000&PageSize=1&Page=1'
+        self.server.pages = {
+            0: {'messages': [{'sid': 'SM2'}], 'next_page_uri': next_uri},
+            1: {'messages': [{'sid': 'SM1'}], 'next_page_uri': None},
+        }
+
+        pages = list(client.iter_message_pages({'To': '+15559990000', 'PageSize': 1}))
+        client.close()
+
+        self.assertEqual(pages, [[{'sid': 'SM2'}], [{'sid': 'SM1'}]])
+        self.assertEqual(self.server.listed[1]['Page'], ['1'])
+        self.assertEqual(self.server.listed[1]['To'], ['+15559990000'])
+
+    def test_send_requests_delivery_receipts(self):
+        client = SignalWireSMSClient(status_callback_url='https://proceed.example/messages/signalwire/status/')
+        client.send('5551234567', 'Hi')
+        client.close()
+        self.assertEqual(self.server.received[0]['StatusCallback'], ['https://proceed.example/messages/signalwire/status/'])
+
+    def test_missing_credentials(self):
+        os.environ.pop('SIGNALWIRE_API_TOKEN')
+        client = SignalWireSMSClient()
+        self.assertEqual(client.send('5551234567', 'Hi'), (False, 'SignalWire credentials missing'))
+
+
+class SendScheduledSmsWishesTests(StubSignalWireMixin, TestCase):
+    def test_sms_wishes_sent_through_batch_client(self):
+        template = MessageTemplate.objects.create(name='Birthday SMS', type='SMS', body='<p>Hi {first_name}!</p>')
+        due = timezone.now() - timezone.timedelta(minutes=5)
+        for index, phone in enumerate(['5551110001', '5551110002', '5551110000']):
+            patient = Patient.objects.create(
+                first_name=f'Sms{index}', last_name='Patient', dob='1990-06-15',
+                phone=phone, email=f'sms{index}@example.com',
+            )
+            ScheduledWish.objects.create(patient=patient, template=template, channel='SMS', scheduled_for=due)
+
+        result = send_scheduled_wishes_task(batch_size=2)
+
+        self.assertEqual(result, {'sent': 2, 'failed': 1, 'total': 3})
+        sent_log = CommunicationLog.objects.get(recipient='5551110001')
+        self.assertEqual(sent_log.status, 'Sent')
+        self.assertEqual(sent_log.external_message_id, 'SM15551110001')
+        self.assertEqual(sent_log.body, 'Hi Sms0!')
+        failed_wish = ScheduledWish.objects.get(patient__phone='5551110000')
+        self.assertEqual(failed_wish.status, 'Failed')
+        self.assertEqual(failed_wish.error_message, 'SignalWire Error: Invalid To number')
+        self.assertTrue(CommunicationLog.objects.filter(recipient='5551110000', status='Failed').exists())
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """locmem backend that drops the connection once and rejects a blocked address."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = 0
+        self.is_open = False
+        self.dropped = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        self.opened += 1
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        if not self.is_open:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if messages[0].to == ['drop@example.com'] and not self.dropped:
+            self.dropped = True
+            self.is_open = False
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if messages[0].to == ['blocked@example.com']:
+            raise smtplib.SMTPRecipientsRefused({'blocked@example.com': (550, b'Rejected')})
+        return super().send_messages(messages)
+
+
+class SendEmailBatchTests(TestCase):
+    def _message(self, to):
+        return EmailMessage(subject='Hi', body='Hello', to=[to])
+
+    def test_single_connection_with_reconnect_and_per_message_results(self):
+        connection = FlakyEmailBackend()
+        messages = [self._message(to) for to in
+                    ['a@example.com', 'drop@example.com', 'blocked@example.com', 'b@example.com']]
+
+        results = send_email_batch(messages, connection=connection)
+
+        self.assertEqual([success for success, _ in results], [True, True, False, True])
+        self.assertIn('blocked@example.com', results[2][1])
+        self.assertEqual(connection.opened, 2)  # initial open + one reconnect
+        self.assertEqual([m.to[0] for m in mail.outbox], ['a@example.com', 'drop@example.com', 'b@example.com'])
+
+    def test_failed_email_recorded_on_wish(self):
+        template = MessageTemplate.objects.create(name='Birthday Email', type='Email', subject='Hi', body='Hello')
+        patient = Patient.objects.create(
+            first_name='Blocked', last_name='Patient', dob='1990-06-15',
+            phone='5550004444', email='blocked@example.com',
+        )
+        wish = ScheduledWish.objects.create(
+            patient=patient, template=template, channel='Email',
+            scheduled_for=timezone.now() - timezone.timedelta(minutes=1),
+        )
+
+        with self.settings(EMAIL_BACKEND='birthday.tests.FlakyEmailBackend'):
+            result = send_scheduled_wishes_task()
+
+        self.assertEqual(result, {'sent': 0, 'failed': 1, 'total': 1})
+        wish.refresh_from_db()
+        self.assertEqual(wish.status, 'Failed')
+        self.assertIn('blocked@example.com', wish.error_message)
+
+
+class ScheduledWishClaimTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Claim', last_name='Patient', dob='1990-06-15',
+            phone='5550005555', email='claim@example.com',
+        )
+        self.now = timezone.now()
+        self.wishes = [
+            ScheduledWish.objects.create(
+                patient=self.patient, channel='Email',
+                scheduled_for=self.now - timezone.timedelta(minutes=index + 1),
+            )
+            for index in range(5)
+        ]
+
+    def test_concurrent_claims_are_disjoint(self):
+        first = ScheduledWish.objects.claim_due(self.now, 3, 600, 'worker-a')
+        second = ScheduledWish.objects.claim_due(self.now, 3, 600, 'worker-b')
+        third = ScheduledWish.objects.claim_due(self.now, 3, 600, 'worker-c')
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertEqual(third, [])
+        self.assertFalse(set(first) & set(second))
+        claimed = ScheduledWish.objects.get(pk=first[0])
+        self.assertEqual(claimed.status, 'Processing')
+        self.assertEqual(claimed.claimed_by, 'worker-a')
+        self.assertGreater(claimed.lease_expires_at, self.now + timezone.timedelta(seconds=590))
+
+    def test_expired_leases_are_reclaimed(self):
+        claimed = ScheduledWish.objects.claim_due(self.now, 5, 60, 'crashed-worker')
+        self.assertEqual(len(claimed), 5)
+
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timezone.timedelta(seconds=30)):
+            self.assertEqual(ScheduledWish.objects.claim_due(self.now, 5, 60, 'worker-b'), [])
+
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timezone.timedelta(seconds=120)):
+            reclaimed = ScheduledWish.objects.claim_due(self.now, 5, 60, 'worker-b')
+        self.assertEqual(sorted(reclaimed), sorted(claimed))
+
+    def test_lease_starts_at_claim_time_not_task_start(self):
+        # A task that started long ago (stale `now`) must still hand out a live lease
+        claim_time = self.now + timezone.timedelta(seconds=300)
+        with mock.patch('django.utils.timezone.now', return_value=claim_time):
+            claimed = ScheduledWish.objects.claim_due(self.now, 5, 60, 'slow-worker')
+        self.assertEqual(len(claimed), 5)
+        self.assertFalse(
+            ScheduledWish.objects.filter(pk__in=claimed).exclude(
+                lease_expires_at=claim_time + timezone.timedelta(seconds=60)
+            ).exists()
+        )
+
+        # Another worker running just after the claim, also with a stale cutoff, gets nothing
+        with mock.patch('django.utils.timezone.now', return_value=claim_time + timezone.timedelta(seconds=1)):
+            self.assertEqual(ScheduledWish.objects.claim_due(self.now, 5, 60, 'worker-b'), [])
+
+    def test_task_skips_wishes_claimed_elsewhere_and_releases_lease(self):
+        held = ScheduledWish.objects.claim_due(self.now, 2, 600, 'other-worker')
+
+        result = send_scheduled_wishes_task()
+
+        self.assertEqual(result['total'], 3)
+        self.assertEqual(ScheduledWish.objects.filter(pk__in=held, status='Processing').count(), 2)
+        processed = ScheduledWish.objects.exclude(pk__in=held)
+        self.assertFalse(processed.filter(status__in=['Pending', 'Processing']).exists())
+        self.assertFalse(processed.filter(lease_expires_at__isnull=False).exists())
+
+
+class TemplateRenderingTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Ana',
+            last_name='Lopez',
+            dob=date(1990, 6, 15),
+            membership_plan='Gold',
+            enrollment_date=date(2024, 1, 1),
+        )
+        self.context = PlaceholderContext(
+            self.patient, practice_name='Implants Guru', plan_duration_days=365, today=date(2025, 6, 1),
+        )
+
+    def test_renders_all_placeholders(self):
+        text = '{first_name} {last_name} turns {age_turning} - {plan} until {expiry_date} at {practice_name}'
+        self.assertEqual(
+            render_text(text, self.context),
+            'Ana Lopez turns 35 - Gold until Dec 31, 2024 at Implants Guru',
+        )
+
+    def test_age_turning_after_birthday_counts_next_year(self):
+        context = PlaceholderContext(self.patient, today=date(2025, 7, 1))
+        self.assertEqual(render_text('{age_turning}', context), '36')
+
+    def test_literal_and_unknown_braces_pass_through(self):
+        text = 'Hi {first_name}, {unknown} stays, so do {{braces}} and } {'
+        self.assertEqual(render_text(text, self.context), 'Hi Ana, {unknown} stays, so do {{braces}} and } {')
+
+    def test_template_renderer_recompiles_when_template_changes(self):
+        template = MessageTemplate.objects.create(name='Greeting', type='Email', subject='Hi', body='Hello {first_name}')
+        self.assertEqual(get_template_renderer(template).render(self.context), 'Hello Ana')
+        self.assertIs(get_template_renderer(template), get_template_renderer(template))
+
+        template.body = 'Happy birthday {first_name} {last_name}'
+        template.save()
+        self.assertEqual(get_template_renderer(template).render(self.context), 'Happy birthday Ana Lopez')
+
+    def test_html_to_sms_text(self):
+        body = '<p>Hi <b>Ana</b>,</p><p>Enjoy&nbsp;your day!<br/>Line two<BR></p><div>Team</div>\n\n\n\nBye'
+        self.assertEqual(html_to_sms_text(body), 'Hi Ana,\n\nEnjoy\xa0your day!\nLine two\n\nTeam\n\nBye')
+
+
+class BirthdayPopupCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = date.today()
+        self.patient = Patient.objects.create(
+            first_name='Popup',
+            last_name='Patient',
+            dob=self.today.replace(year=1992),
+            email='popup@example.com',
+        )
+        cache.clear()
+
+    def test_context_processor_defers_to_endpoint_when_cold(self):
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(0):
+            context = todays_birthdays_popup(request)
+        self.assertTrue(context['birthday_popup_lazy'])
+        self.assertEqual(context['todays_birthdays_popup_count'], 0)
+
+    def test_cached_payload_is_served_without_queries(self):
+        payload = get_birthday_popup(self.today)
+        self.assertEqual(payload['todays_birthdays_popup_count'], 1)
+        self.assertEqual(payload['todays_birthdays_popup'][0]['first_name'], 'Popup')
+        self.assertFalse(payload['is_tomorrow'])
+
+        with self.assertNumQueries(0):
+            context = todays_birthdays_popup(RequestFactory().get('/'))
+        self.assertEqual(context, payload)
+
+    def test_writes_invalidate_cached_payload(self):
+        get_birthday_popup(self.today)
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduledWish.objects.create(
+                patient=self.patient, channel='Email', scheduled_for=timezone.now(), status='Pending',
+            )
+        self.assertIsNone(cache.get(popup_cache_key(self.today)))
+        self.assertTrue(get_birthday_popup(self.today)['todays_birthdays_popup'][0]['has_pending_wish'])
+
+    def test_patient_saves_only_invalidate_for_popup_fields(self):
+        get_birthday_popup(self.today)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.phone = '5550009999'
+            self.patient.save()
+        self.assertIsNotNone(cache.get(popup_cache_key(self.today)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.first_name = 'Renamed'
+            self.patient.save()
+        self.assertIsNone(cache.get(popup_cache_key(self.today)))
+
+    def test_popup_api_returns_payload_and_markup(self):
+        response = self.client.get(reverse('birthday_popup_api'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['patients'][0]['pk'], self.patient.pk)
+        self.assertIn('todayBirthdayPopup', data['html'])
+        self.assertIn(reverse('patient_detail', args=[self.patient.pk]), data['html'])
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = date(2026, 3, 15)
+        rows = [
+            ('Gold', 'Proceed', 10),      # active
+            ('Silver', 'Proceed', 340),   # active, expiring soon
+            ('Bronze', 'Regular', 370),   # just expired
+            ('Gold', 'Regular', 500),     # expired
+        ]
+        for index, (plan, patient_type, days_ago) in enumerate(rows):
+            Patient.objects.create(
+                first_name=f'Stats{index}',
+                last_name='Patient',
+                dob='1980-01-01',
+                membership_plan=plan,
+                patient_type=patient_type,
+                enrollment_date=self.today - timezone.timedelta(days=days_ago),
+            )
+        patient = Patient.objects.first()
+        for change_type, created in [
+            ('Upgrade', '2026-03-02'),
+            ('Upgrade', '2026-01-20'),
+            ('Downgrade', '2025-12-05'),
+            ('Renewal', '2025-06-01'),  # outside the 6-month chart, still in totals
+        ]:
+            history = PlanHistory.objects.create(patient=patient, old_plan='Silver', new_plan='Gold', change_type=change_type)
+            PlanHistory.objects.filter(pk=history.pk).update(
+                created_at=timezone.make_aware(timezone.datetime.fromisoformat(created + 'T12:00'))
+            )
+
+    def test_counts_and_chart_in_three_queries(self):
+        # plan duration, membership aggregate, plan-transition chart
+        with self.assertNumQueries(3):
+            stats = compute_dashboard_stats(self.today)
+
+        self.assertEqual(stats['total_patients'], 4)
+        self.assertEqual(stats['active_count'], 2)
+        self.assertEqual(stats['expiring_soon_count'], 1)
+        self.assertEqual(stats['just_expired_count'], 1)
+        self.assertEqual(stats['expired_total_count'], 2)
+        self.assertEqual((stats['proceed_count'], stats['regular_count']), (2, 2))
+        self.assertEqual((stats['gold_count'], stats['silver_count'], stats['bronze_count']), (1, 1, 0))
+
+        self.assertEqual(stats['chart_labels'], ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'Mar'])
+        self.assertEqual(stats['chart_upgrades'], [0, 0, 0, 1, 0, 1])
+        self.assertEqual(stats['chart_downgrades'], [0, 0, 1, 0, 0, 0])
+        self.assertEqual(stats['chart_renewals'], [0] * 6)
+        self.assertEqual((stats['total_up'], stats['total_down'], stats['total_ren']), (2, 1, 1))
+
+    def test_counts_follow_plan_duration(self):
+        PracticeSettings.objects.create(plan_duration_days=180)
+
+        stats = compute_dashboard_stats(self.today)
+
+        self.assertEqual(stats['active_count'], 1)
+        self.assertEqual(stats['expiring_soon_count'], 0)
+        self.assertEqual(stats['just_expired_count'], 0)
+        self.assertEqual(stats['expired_total_count'], 3)
+
+    def test_stats_are_cached(self):
+        stats = get_dashboard_stats(self.today)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_stats(self.today), stats)
+
+    def test_index_page_query_count(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+
+class FakeSMOResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSMOSession:
+    """Serves canned SMO patient pages, keyed by the requested page number."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.requests.append((url, dict(params or {})))
+        return FakeSMOResponse(self.pages(params or {}))
+
+
+class SMOPatientSyncTests(TestCase):
+    def setUp(self):
+        self.practice = Practice.objects.create(external_id=7, name='Palm Desert')
+
+    def _records(self, start, count, **overrides):
+        return [
+            {
+                'id': index,
+                'first_name': f'Smo{index}',
+                'last_name': 'Patient',
+                'email': f'smo{index}@example.com',
+                'phone': '+1 (555) 000-1234',
+                'dob': '1985-04-12',
+                **overrides,
+            }
+            for index in range(start, start + count)
+        ]
+
+    def test_streams_pages_and_bulk_upserts(self):
+        existing = Patient.objects.create(
+            external_id='2', first_name='Old', last_name='Name', dob=date(1970, 1, 1), phone='5550000000', email='old@example.com',
+        )
+        records = self._records(1, 5) + [{'first_name': 'No', 'last_name': 'Id'}] + self._records(6, 1, dob=None)
+        session = FakeSMOSession(lambda params: {
+            'patients': records[(params['page'] - 1) * 3:params['page'] * 3],
+            'total_pages': 3,
+        })
+
+        with self.assertNumQueries(16):
+            result = sync_practice_patients(self.practice, page_size=3, session=session)
+
+        self.assertEqual(result, {'fetched': 7, 'created': 4, 'updated': 1, 'skipped': 2, 'pages': 3})
+        self.assertEqual([params['page'] for _, params in session.requests], [1, 2, 3])
+        existing.refresh_from_db()
+        self.assertEqual((existing.first_name, existing.dob), ('Smo2', date(1985, 4, 12)))
+        self.assertEqual(existing.birthday_ordinal, 412)
+        self.assertEqual(existing.phone, '5550001234')
+        self.assertEqual(existing.practice, self.practice)
+        self.assertFalse(Patient.objects.filter(external_id='6').exists())
+        # One 'Added' activity per newly created patient (the existing one keeps its own)
+        self.assertEqual(PatientStatus.objects.filter(activity_type='Added').count(), 5)
+
+    def test_incremental_sync_requests_changes_since_last_sync(self):
+        session = FakeSMOSession(lambda params: {'patients': self._records(1, 2), 'has_more': False})
+        sync_practice_patients(self.practice, session=session)
+        self.practice.refresh_from_db()
+        self.assertIsNotNone(self.practice.last_sync)
+        self.assertNotIn('updated_since', session.requests[0][1])
+
+        result = sync_practice_patients(self.practice, session=session)
+        self.assertIn('updated_since', session.requests[1][1])
+        self.assertEqual(result['updated'], 2)
+        self.assertEqual(Patient.objects.count(), 2)
+
+    def test_stops_when_api_ignores_paging(self):
+        session = FakeSMOSession(lambda params: {'patients': self._records(1, 2)})
+        result = sync_practice_patients(self.practice, page_size=2, session=session)
+        self.assertEqual(len(session.requests), 2)
+        self.assertEqual(result['pages'], 1)
+        self.assertEqual(Patient.objects.count(), 2)
+
+
+class PatientMatchIndexTests(TestCase):
+    def setUp(self):
+        self.by_id = Patient.objects.create(
+            external_id='501', first_name='Maria', last_name='Lopez', dob=date(1980, 5, 1), phone='5550001111', email='maria@example.com',
+        )
+        self.sibling = Patient.objects.create(
+            first_name='Jose', last_name='Lopez', dob=date(1985, 7, 2), phone='5550002222', email='Family@Example.com',
+        )
+        self.duplicate = Patient.objects.create(
+            first_name='Jose', last_name='Lopez', dob=date(1985, 7, 2), phone='5550002222', email='family@example.com',
+        )
+        with self.assertNumQueries(1):
+            self.index = PatientMatchIndex.load()
+
+    def test_match_precedence_and_reasons(self):
+        self.assertEqual(self.index.match(external_id='501', email='family@example.com', first_name='Jose'), (self.by_id.pk, 'ID Match'))
+        self.assertEqual(self.index.match(email=' FAMILY@example.com ', first_name='jose'), (self.sibling.pk, 'Email + Name Match'))
+        self.assertEqual(self.index.match(email='family@example.com', first_name='Ana'), (None, ''))
+        self.assertEqual(
+            self.index.match(phone='5550001111', first_name='MARIA', last_name='lopez'), (self.by_id.pk, 'Phone + Name Match'),
+        )
+        self.assertEqual(
+            self.index.match(first_name='maria', last_name='LOPEZ', dob=date(1980, 5, 1)), (self.by_id.pk, 'Name + DOB Match'),
+        )
+        self.assertEqual(self.index.match(first_name='maria', last_name='lopez', dob=date(1980, 5, 2)), (None, ''))
+
+    def test_bulk_sync_dedupes_with_index(self):
+        practice = Practice.objects.create(external_id=9, name='Indio')
+        result = bulk_sync_patients(practice, [
+            {'id': 501, 'first_name': 'Maria', 'last_name': 'Lopez', 'dob': '1980-05-01', 'email': 'maria@example.com'},
+            {'id': 777, 'first_name': 'New', 'last_name': 'Person', 'dob': '1990-01-01', 'email': 'new@example.com'},
+            # Same person selected twice: matched against the patient created above
+            {'first_name': 'New', 'last_name': 'Person', 'dob': '1990-01-01', 'email': 'NEW@example.com'},
+            {'first_name': 'No', 'last_name': 'Birthday'},
+        ])
+        self.assertEqual(len(result['updated_patients']), 2)
+        self.assertEqual(len(result['created_patients']), 1)
+        self.assertEqual(result['skipped'], 1)
+        self.assertEqual(Patient.objects.filter(first_name='New').count(), 1)
+
+
+class SyncJobTests(TestCase):
+    def setUp(self):
+        self.practice = Practice.objects.create(external_id=11, name='La Quinta')
+        # Run the Celery task synchronously instead of publishing to the broker
+        patcher = mock.patch(
+            'birthday.tasks.run_sync_job_task.apply_async', side_effect=lambda args, **options: run_sync_job_task(*args),
+        )
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_confirm_bulk_sync_returns_job_and_status_reports_progress(self):
+        payload = {
+            'practice_id': self.practice.pk,
+            'patients': [
+                {'id': 901, 'first_name': 'Job', 'last_name': 'Patient', 'dob': '1975-02-03', 'email': 'job@example.com'},
+                {'first_name': 'Missing', 'last_name': 'Dob'},
+            ],
+        }
+        response = self.client.post(reverse('confirm_bulk_sync'), data=json.dumps(payload), content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        self.apply_async.assert_called_once_with((data['job_id'],), retry=False)
+
+        job = self.client.get(data['status_url']).json()['job']
+        self.assertEqual(job['status'], 'Completed')
+        self.assertTrue(job['is_finished'])
+        self.assertEqual((job['fetched'], job['created'], job['updated'], job['errors']), (2, 1, 0, 1))
+        self.assertEqual(job['result']['created_patients'][0]['name'], 'Job Patient')
+        self.practice.refresh_from_db()
+        self.assertIsNotNone(self.practice.last_sync)
+
+    def test_failed_job_records_error(self):
+        with mock.patch('birthday.smo_sync.iter_patient_pages', side_effect=RuntimeError('SMO unreachable')):
+            response = self.client.get(
+                reverse('sync_practice_patients', args=[self.practice.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        job = SyncJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, 'Failed')
+        self.assertEqual(job.message, 'SMO unreachable')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_broker_outage_fails_job_without_syncing_inline(self):
+        self.apply_async.side_effect = ConnectionError('no broker')
+        with mock.patch('birthday.smo_sync.run_sync_job') as run_inline:
+            response = self.client.get(
+                reverse('sync_practice_patients', args=[self.practice.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+
+        run_inline.assert_not_called()
+        job = SyncJob.objects.get(pk=response.json()['job_id'])
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('could not be queued', job.message)
+
+    def test_finished_jobs_are_not_rerun(self):
+        job = SyncJob.objects.create(kind='practice_patients', practice=self.practice, status='Completed')
+        self.assertIsNone(run_sync_job_task(job.pk))
+
+
+def patient_upload(name, first_name, last_name, dob, email, phone, enrolled=None, plan=None):
+    lines = [
+        f'TB^patient {first_name}',
+        f'TB^last_name {last_name}',
+        f'TB^dob {dob}',
+        f'TB^PatientEmail {email}',
+        f'TB^PatientPhone {phone}',
+    ]
+    if enrolled:
+        lines.append(f'TB^PUT_TodaysDate {enrolled}')
+    if plan:
+        lines.append(f'RB^PUT_{plan}Plan_SFYS True')
+    return SimpleUploadedFile(name, '\n'.join(lines).encode('utf-8'), content_type='text/plain')
+
+
+class PatientFileImportTests(TestCase):
+    def setUp(self):
+        self.upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.upload_dir.cleanup)
+        settings_override = self.settings(IMPORT_UPLOAD_DIR=self.upload_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.existing = Patient.objects.create(
+            first_name='Rene', last_name='Garcia', dob=date(1970, 3, 3), email='rene@example.com',
+            phone='5550004444', membership_plan='Silver', patient_type='Proceed', enrollment_date=date(2024, 1, 10),
+        )
+        self.same_date = Patient.objects.create(
+            first_name='Dup', last_name='Licate', dob=date(1971, 4, 4), email='dup@example.com',
+            phone='5550005555', membership_plan='Gold', patient_type='Proceed', enrollment_date=date(2025, 2, 1),
+        )
+
+    def _upload(self, *files):
+        with mock.patch(
+            'birthday.tasks.run_import_job_task.apply_async', side_effect=lambda args, **options: run_import_job_task(*args),
+        ):
+            return self.client.post(reverse('patient_create'), {'upload_file': '1', 'file': list(files)})
+
+    def test_imports_renews_and_reports_per_file(self):
+        response = self._upload(
+            patient_upload('new.txt', 'Nina', 'Park', '05/06/1990', 'nina@example.com', '(555) 000-6666', '01/15/2026', 'Bronze'),
+            # Existing patient by phone, new enrollment date + plan change -> renewal
+            patient_upload('renew.txt', 'Rene', 'Garcia', '03/03/1970', 'other@example.com', '555-000-4444', '02/01/2026', 'Gold'),
+            # Same enrollment date -> duplicate
+            patient_upload('dup.txt', 'Dup', 'Licate', '04/04/1971', 'dup@example.com', '5550005555', '02/01/2025', 'Gold'),
+            patient_upload('bad.txt', 'No', 'Birthday', 'not-a-date', 'nobday@example.com', '5550007777'),
+            # Second file for the patient created above (matched before it is saved)
+            patient_upload('new-again.txt', 'Nina', 'Park', '05/06/1990', 'nina@example.com', '5550006666', '02/20/2026', 'Silver'),
+        )
+
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('import_job_detail', args=[job.pk]))
+        self.assertEqual(job.status, 'Completed')
+        self.assertEqual(
+            (job.total, job.processed, job.created, job.updated, job.duplicates, job.errors), (5, 5, 1, 2, 1, 1),
+        )
+
+        rows = list(job.rows.values_list('file_name', 'outcome'))
+        self.assertEqual(rows, [
+            ('new.txt', 'created'), ('renew.txt', 'updated'), ('dup.txt', 'duplicate'),
+            ('bad.txt', 'error'), ('new-again.txt', 'updated'),
+        ])
+        self.assertIn('dob:', job.rows.get(outcome='error').reason)
+        self.assertEqual(job.rows.get(file_name='renew.txt').patient, self.existing)
+        self.assertEqual(job.rows.get(file_name='dup.txt').patient, self.same_date)
+
+        nina = Patient.objects.get(email='nina@example.com')
+        self.assertEqual((nina.membership_plan, nina.enrollment_date), ('Silver', date(2026, 2, 20)))
+        self.assertEqual(nina.phone, '5550006666')
+        self.assertEqual(nina.birthday_ordinal, 506)
+        self.assertEqual(job.rows.get(file_name='new.txt').patient, nina)
+        # One 'Added' row per imported patient (no duplicate from Patient.save)
+        self.assertEqual(list(nina.activities.values_list('activity_type', flat=True).order_by('pk')), ['Added', 'Plan Updated'])
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.membership_plan, self.existing.enrollment_date), ('Gold', date(2026, 2, 1)))
+        self.assertEqual(self.existing.email, 'other@example.com')
+        self.assertEqual(
+            list(self.existing.activities.filter(activity_type='Plan Updated').values_list('description', flat=True)),
+            ['Plan upgraded from Silver to Gold'],
+        )
+        self.assertEqual(
+            list(PlanHistory.objects.filter(patient=self.existing).values_list('change_type', flat=True)), ['Upgrade'],
+        )
+        self.assertEqual(Patient.objects.count(), 3)
+
+        # Staged uploads are removed once the job has run
+        self.assertEqual(os.listdir(os.path.join(self.upload_dir.name, str(job.pk))), [])
+
+    def test_query_count_does_not_grow_per_file(self):
+        files = [
+            patient_upload(f'p{i}.txt', f'Bulk{i}', 'Import', '01/02/1980', f'bulk{i}@example.com', f'55500190{i:02d}', '01/01/2026')
+            for i in range(30)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            result = import_patient_files(files, parse_patient_file)
+        self.assertEqual(result.success_count, 30)
+        self.assertEqual(Patient.objects.filter(last_name='Import').count(), 30)
+        self.assertLess(len(queries), 20)
+
+    def test_chunks_match_patients_created_by_earlier_chunks(self):
+        job = ImportJob.objects.create()
+        stage_import_files(job, [
+            patient_upload('a.txt', 'Omar', 'Reyes', '07/08/1985', 'omar@example.com', '5550008888', '01/01/2026', 'Bronze'),
+            patient_upload('b.txt', 'Lia', 'Chen', '09/10/1992', 'lia@example.com', '5550009999', '01/01/2026'),
+            patient_upload('c.txt', 'Omar', 'Reyes', '07/08/1985', 'omar@example.com', '5550008888', '03/01/2026', 'Gold'),
+        ])
+
+        run_import_job(job, chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.created, job.updated), ('Completed', 3, 2, 1))
+        self.assertEqual(list(job.rows.values_list('position', 'outcome')), [(0, 'created'), (1, 'created'), (2, 'updated')])
+        self.assertEqual(Patient.objects.get(email='omar@example.com').membership_plan, 'Gold')
+
+    def test_staged_files_kept_when_job_fails(self):
+        job = ImportJob.objects.create()
+        stage_import_files(job, [
+            patient_upload('a.txt', 'Omar', 'Reyes', '07/08/1985', 'omar@example.com', '5550008888', '01/01/2026'),
+        ])
+        staged = os.path.join(self.upload_dir.name, job.files[0]['path'])
+
+        with mock.patch('birthday.importer.import_patient_files', side_effect=RuntimeError('database went away')):
+            run_import_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('staged files', job.message)
+        self.assertNotIn(self.upload_dir.name, job.message)
+        self.assertTrue(os.path.exists(staged))
+
+        job = ImportJob.objects.create()
+        stage_import_files(job, [
+            patient_upload('a.txt', 'Omar', 'Reyes', '07/08/1985', 'omar@example.com', '5550008888', '01/01/2026'),
+        ])
+        run_import_job(job)
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir.name, job.files[0]['path'])))
+
+    def test_broker_outage_fails_job_without_importing_inline(self):
+        with mock.patch('birthday.tasks.run_import_job_task.apply_async', side_effect=ConnectionError('no broker')), \
+                mock.patch('birthday.importer.run_import_job') as run_inline:
+            response = self.client.post(reverse('patient_create'), {
+                'upload_file': '1',
+                'file': [patient_upload('new.txt', 'Ada', 'Stone', '01/01/1990', 'ada@example.com', '5550001212')],
+            })
+
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('import_job_detail', args=[job.pk]))
+        run_inline.assert_not_called()
+        self.assertEqual(job.status, 'Failed')
+        self.assertIn('upload the files again', job.message)
+        self.assertFalse(os.listdir(os.path.join(self.upload_dir.name, str(job.pk))))
+
+    def test_detail_json_and_csv_report(self):
+        self._upload(
+            patient_upload('new.txt', 'Ada', 'Stone', '01/01/1990', 'ada@example.com', '5550001212'),
+            patient_upload('bad.txt', 'No', 'Birthday', 'not-a-date', 'nobday@example.com', '5550007777'),
+        )
+        job = ImportJob.objects.get()
+
+        page = self.client.get(reverse('import_job_detail', args=[job.pk]))
+        self.assertContains(page, 'bad.txt')
+        self.assertContains(page, 'Ada Stone')
+
+        data = self.client.get(reverse('import_job_detail', args=[job.pk]), {'format': 'json'}).json()
+        self.assertEqual(data['job']['status'], 'Completed')
+        self.assertEqual((data['job']['created'], data['job']['errors'], data['job']['percent']), (1, 1, 100))
+
+        report = self.client.get(reverse('import_job_csv', args=[job.pk]))
+        self.assertEqual(report['Content-Type'], 'text/csv')
+        lines = report.content.decode().splitlines()
+        self.assertEqual(lines[0], 'File,Outcome,Reason,Patient')
+        self.assertEqual(lines[1], 'new.txt,Created,,Ada Stone')
+        self.assertTrue(lines[2].startswith('bad.txt,Error,'))
+
+
+class PatientChangeTrackingTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Tara', last_name='Wells', dob=date(1988, 6, 7), email='tara@example.com',
+            phone='5550003030', membership_plan='Silver', patient_type='Proceed', enrollment_date=date(2025, 1, 5),
+        )
+
+    def _activities(self, patient):
+        return list(patient.activities.order_by('pk').values_list('activity_type', 'description'))
+
+    def test_creation_logs_a_single_added_activity(self):
+        self.assertEqual(self._activities(self.patient), [('Added', 'Patient registered in directory')])
+
+    def test_update_uses_loaded_values_instead_of_refetching(self):
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.membership_plan = 'Gold'
+        with CaptureQueriesContext(connection) as queries:
+            patient.save()
+
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT')])
+        self.assertEqual(
+            list(PlanHistory.objects.filter(patient=patient).values_list('old_plan', 'new_plan', 'change_type')),
+            [('Silver', 'Gold', 'Upgrade')],
+        )
+        self.assertEqual(self._activities(patient)[-1], ('Plan Updated', 'Plan upgraded from Silver to Gold'))
+
+        # Saving again without changes logs nothing more
+        patient.save()
+        self.assertEqual(PlanHistory.objects.filter(patient=patient).count(), 1)
+
+    def test_refresh_from_db_resets_loaded_values(self):
+        patient = Patient.objects.get(pk=self.patient.pk)
+        Patient.objects.filter(pk=patient.pk).update(membership_plan='Gold')
+
+        patient.refresh_from_db(fields=['membership_plan'])
+        self.assertEqual(patient.changed_fields(['membership_plan']), set())
+        patient.membership_plan = 'Silver'
+        patient.save()
+
+        self.assertEqual(
+            list(PlanHistory.objects.filter(patient=patient).values_list('old_plan', 'new_plan')), [('Gold', 'Silver')],
+        )
+
+    def test_update_fields_without_plan_fields_skip_plan_detection(self):
+        response = self.client.post(reverse('toggle_patient_verification', args=[self.patient.pk]))
+        self.assertTrue(response.json()['is_verified'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('toggle_patient_verification', args=[self.patient.pk]))
+        # The lookup and one UPDATE; no re-fetch and no activity rows
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(self._activities(self.patient)), 1)
+
+    def test_deferred_plan_fields_are_read_once_for_detection(self):
+        patient = Patient.objects.only('pk', 'first_name', 'dob', 'phone').get(pk=self.patient.pk)
+        patient.enrollment_date = date(2026, 1, 5)
+        patient.save(update_fields=['enrollment_date'])
+
+        self.assertEqual(
+            list(PlanHistory.objects.filter(patient=patient).values_list('change_type', flat=True)), ['Renewal'],
+        )
+
+    def test_patient_update_view_logs_exactly_one_activity(self):
+        data = {
+            'first_name': 'Tara', 'last_name': 'Wells', 'dob': '1988-06-07', 'email': 'tara@example.com',
+            'phone': '5550003030', 'membership_plan': 'Bronze', 'patient_type': 'Proceed',
+            'enrollment_date': '2025-01-05', 'accepts_marketing': 'on',
+        }
+        self.client.post(reverse('patient_update', args=[self.patient.pk]), data)
+        self.assertEqual(self._activities(self.patient)[1:], [('Plan Updated', 'Plan downgraded from Silver to Bronze')])
+
+        self.client.post(reverse('patient_update', args=[self.patient.pk]), {**data, 'city': 'Austin'})
+        self.assertEqual(self._activities(self.patient)[2:], [('Details Updated', 'Patient details were updated')])
+
+        # Re-submitting unchanged data is not logged
+        self.client.post(reverse('patient_update', args=[self.patient.pk]), {**data, 'city': 'Austin'})
+        self.assertEqual(len(self._activities(self.patient)), 3)
+
+    def test_bulk_writers_can_collect_and_batch_audit_records(self):
+        patients = list(Patient.objects.filter(pk=self.patient.pk))
+        patients.append(Patient(
+            first_name='Noel', last_name='Hart', dob=date(1979, 2, 2), email='noel@example.com', phone='5550004040',
+        ))
+        patients[0].membership_plan = 'Gold'
+        records = [record for patient in patients for record in patient.pop_audit_records()]
+
+        # Nothing is pending once popped, so a later save() does not log the change again
+        self.assertEqual(patients[0].audit_records(), [])
+
+        patients[0].save(audit=False)
+        Patient.objects.bulk_create(patients[1:])
+        with self.assertNumQueries(2):
+            write_audit_records(records)
+
+        self.assertEqual(PlanHistory.objects.get().change_type, 'Upgrade')
+        self.assertEqual(self._activities(patients[1]), [('Added', 'Patient registered in directory')])
+
+
+class PlanStatusTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        PracticeSettings.objects.create(pk=1, plan_duration_days=180)
+        # Days since enrollment -> expected SQL/Python status
+        self.cases = {
+            0: ('Active', 180, False),
+            149: ('Active', 31, False),
+            150: ('Expiring Soon', 30, False),
+            180: ('Expiring Soon', 0, False),
+            181: ('Just Expired', 0, True),
+            210: ('Just Expired', 0, True),
+            211: ('Expired', 0, True),
+        }
+        for elapsed in self.cases:
+            Patient.objects.create(
+                first_name=f'Plan{elapsed}', last_name='Status', dob=date(1990, 1, 1), email=f'plan{elapsed}@example.com',
+                phone='5550001000', patient_type='Proceed', membership_plan='Gold',
+                enrollment_date=self.today - timedelta(days=elapsed),
+            )
+        Patient.objects.create(
+            first_name='NoPlan', last_name='Status', dob=date(1990, 1, 1), email='noplan@example.com',
+            phone='5550001001', patient_type='Proceed',
+        )
+
+    def test_sql_annotation_matches_plan_progress(self):
+        with self.assertNumQueries(2):  # plan duration + the patients
+            patients = list(Patient.objects.filter(enrollment_date__isnull=False).with_plan_status(self.today))
+
+        with self.assertNumQueries(0):
+            for patient in patients:
+                elapsed = (self.today - patient.enrollment_date).days
+                label, days_left, is_expired = self.cases[elapsed]
+                self.assertEqual(
+                    (patient.plan_status_label, patient.plan_days_left, patient.plan_is_expired, patient.plan_elapsed_days),
+                    (label, days_left, is_expired, elapsed),
+                )
+                progress = patient.plan_progress
+                self.assertEqual((progress['label'], progress['days_left'], progress['is_expired']), (label, days_left, is_expired))
+                self.assertEqual(progress['expiry_date'], patient.enrollment_date + timedelta(days=180))
+
+        no_plan = Patient.objects.with_plan_status(self.today).get(first_name='NoPlan')
+        self.assertEqual((no_plan.plan_status_label, no_plan.plan_days_left, no_plan.plan_is_expired), ('No Plan', 0, False))
+
+    def test_plan_progress_is_computed_once_per_instance(self):
+        patient = Patient.objects.get(first_name='Plan150')
+        with self.assertNumQueries(1):
+            self.assertEqual(patient.plan_progress['label'], 'Expiring Soon')
+            self.assertEqual(patient.plan_progress['days_left'], 30)
+
+        patient.enrollment_date = self.today
+        patient.save()
+        self.assertEqual(patient.plan_progress['label'], 'Active')
+
+    def test_analytics_buckets_use_plan_duration(self):
+        response = self.client.get(reverse('analytics_dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.context['active_count'], response.context['expiring_soon_count'], response.context['expired_count']),
+            (2, 2, 3),
+        )
+
+    def test_patient_list_status_filters(self):
+        def names(status):
+            response = self.client.get(reverse('patient_list'), {'status': status, 'per_page': 50})
+            return sorted(p.first_name for p in response.context['page_obj'])
+
+        self.assertEqual(names('expiring_soon'), ['Plan150', 'Plan180'])
+        self.assertEqual(names('proceed_active'), ['Plan0', 'Plan149', 'Plan150', 'Plan180'])
+        self.assertEqual(names('proceed_inactive'), ['NoPlan', 'Plan181', 'Plan210', 'Plan211'])
+
+
+class PatientSearchTests(TestCase):
+    def setUp(self):
+        Patient.objects.create(
+            first_name='Maria', last_name='Lopez', dob=date(1980, 1, 2), email='mlopez@example.com',
+            phone='(555) 201-3344', city='Fresno',
+        )
+        Patient.objects.create(
+            first_name='Mario', last_name='Bates', dob=date(1981, 3, 4), email='mario@example.com',
+            phone='5559998877', city='Austin',
+        )
+
+    def _search(self, query):
+        response = self.client.get(reverse('patient_list'), {'q': query})
+        return sorted(p.first_name for p in response.context['page_obj'])
+
+    def test_matches_name_email_city_and_full_name(self):
+        self.assertEqual(self._search('mari'), ['Maria', 'Mario'])
+        self.assertEqual(self._search('maria lopez'), ['Maria'])
+        self.assertEqual(self._search('MARIO@'), ['Mario'])
+        self.assertEqual(self._search('austin'), ['Mario'])
+        self.assertEqual(self._search('nobody'), [])
+
+    def test_phone_queries_are_digit_normalised(self):
+        self.assertEqual(self._search('(555) 201-33'), ['Maria'])
+        self.assertEqual(self._search('+1 555 999 8877'), ['Mario'])
+        self.assertEqual(phone_digits('ab12'), '')
+
+    def test_search_document_matches_index_expression(self):
+        patient = Patient.objects.annotate(document=PatientSearchDocument()).get(first_name='Maria')
+        self.assertEqual(patient.document, 'maria lopez mlopez@example.com fresno 5552013344')
+
+        # The query expression must be the one migration 0027 indexes
+        migration = importlib.import_module('birthday.migrations.0027_patient_search_trgm')
+        query = Patient.objects.all().query
+        sql, params = PatientSearchDocument().resolve_expression(query).as_sql(query.get_compiler(connection=connection), connection)
+        sql = sql.replace('"birthday_patient".', '').replace('"', '') % tuple(f"'{param}'" for param in params)
+        self.assertEqual(sql, migration.SEARCH_DOCUMENT)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Page', last_name='Walker', dob=date(1985, 5, 5), email='page@example.com', phone='5550002020',
+        )
+        CommunicationLog.objects.bulk_create([
+            CommunicationLog(patient=self.patient, channel='SMS', body=f'Message {i}', recipient='5550002020')
+            for i in range(120)
+        ])
+        # Half of the rows share one timestamp, so the pk has to break ties
+        stamp = timezone.now()
+        CommunicationLog.objects.filter(pk__in=list(CommunicationLog.objects.values_list('pk', flat=True)[:60])).update(created_at=stamp)
+        self.expected = list(CommunicationLog.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def _log_page(self, **params):
+        return self.client.get(reverse('communication_log_list'), {'format': 'json', **params}).json()
+
+    def test_walks_forward_and_back_without_gaps(self):
+        seen, pages, params = [], [], {}
+        while True:
+            data = self._log_page(**params)
+            pages.append(data)
+            seen.extend(log['id'] for log in data['logs'])
+            if not data['page']['has_next']:
+                break
+            params = {'after': data['page']['next_cursor']}
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([p['page']['start_index'] for p in pages], [1, 51, 101])
+
+        # Back from the last page to the first
+        back = self._log_page(before=pages[-1]['page']['previous_cursor'])
+        self.assertEqual([log['id'] for log in back['logs']], self.expected[50:100])
+        self.assertEqual(back['page']['start_index'], 51)
+        first = self._log_page(before=back['page']['previous_cursor'])
+        self.assertEqual([log['id'] for log in first['logs']], self.expected[:50])
+        self.assertFalse(first['page']['has_previous'])
+
+    def test_deep_pages_do_not_count_or_offset(self):
+        first = self._log_page()
+        with CaptureQueriesContext(connection) as queries:
+            self._log_page(after=first['page']['next_cursor'])
+        sql = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('OFFSET', sql)
+        self.assertIsNone(first['page']['total'])
+        self.assertEqual(self._log_page(count='1')['page']['total'], 120)
+
+    def test_invalid_cursor_restarts_at_first_page(self):
+        data = self._log_page(after='not-a-cursor')
+        self.assertEqual([log['id'] for log in data['logs']], self.expected[:50])
+
+    def test_patient_list_upcoming_sort_pages_by_cursor(self):
+        for i in range(5):
+            Patient.objects.create(
+                first_name=f'Up{i}', last_name='Coming', dob=date(1990, (i % 12) + 1, 10), email=f'up{i}@example.com',
+                phone='5550002021',
+            )
+        expected = list(Patient.objects.upcoming_birthdays().values_list('pk', flat=True))
+        seen, params = [], {'sort': 'upcoming', 'per_page': 2, 'format': 'json'}
+        while True:
+            data = self.client.get(reverse('patient_list'), params).json()
+            seen.extend(patient['id'] for patient in data['patients'])
+            self.assertEqual(data['page']['total'], 6)
+            if not data['page']['has_next']:
+                break
+            params['after'] = data['page']['next_cursor']
+        self.assertEqual(seen, expected)
+
+    def test_scheduled_list_pages_html_and_json(self):
+        now = timezone.now()
+        for i in range(3):
+            ScheduledWish.objects.create(patient=self.patient, scheduled_for=now + timezone.timedelta(days=i))
+
+        data = self.client.get(reverse('scheduled_list'), {'per_page': 2, 'format': 'json'}).json()
+        self.assertEqual(len(data['wishes']), 2)
+        self.assertTrue(data['page']['has_next'])
+
+        response = self.client.get(reverse('scheduled_list'), {'per_page': 2, 'after': data['page']['next_cursor']})
+        self.assertEqual(len(response.context['wishes']), 1)
+        self.assertContains(response, 'Showing 3 to 3 of 3 wishes')
+
+
+class PatientTimelineTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Tim', last_name='Line', dob=date(1975, 8, 9), email='tim@example.com', phone='5550005050',
+        )
+        PatientStatus.objects.bulk_create([
+            PatientStatus(patient=self.patient, activity_type='Email Sent', description=f'Email {i}', full_content='x' * 5000)
+            for i in range(12)
+        ])
+        self.newest_first = list(self.patient.activities.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def test_patient_list_prefetches_latest_activities_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('patient_list'))
+
+        patient = next(p for p in response.context['page_obj'] if p.pk == self.patient.pk)
+        self.assertEqual([a.pk for a in patient.recent_activities], self.newest_first[:5])
+        self.assertIn('full_content', patient.recent_activities[0].get_deferred_fields())
+        prefetch_sql = next(q['sql'] for q in queries if 'birthday_patientstatus' in q['sql'] and 'ROW_NUMBER' in q['sql'])
+        self.assertNotIn('full_content', prefetch_sql.split(' FROM ')[0])
+        self.assertContains(response, reverse('patient_activity_history', args=[self.patient.pk]))
+
+    def test_history_endpoint_pages_full_timeline(self):
+        url = reverse('patient_activity_history', args=[self.patient.pk])
+        first = self.client.get(url, {'per_page': 10}).json()
+        rest = self.client.get(url, {'per_page': 10, 'after': first['page']['next_cursor']}).json()
+
+        ids = [a['id'] for a in first['activities'] + rest['activities']]
+        self.assertEqual(ids, self.newest_first)
+        self.assertEqual(len(first['activities'][0]['full_content']), 5000)
+        self.assertFalse(rest['page']['has_next'])
+
+
+class FakeMessageListClient:
+    """SignalWireSMSClient stand-in serving one canned Messages list page per leg."""
+    is_configured = True
+    from_number = '5559990000'
+
+    def __init__(self, inbound=(), outbound=(), error=None):
+        self.legs = {'To': list(inbound), 'From': list(outbound)}
+        self.error = error
+        self.calls = []
+
+    def iter_message_pages(self, params, max_pages=None):
+        self.calls.append(params)
+        if self.error:
+            raise self.error
+        yield self.legs['To' if 'To' in params else 'From']
+
+
+def signalwire_message(sid, from_number, to_number, sent, status='received', body='Hi'):
+    return {
+        'sid': sid, 'from': from_number, 'to': to_number, 'status': status, 'body': body,
+        'date_sent': sent.strftime('%a, %d %b %Y %H:%M:%S %z'),
+    }
+
+
+class SmsMirrorTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Sam', last_name='Reply', email='sam@example.com', phone='5551112222', dob=date(1985, 3, 4)
+        )
+        self.now = timezone.now().replace(microsecond=0)
+        self.original_number = os.environ.get('TWILIO_PHONE_NUMBER')
+        os.environ['TWILIO_PHONE_NUMBER'] = '5559990000'
+
+    def tearDown(self):
+        if self.original_number is None:
+            os.environ.pop('TWILIO_PHONE_NUMBER', None)
+        else:
+            os.environ['TWILIO_PHONE_NUMBER'] = self.original_number
+        super().tearDown()
+
+    def test_mirror_inserts_new_messages_and_refreshes_known_ones(self):
+        CommunicationLog.objects.create(
+            patient=self.patient, channel='SMS', direction='Outbound', status='Sent', body='Happy birthday',
+            recipient='5551112222', external_message_id='SM1', gateway_number='5559990000',
+        )
+        reply_at = self.now - timedelta(hours=1)
+        client = FakeMessageListClient(
+            inbound=[
+                signalwire_message('SM2', '+15551112222', '+15559990000', reply_at, body='Thanks!'),
+                signalwire_message('SM3', '+15553334444', '+15559990000', reply_at - timedelta(minutes=5)),
+            ],
+            outbound=[
+                signalwire_message('SM1', '+15559990000', '+15551112222', reply_at - timedelta(hours=1), status='undelivered'),
+                # Still inside the settle window: left for the send path to log
+                signalwire_message('SM4', '+15559990000', '+15551112222', self.now, status='sent'),
+            ],
+        )
+
+        result = mirror_signalwire_messages(client=client)
+
+        self.assertEqual((result['status'], result['created'], result['updated']), ('success', 2, 1))
+        self.assertNotIn('DateSent>=', client.calls[0])
+        reply = CommunicationLog.objects.get(external_message_id='SM2')
+        self.assertEqual((reply.patient, reply.direction, reply.status), (self.patient, 'Inbound', 'Sent'))
+        self.assertEqual((reply.created_at, reply.recipient), (reply_at, '+15551112222'))
+        self.assertIsNone(CommunicationLog.objects.get(external_message_id='SM3').patient)
+        self.assertEqual(CommunicationLog.objects.get(external_message_id='SM1').status, 'Undelivered')
+        self.assertFalse(CommunicationLog.objects.filter(external_message_id='SM4').exists())
+        self.assertEqual(SmsMirrorState.objects.get(gateway_number='+15559990000').high_water_mark, reply_at)
+
+        # The next run starts from the mark's (UTC) day and does not duplicate rows
+        result = mirror_signalwire_messages(client=client)
+        self.assertEqual(client.calls[2]['DateSent>='], reply_at.date().isoformat())
+        self.assertEqual((result['created'], result['updated']), (0, 0))
+        self.assertEqual(CommunicationLog.objects.filter(channel='SMS').count(), 3)
+
+    def test_failed_run_keeps_high_water_mark(self):
+        mark = self.now - timedelta(days=2)
+        SmsMirrorState.objects.create(gateway_number='+15559990000', high_water_mark=mark)
+
+        result = mirror_signalwire_messages(client=FakeMessageListClient(error=ValueError('timeout')))
+
+        state = SmsMirrorState.objects.get(gateway_number='+15559990000')
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(state.high_water_mark, mark)
+        self.assertIn('timeout', state.last_error)
+
+    def test_run_is_skipped_while_another_holds_the_state_row(self):
+        client = FakeMessageListClient()
+        held = mock.MagicMock()
+        held.filter.return_value.first.return_value = None  # SKIP LOCKED found the row taken
+        with mock.patch.object(SmsMirrorState.objects, 'select_for_update', return_value=held) as select_for_update:
+            result = mirror_signalwire_messages(client=client)
+
+        select_for_update.assert_called_once_with(skip_locked=True)
+        self.assertEqual(result['status'], 'skipped')
+        self.assertEqual(client.calls, [])
+
+        with mock.patch('birthday.sms_mirror.mirror_signalwire_messages', return_value={'status': 'success'}) as mirror:
+            self.assertEqual(mirror_signalwire_messages_task(), {'status': 'success'})
+        mirror.assert_called_once_with()
+
+    def test_hub_reads_only_the_local_store(self):
+        CommunicationLog.objects.create(
+            patient=self.patient, channel='SMS', direction='Outbound', status='Delivered', body='Happy birthday',
+            recipient='5551112222', external_message_id='SM1', gateway_number='5559990000',
+        )
+        CommunicationLog.objects.create(
+            channel='SMS', direction='Inbound', status='Sent', body='Who is this?',
+            recipient='+15553334444', external_message_id='SM2', gateway_number='+15559990000',
+        )
+        CommunicationLog.objects.create(
+            patient=self.patient, channel='SMS', direction='Outbound', status='Failed', body='Retry',
+            recipient='5551112222', gateway_number='5559990000',
+        )
+        SmsMirrorState.objects.create(gateway_number='+15559990000', last_run_at=self.now, last_error='Unable to mirror')
+
+        with mock.patch('birthday.utils.requests.get') as remote_get, \
+                mock.patch('birthday.utils.SignalWireSMSClient.iter_message_pages') as remote_list:
+            response = self.client.get(reverse('messages_hub'))
+
+        remote_get.assert_not_called()
+        remote_list.assert_not_called()
+        context = response.context
+        self.assertEqual(
+            (context['sent_today'], context['received_today'], context['delivered_today'], context['failed_today']),
+            (2, 1, 1, 1),
+        )
+        self.assertEqual(len(context['signalwire_feed']), 3)
+        self.assertEqual(context['signalwire_fetch_error'], 'Unable to mirror')
+        self.assertEqual({thread.key for thread in context['threads']}, {f'p:{self.patient.pk}', 'n:+15553334444'})
+
+
+class SmsMirrorPagingTests(StubSignalWireMixin, TestCase):
+    next_uri = '/api/laml/2010-04-01/Accounts/project/Messages.json?PageSize=1&Page=1'
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now().replace(microsecond=0)
+
+    def page(self, sid, sent, more=False, older=False):
+        # next_page_uri carries the request's filters, DateSent< included
+        next_uri = self.next_uri + ('&DateSent%3C=2000-01-01' if older else '')
+        return {
+            'messages': [signalwire_message(sid, '+15551112222', '+15559990000', sent)],
+            'next_page_uri': next_uri if more else None,
+        }
+
+    def mirror(self, max_pages):
+        client = SignalWireSMSClient()
+        try:
+            return mirror_signalwire_messages(client=client, max_pages=max_pages)
+        finally:
+            client.close()
+
+    def test_truncated_first_run_sets_mark_and_backfills_older_pages(self):
+        newest, older, oldest = self.now - timedelta(hours=1), self.now - timedelta(days=3), self.now - timedelta(days=5)
+        self.server.pages = {0: self.page('SM3', newest, more=True), 1: self.page('SM2', older)}
+
+        result = self.mirror(max_pages=1)
+
+        state = SmsMirrorState.objects.get(gateway_number='+15559990000')
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(state.high_water_mark, newest)
+        self.assertEqual((state.backfill_before, state.backfill_after), (newest, None))
+
+        # Next runs read new messages from the mark and page older ones (DateSent<) a few at a time
+        self.server.pages = {0: self.page('SM3', newest)}
+        self.server.older_pages = {0: self.page('SM2', older, more=True, older=True), 1: self.page('SM1', oldest)}
+        self.server.listed = []
+        self.mirror(max_pages=1)
+
+        backfill = [query for query in self.server.listed if 'DateSent<' in query]
+        self.assertEqual(
+            backfill[0]['DateSent<'], [(newest.astimezone(dt_timezone.utc).date() + timedelta(days=1)).isoformat()]
+        )
+        self.assertNotIn('DateSent>=', backfill[0])
+        state.refresh_from_db()
+        self.assertEqual((state.high_water_mark, state.backfill_before), (newest, older))
+
+        self.mirror(max_pages=2)
+
+        state.refresh_from_db()
+        self.assertEqual((state.high_water_mark, state.backfill_before, state.backfill_after), (newest, None, None))
+        self.assertEqual(
+            set(CommunicationLog.objects.values_list('external_message_id', flat=True)), {'SM1', 'SM2', 'SM3'}
+        )
+
+    def test_truncated_run_backfills_down_to_previous_mark(self):
+        mark = self.now - timedelta(days=2)
+        SmsMirrorState.objects.create(gateway_number='+15559990000', high_water_mark=mark)
+        self.server.pages = {
+            0: self.page('SM2', self.now - timedelta(hours=1), more=True),
+            1: self.page('SM1', self.now - timedelta(days=1)),
+        }
+
+        self.mirror(max_pages=1)
+
+        state = SmsMirrorState.objects.get(gateway_number='+15559990000')
+        self.assertEqual(state.high_water_mark, self.now - timedelta(hours=1))
+        self.assertEqual(state.backfill_after, mark)
+        self.assertEqual(state.last_error, '')
+        self.assertFalse(CommunicationLog.objects.filter(external_message_id='SM1').exists())
+
+        self.server.pages = {0: self.page('SM2', self.now - timedelta(hours=1))}
+        self.server.older_pages = {0: self.page('SM1', self.now - timedelta(days=1))}
+        self.server.listed = []
+        self.mirror(max_pages=1)
+
+        backfill = [query for query in self.server.listed if 'DateSent<' in query]
+        self.assertEqual(backfill[0]['DateSent>='], [mark.astimezone(dt_timezone.utc).date().isoformat()])
+        self.assertTrue(CommunicationLog.objects.filter(external_message_id='SM1').exists())
+        self.assertIsNone(SmsMirrorState.objects.get(gateway_number='+15559990000').backfill_before)
+
+
+class PhoneE164Tests(TestCase):
+    def make_patient(self, phone, **extra):
+        return Patient.objects.create(
+            first_name='Pat', last_name='Phone', email=f'{phone}@example.com', phone=phone, dob=date(1980, 1, 2), **extra
+        )
+
+    def test_patient_phone_e164_follows_phone(self):
+        patient = self.make_patient('(555) 111-2222')
+        self.assertEqual((patient.phone, patient.phone_e164), ('5551112222', '+15551112222'))
+
+        patient.phone = '1-555-333-4444'
+        patient.save(update_fields=['phone'])
+        self.assertEqual(Patient.objects.get(pk=patient.pk).phone_e164, '+15553334444')
+
+    def test_bulk_writes_keep_phone_e164(self):
+        Patient.objects.bulk_create([Patient(first_name='Bulk', last_name='One', email='b1@example.com', phone='5556667777', dob=date(1990, 5, 6))])
+        patient = Patient.objects.get(email='b1@example.com')
+        self.assertEqual(patient.phone_e164, '+15556667777')
+
+        patient.phone = '5558889999'
+        Patient.objects.bulk_update([patient], ['phone'])
+        self.assertEqual(Patient.objects.get(pk=patient.pk).phone_e164, '+15558889999')
+
+    def test_communication_log_counterparty(self):
+        sms = CommunicationLog.objects.create(channel='SMS', body='Hi', recipient='555-111-2222')
+        email = CommunicationLog.objects.create(channel='Email', body='Hi', recipient='pat@example.com')
+        CommunicationLog.objects.bulk_create([CommunicationLog(channel='SMS', body='Hi', recipient='+15553334444', external_message_id='SM9')])
+
+        self.assertEqual(sms.counterparty_e164, '+15551112222')
+        self.assertEqual(email.counterparty_e164, '')
+        self.assertEqual(CommunicationLog.objects.get(external_message_id='SM9').counterparty_e164, '+15553334444')
+
+    def test_inbound_sms_resolves_patient_by_exact_e164_match(self):
+        patient = self.make_patient('5551112222')
+        enqueue_inbound_sms({'From': '+1 (555) 111-2222', 'To': '+15559990000', 'Body': 'Thanks!', 'MessageSid': 'SM1'})
+
+        with CaptureQueriesContext(connection) as queries:
+            process_sms_inbox()
+
+        log = CommunicationLog.objects.get(external_message_id='SM1')
+        self.assertEqual((log.patient, log.counterparty_e164), (patient, '+15551112222'))
+        lookup = next(query['sql'] for query in queries.captured_queries if 'FROM "birthday_patient"' in query['sql'])
+        self.assertIn('"phone_e164" IN', lookup)
+
+    def test_hub_conversation_matches_counterparty(self):
+        patient = self.make_patient('5551112222')
+        CommunicationLog.objects.create(patient=patient, channel='SMS', body='Happy birthday', recipient='5551112222')
+        CommunicationLog.objects.create(channel='SMS', direction='Inbound', body='Thanks', recipient='+15551112222')
+        CommunicationLog.objects.create(channel='SMS', direction='Inbound', body='Wrong number', recipient='+15551112223')
+
+        response = self.client.get(reverse('messages_hub'), {'patient': patient.pk, 'lookup': '(555) 111-2222'})
+
+        self.assertEqual([msg['body'] for msg in response.context['conversation']], ['Happy birthday', 'Thanks'])
+        self.assertEqual(response.context['found_patient_for_lookup'], patient)
+
+    def test_backfill_migration(self):
+        migration = importlib.import_module('birthday.migrations.0030_phone_e164')
+        patient = self.make_patient('5551112222')
+        log = CommunicationLog.objects.create(channel='SMS', body='Hi', recipient='555.111.2222')
+        Patient.objects.update(phone_e164='')
+        CommunicationLog.objects.update(counterparty_e164='')
+
+        migration.backfill_phone_e164(django_apps, None)
+
+        self.assertEqual(Patient.objects.get(pk=patient.pk).phone_e164, '+15551112222')
+        self.assertEqual(CommunicationLog.objects.get(pk=log.pk).counterparty_e164, '+15551112222')
+
+
+class SmsThreadTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(
+            first_name='Tia', last_name='Thread', email='tia@example.com', phone='5551112222', dob=date(1975, 7, 8)
+        )
+        self.now = timezone.now()
+
+    def sms(self, recipient, body, direction='Outbound', minutes_ago=0, **extra):
+        return CommunicationLog(
+            channel='SMS', direction=direction, status='Sent', body=body, recipient=recipient,
+            created_at=self.now - timedelta(minutes=minutes_ago), **extra
+        )
+
+    def test_logged_messages_update_their_thread(self):
+        self.sms('5551112222', 'Happy birthday', patient=self.patient, minutes_ago=10).save()
+        CommunicationLog.objects.bulk_create([
+            self.sms('+15551112222', 'Thanks! ' * 20, direction='Inbound', minutes_ago=5),
+            self.sms('+15551112222', 'See you soon', direction='Inbound', minutes_ago=1),
+            self.sms('+15553334444', 'Who is this?', direction='Inbound', minutes_ago=2),
+            # Mirrored history older than the thread's latest message
+            self.sms('+15551112222', 'Old reminder', minutes_ago=600),
+        ])
+        CommunicationLog.objects.create(channel='Email', body='Hi', recipient='tia@example.com')
+
+        thread = SmsThread.objects.get(phone_e164='+15551112222')
+        self.assertEqual(thread.patient, self.patient)
+        self.assertEqual((thread.message_count, thread.unread_count), (4, 2))
+        self.assertEqual((thread.last_preview, thread.last_direction), ('See you soon', 'Inbound'))
+        self.assertEqual(thread.last_message_at, self.now - timedelta(minutes=1))
+        self.assertEqual(SmsThread.objects.get(phone_e164='+15553334444').display_name, '+15553334444')
+        self.assertEqual(SmsThread.objects.count(), 2)
+
+    def test_record_messages_query_count_is_constant(self):
+        logs = [self.sms(f'+1555000{index:04d}', 'Hi') for index in range(50)]
+        # INSERT logs + INSERT threads + SELECT threads + UPDATE threads (+ savepoint)
+        with self.assertNumQueries(6):
+            CommunicationLog.objects.bulk_create(logs)
+        self.assertEqual(SmsThread.objects.count(), 50)
+
+    def test_hub_sidebar_pages_every_thread_and_marks_read(self):
+        for index in range(3):
+            self.sms(f'+1555000000{index}', f'Message {index}', direction='Inbound', minutes_ago=index).save()
+
+        response = self.client.get(reverse('messages_hub'), {'per_page': 2})
+        first_page = response.context['threads']
+        self.assertEqual([thread.phone_e164 for thread in first_page], ['+15550000000', '+15550000001'])
+        # The newest thread is shown by default but stays unread until it is picked
+        self.assertEqual(response.context['selected_phone'], '+15550000000')
+        self.assertEqual(first_page[0].unread_count, 1)
+        self.assertEqual(SmsThread.objects.get(phone_e164='+15550000000').unread_count, 1)
+
+        response = self.client.get(reverse('messages_hub'), {'per_page': 2, 'phone': '+15550000001'})
+        self.assertEqual(response.context['threads'][1].unread_count, 0)
+        self.assertEqual(SmsThread.objects.get(phone_e164='+15550000001').unread_count, 0)
+        self.assertEqual(SmsThread.objects.get(phone_e164='+15550000000').unread_count, 1)
+
+        cursor = response.context['page_obj'].next_cursor
+        data = self.client.get(reverse('messages_hub'), {'per_page': 2, 'after': cursor, 'format': 'json'}).json()
+        self.assertEqual([thread['phone'] for thread in data['threads']], ['+15550000002'])
+        self.assertFalse(data['page']['has_next'])
+
+    def test_backfill_migration(self):
+        self.sms('5551112222', 'Happy birthday', patient=self.patient, minutes_ago=10).save()
+        self.sms('+15551112222', 'Thanks', direction='Inbound', minutes_ago=5).save()
+        SmsThread.objects.all().delete()
+
+        importlib.import_module('birthday.migrations.0031_smsthread').backfill_sms_threads(django_apps, None)
+
+        thread = SmsThread.objects.get()
+        self.assertEqual((thread.patient, thread.message_count, thread.unread_count), (self.patient, 2, 0))
+        self.assertEqual(thread.last_preview, 'Thanks')
+
+
+class SmsInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = Patient.objects.create(
+            first_name='Ina', last_name='Inbox', email='ina@example.com', phone='5551112222', dob=date(1982, 9, 10)
+        )
+        self.url = reverse('signalwire_sms_webhook')
+        self.original_key = os.environ.pop('SIGNALWIRE_SIGNING_KEY', None)
+
+    def tearDown(self):
+        if self.original_key is not None:
+            os.environ['SIGNALWIRE_SIGNING_KEY'] = self.original_key
+        else:
+            os.environ.pop('SIGNALWIRE_SIGNING_KEY', None)
+        super().tearDown()
+
+    def webhook(self, index, from_number='+15551112222'):
+        return {'From': from_number, 'To': '+15559990000', 'Body': f'Reply {index}', 'MessageSid': f'SM{index:05d}'}
+
+    def test_webhook_only_appends_to_inbox_and_queues_one_drain(self):
+        with mock.patch('birthday.tasks.process_sms_inbox_task.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                response = self.client.post(self.url, self.webhook(1))
+            self.client.post(self.url, self.webhook(2))
+            self.client.post(self.url, {'From': '+15551112222', 'Body': ''})
+
+        self.assertEqual(response.content, b'<Response></Response>')
+        self.assertEqual(SmsInboxMessage.objects.count(), 2)
+        self.assertFalse(CommunicationLog.objects.exists())
+        apply_async.assert_called_once()
+
+    def test_webhook_signature(self):
+        os.environ['SIGNALWIRE_SIGNING_KEY'] = 'signing-key'
+        params = self.webhook(1)
+
+        self.assertEqual(self.client.post(self.url, params).status_code, 403)
+        signature = signalwire_signature(f'http://testserver{self.url}', params, 'signing-key')
+        response = self.client.post(self.url, params, headers={'X-SignalWire-Signature': signature})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SmsInboxMessage.objects.count(), 1)
+
+    def test_drain_logs_unknown_numbers_and_skips_logged_sids(self):
+        CommunicationLog.objects.create(
+            channel='SMS', direction='Inbound', body='Reply 3', recipient='+15551112222', external_message_id='SM00003'
+        )
+        for payload in [self.webhook(1), self.webhook(2, '+15553334444'), self.webhook(1), self.webhook(3)]:
+            enqueue_inbound_sms(payload)
+
+        result = process_sms_inbox()
+
+        self.assertEqual(result, {'processed': 4, 'logged': 2, 'delivery_updates': 0})
+        self.assertFalse(SmsInboxMessage.objects.exists())
+        self.assertEqual(CommunicationLog.objects.get(external_message_id='SM00001').patient, self.patient)
+        unknown = CommunicationLog.objects.get(external_message_id='SM00002')
+        self.assertIsNone(unknown.patient)
+        self.assertEqual(SmsThread.objects.get(phone_e164='+15553334444').unread_count, 1)
+
+    def test_drain_skips_sid_logged_concurrently(self):
+        for index in (1, 2):
+            enqueue_inbound_sms(self.webhook(index))
+        original = CommunicationLogQuerySet.values_list
+
+        def check_then_rival_insert(queryset, *fields, **kwargs):
+            # The mirror logs SM00001 right after the drain checked for it
+            logged = list(original(queryset, *fields, **kwargs))
+            if not CommunicationLog.objects.filter(external_message_id='SM00001').exists():
+                CommunicationLog.objects.create(
+                    channel='SMS', direction='Inbound', body='Reply 1', recipient='+15551112222',
+                    external_message_id='SM00001',
+                )
+            return logged
+
+        with mock.patch.object(CommunicationLogQuerySet, 'values_list', autospec=True, side_effect=check_then_rival_insert):
+            result = process_sms_inbox()
+
+        self.assertEqual(result['logged'], 1)
+        self.assertEqual(CommunicationLog.objects.filter(external_message_id='SM00001').count(), 1)
+        self.assertTrue(CommunicationLog.objects.filter(external_message_id='SM00002').exists())
+        thread = SmsThread.objects.get(phone_e164='+15551112222')
+        self.assertEqual((thread.message_count, thread.unread_count), (2, 2))
+
+    def test_replay_1k_webhooks(self):
+        senders = [f'+1555200{index:04d}' for index in range(100)] + ['+15551112222']
+        with mock.patch('birthday.tasks.process_sms_inbox_task.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as webhook_queries:
+                for index in range(1000):
+                    response = self.client.post(self.url, self.webhook(index, senders[index % len(senders)]))
+                    self.assertEqual(response.status_code, 200)
+        # One INSERT per webhook, and a single drain queued for the whole burst
+        self.assertEqual(len(webhook_queries), 1000)
+        apply_async.assert_called_once()
+
+        with CaptureQueriesContext(connection) as drain_queries:
+            result = process_sms_inbox(batch_size=500)
+
+        self.assertEqual(result, {'processed': 1000, 'logged': 1000, 'delivery_updates': 0})
+        self.assertLess(len(drain_queries), 40)
+        self.assertEqual(CommunicationLog.objects.filter(channel='SMS', direction='Inbound').count(), 1000)
+        self.assertEqual(CommunicationLog.objects.filter(patient=self.patient).count(), len(range(len(senders) - 1, 1000, len(senders))))
+        self.assertEqual(SmsThread.objects.count(), len(senders))
+        self.assertEqual(sum(SmsThread.objects.values_list('unread_count', flat=True)), 1000)
+
+
+class SmsDeliveryStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.logs = CommunicationLog.objects.bulk_create([
+            CommunicationLog(channel='SMS', status='Sent', body=f'Wish {index}', recipient=f'+1555300{index:04d}',
+                             external_message_id=f'SM{index:05d}')
+            for index in range(3)
+        ])
+
+    def receipt(self, sid, status, **extra):
+        return {'MessageSid': sid, 'MessageStatus': status, **extra}
+
+    def test_status_webhook_only_appends_to_inbox(self):
+        with mock.patch('birthday.tasks.process_sms_inbox_task.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                response = self.client.post(reverse('signalwire_status_webhook'), self.receipt('SM00000', 'delivered'))
+            self.client.post(reverse('signalwire_status_webhook'), {'MessageSid': 'SM00000'})
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(SmsInboxMessage.objects.values_list('kind', flat=True)), ['status'])
+        apply_async.assert_called_once()
+
+    def test_drain_applies_the_most_advanced_status(self):
+        for payload in [
+            self.receipt('SM00000', 'delivered'),
+            # Arrives late: must not move the message back to Sent
+            self.receipt('SM00000', 'sent'),
+            self.receipt('SM00001', 'queued'),
+            self.receipt('SM00002', 'undelivered', ErrorCode='30003'),
+        ]:
+            enqueue_delivery_receipt(payload)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = process_sms_inbox()
+
+        self.assertEqual(result, {'processed': 4, 'logged': 0, 'delivery_updates': 2})
+        statuses = dict(CommunicationLog.objects.values_list('external_message_id', 'status'))
+        self.assertEqual(statuses, {'SM00000': 'Delivered', 'SM00001': 'Sent', 'SM00002': 'Undelivered'})
+        self.assertEqual(CommunicationLog.objects.get(external_message_id='SM00002').error_message, 'SignalWire error 30003')
+        self.assertEqual(sum('UPDATE "birthday_communicationlog"' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_receipts_wait_for_their_message_to_be_logged(self):
+        enqueue_delivery_receipt(self.receipt('SM09999', 'delivered'))
+        stale = enqueue_delivery_receipt(self.receipt('SM08888', 'delivered'))
+        SmsInboxMessage.objects.filter(pk=stale.pk).update(received_at=self.now - timedelta(hours=2))
+
+        self.assertEqual(process_sms_inbox()['processed'], 1)
+        self.assertEqual([row.payload['MessageSid'] for row in SmsInboxMessage.objects.all()], ['SM09999'])
+
+        # The wish batch flushes its log; the next drain applies the waiting receipt
+        CommunicationLog.objects.create(channel='SMS', status='Sent', body='Late', recipient='+15553009999', external_message_id='SM09999')
+        self.assertEqual(process_sms_inbox()['delivery_updates'], 1)
+        self.assertEqual(CommunicationLog.objects.get(external_message_id='SM09999').status, 'Delivered')
+        self.assertFalse(SmsInboxMessage.objects.exists())
+
+    def test_hub_delivery_metrics_come_from_the_log(self):
+        enqueue_delivery_receipt(self.receipt('SM00000', 'delivered'))
+        enqueue_delivery_receipt(self.receipt('SM00001', 'failed'))
+        process_sms_inbox()
+
+        with mock.patch('birthday.utils.requests.get') as remote_get:
+            response = self.client.get(reverse('messages_hub'))
+
+        remote_get.assert_not_called()
+        self.assertEqual((response.context['delivered_today'], response.context['failed_today']), (1, 1))
+
+
 class DailyReportApiDocsTests(TestCase):
     def test_docs_page_renders(self):
         response = self.client.get(reverse('daily_report_api_docs'))
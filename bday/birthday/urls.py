@@ -3,9 +3,11 @@ from . import views, reports
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('api/birthday-popup/', views.birthday_popup_api, name='birthday_popup_api'),
     path('patients/', views.patient_list, name='patient_list'),
     path('patients/add/', views.patient_create, name='patient_create'),
     path('patients/<int:pk>/', views.patient_detail, name='patient_detail'),
+    path('patients/<int:pk>/activities/', views.patient_activity_history, name='patient_activity_history'),
     path('patients/<int:pk>/edit/', views.patient_update, name='patient_update'),
     path('patients/<int:pk>/delete/', views.patient_delete, name='patient_delete'),
     path('patients/bulk-delete/', views.patient_bulk_delete, name='patient_bulk_delete'),
@@ -59,6 +61,9 @@ urlpatterns = [
     path('sync/patients/<int:practice_id>/', views.sync_practice_patients, name='sync_practice_patients'),
     path('sync/patients/<int:practice_id>/preview/', views.preview_sync_patients, name='preview_sync_patients'),
     path('sync/patients/bulk-sync/', views.confirm_bulk_sync, name='confirm_bulk_sync'),
+    path('sync/jobs/<int:pk>/', views.sync_job_status, name='sync_job_status'),
+    path('patients/import/<int:pk>/', views.import_job_detail, name='import_job_detail'),
+    path('patients/import/<int:pk>/report.csv', views.import_job_csv, name='import_job_csv'),
 
     # --- Proceed Plan Management System ---
     # Membership Plans
@@ -91,4 +96,5 @@ urlpatterns = [
     path('messages/', views.messages_hub, name='messages_hub'),
     path('messages/send/', views.send_direct_sms, name='send_direct_sms'),
     path('messages/signalwire/webhook/', views.signalwire_sms_webhook, name='signalwire_sms_webhook'),
+    path('messages/signalwire/status/', views.signalwire_status_webhook, name='signalwire_status_webhook'),
 ]
@@ -1,10 +1,27 @@
+import base64
+import hashlib
+import hmac
 import logging
 import os
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
 import requests
+from django.conf import settings
+from django.core.mail import get_connection
+from requests.adapters import HTTPAdapter
+
+from .models import to_e164 as _to_e164
 
 logger = logging.getLogger(__name__)
 
 
+class MessageListTruncated(Exception):
+    """The Messages list still had pages left when max_pages was reached."""
+
+
 def _get_signalwire_credentials():
     """Return (project_id, api_token, space_url, from_number) or raise."""
     project_id = os.getenv('SIGNALWIRE_PROJECT_ID')
@@ -14,17 +31,161 @@ def _get_signalwire_credentials():
     return project_id, api_token, space_url, from_number
 
 
-def _to_e164(number):
-    """Normalize phone numbers to E.164 format (+1XXXXXXXXXX)."""
-    if not number:
-        return ''
-    raw = str(number).strip()
-    digits = ''.join(ch for ch in raw if ch.isdigit())
-    if len(digits) == 10:
-        return f'+1{digits}'
-    if len(digits) == 11 and digits.startswith('1'):
-        return f'+{digits}'
-    return raw if raw.startswith('+') else f'+{digits}' if digits else raw
+def signalwire_signature(url, params, signing_key):
+    """
+    Request signature SignalWire (like Twilio) sends in X-SignalWire-Signature: base64
+    HMAC-SHA1 of the full URL followed by each POST parameter name+value, sorted by name.
+    """
+    data = url + ''.join(f'{key}{params[key]}' for key in sorted(params))
+    digest = hmac.new(signing_key.encode(), data.encode(), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode()
+
+
+def is_valid_signalwire_request(request):
+    """
+    Check a webhook's signature against SIGNALWIRE_SIGNING_KEY.
+    Without a signing key configured every request is accepted.
+    """
+    signing_key = os.getenv('SIGNALWIRE_SIGNING_KEY')
+    if not signing_key:
+        return True
+    signature = request.headers.get('X-SignalWire-Signature') or request.headers.get('X-Twilio-Signature') or ''
+    expected = signalwire_signature(request.build_absolute_uri(), request.POST.dict(), signing_key)
+    return hmac.compare_digest(signature, expected)
+
+
+class SignalWireSMSClient:
+    """
+    SignalWire Compatibility REST API client holding a keep-alive, pooled
+    requests.Session so consecutive sends reuse the same TLS connections.
+    """
+
+    def __init__(self, project_id=None, api_token=None, space_url=None, from_number=None,
+                 max_workers=8, timeout=15, status_callback_url=None):
+        env_project_id, env_api_token, env_space_url, env_from_number = _get_signalwire_credentials()
+        self.project_id = project_id or env_project_id
+        self.api_token = api_token or env_api_token
+        self.space_url = space_url or env_space_url
+        self.from_number = from_number or env_from_number
+        # Public URL of signalwire_status_webhook; SignalWire posts delivery receipts there
+        self.status_callback_url = status_callback_url or os.getenv('SIGNALWIRE_STATUS_CALLBACK_URL', '')
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.auth = (self.project_id, self.api_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def is_configured(self):
+        return all([self.project_id, self.api_token, self.space_url, self.from_number])
+
+    @property
+    def messages_url(self):
+        # space_url may carry an explicit scheme (e.g. a local stub server)
+        base = self.space_url if '://' in self.space_url else f"https://{self.space_url}"
+        return f"{base.rstrip('/')}/api/laml/2010-04-01/Accounts/{self.project_id}/Messages.json"
+
+    def send(self, to_number, body):
+        """
+        Send a single SMS.
+        Returns:
+            bool: True if successful, False otherwise.
+            str: Message SID or Error message.
+        """
+        if not self.is_configured:
+            logger.error("SignalWire credentials are missing in .env")
+            return False, "SignalWire credentials missing"
+
+        data = {
+            # Normalize phone numbers to E.164
+            'From': _to_e164(self.from_number),
+            'To': _to_e164(to_number),
+            'Body': body,
+        }
+        if self.status_callback_url:
+            data['StatusCallback'] = self.status_callback_url
+
+        try:
+            resp = self.session.post(self.messages_url, data=data, timeout=self.timeout)
+            data = resp.json()
+
+            if resp.status_code in (200, 201):
+                sid = data.get('sid', '')
+                logger.info(f"SMS sent successfully via SignalWire. SID: {sid}")
+                return True, sid
+            else:
+                error_msg = data.get('message', '') or data.get('error', '') or resp.text
+                logger.error(f"SignalWire send failed ({resp.status_code}): {error_msg}")
+                return False, error_msg
+
+        except Exception as e:
+            logger.error(f"Failed to send SMS via SignalWire: {e}")
+            return False, str(e)
+
+    def send_batch(self, messages):
+        """
+        Send many SMS concurrently over a bounded thread pool.
+        `messages` is a list of (to_number, body) pairs; results are returned
+        as (success, sid_or_error) tuples in the same order.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        if len(messages) == 1 or self.max_workers <= 1:
+            return [self.send(to_number, body) for to_number, body in messages]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(messages))) as executor:
+            return list(executor.map(lambda message: self.send(*message), messages))
+
+    def iter_message_pages(self, params, max_pages=None):
+        """
+        Yield pages (lists of raw message resources) of the Messages list, newest first,
+        following next_page_uri. Raises requests.HTTPError on a failed page, and
+        MessageListTruncated after `max_pages` pages if the list goes on.
+        """
+        url, query, pages = self.messages_url, dict(params), 0
+        while url:
+            if max_pages is not None and pages >= max_pages:
+                raise MessageListTruncated(f'more than {max_pages} pages of messages for {params}')
+            resp = self.session.get(url, params=query, timeout=self.timeout)
+            if resp.status_code == 401:
+                raise requests.HTTPError(
+                    'SignalWire authentication failed — check your API Token (must be a REST API token, not a PSK token)'
+                )
+            resp.raise_for_status()
+            data = resp.json()
+            pages += 1
+            yield data.get('messages', [])
+
+            # next_page_uri already carries the filters and the page token
+            next_page_uri = data.get('next_page_uri')
+            url, query = (urljoin(self.messages_url, next_page_uri), None) if next_page_uri else (None, None)
+
+    def close(self):
+        self.session.close()
+
+
+_sms_client = None
+_sms_client_lock = threading.Lock()
+
+
+def get_sms_client():
+    """Shared SMS client, rebuilt if the SignalWire credentials change."""
+    global _sms_client
+    credentials = _get_signalwire_credentials()
+    with _sms_client_lock:
+        if _sms_client is None or (
+            _sms_client.project_id, _sms_client.api_token, _sms_client.space_url, _sms_client.from_number
+        ) != credentials or _sms_client.status_callback_url != os.getenv('SIGNALWIRE_STATUS_CALLBACK_URL', ''):
+            if _sms_client is not None:
+                _sms_client.close()
+            _sms_client = SignalWireSMSClient(
+                *credentials, max_workers=getattr(settings, 'SMS_SEND_MAX_WORKERS', 8)
+            )
+        return _sms_client
 
 
 def send_sms(to_number, body):
@@ -34,43 +195,82 @@ def send_sms(to_number, body):
         bool: True if successful, False otherwise.
         str: Message SID or Error message.
     """
-    project_id, api_token, space_url, from_number = _get_signalwire_credentials()
+    return get_sms_client().send(to_number, body)
 
-    if not project_id or not api_token or not space_url or not from_number:
-        logger.error("SignalWire credentials are missing in .env")
-        return False, "SignalWire credentials missing"
 
-    # Normalize phone numbers to E.164
-    to_str = _to_e164(to_number)
-    from_str = _to_e164(from_number)
+def send_sms_batch(messages):
+    """
+    Send a list of (to_number, body) SMS concurrently.
+    Returns a list of (success, sid_or_error) tuples in input order.
+    """
+    return get_sms_client().send_batch(messages)
+
 
-    url = f"https://{space_url}/api/laml/2010-04-01/Accounts/{project_id}/Messages.json"
+def send_email_batch(messages, connection=None):
+    """
+    Send a list of EmailMessage objects over a single SMTP connection.
+    A dropped connection is reopened once and the message retried.
+    Returns a list of (success, error_or_None) tuples in input order.
+    """
+    connection = connection or get_connection(fail_silently=False)
+    results = []
+    if not messages:
+        return results
 
     try:
-        resp = requests.post(
-            url,
-            auth=(project_id, api_token),
-            data={
-                'From': from_str,
-                'To': to_str,
-                'Body': body,
-            },
-            timeout=15,
-        )
-        data = resp.json()
+        connection.open()
+    except Exception as e:
+        logger.error(f"Unable to open email connection: {e}")
+        return [(False, str(e))] * len(messages)
 
-        if resp.status_code in (200, 201):
-            sid = data.get('sid', '')
-            logger.info(f"SMS sent successfully via SignalWire. SID: {sid}")
-            return True, sid
-        else:
-            error_msg = data.get('message', '') or data.get('error', '') or resp.text
-            logger.error(f"SignalWire send failed ({resp.status_code}): {error_msg}")
-            return False, error_msg
+    try:
+        for message in messages:
+            try:
+                try:
+                    sent = connection.send_messages([message])
+                except smtplib.SMTPServerDisconnected:
+                    logger.warning("SMTP connection dropped, reconnecting...")
+                    connection.close()
+                    connection.open()
+                    sent = connection.send_messages([message])
+                if sent:
+                    results.append((True, None))
+                else:
+                    results.append((False, 'Email backend did not send the message'))
+            except Exception as e:
+                logger.error(f"Failed to send email to {message.to}: {e}")
+                results.append((False, str(e)))
+    finally:
+        connection.close()
+    return results
 
-    except Exception as e:
-        logger.error(f"Failed to send SMS via SignalWire: {e}")
-        return False, str(e)
+
+def parse_signalwire_message(msg, sw_number):
+    """Flatten one Compatibility API message resource into the feed/mirror dict."""
+    from django.utils import timezone as tz
+    from datetime import datetime
+
+    msg_from = _to_e164(msg.get('from', ''))
+    msg_to = _to_e164(msg.get('to', ''))
+    direction = 'Outbound' if msg_from == sw_number else 'Inbound'
+
+    # Parse date
+    date_str = msg.get('date_sent') or msg.get('date_created') or ''
+    try:
+        created_at = datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S %z') if date_str else tz.now()
+    except (ValueError, TypeError):
+        created_at = tz.now()
+
+    return {
+        'sid': msg.get('sid', '') or '',
+        'from_number': msg_from,
+        'to_number': msg_to,
+        'direction': direction,
+        'status': (msg.get('status', '') or '').title(),
+        'body': msg.get('body', '') or '',
+        'created_at': created_at,
+        'gateway_number': sw_number,
+    }
 
 
 def fetch_signalwire_messages(sw_number, limit=120):
@@ -108,32 +308,9 @@ def fetch_signalwire_messages(sw_number, limit=120):
             return [], 'SignalWire authentication failed — check your API Token (must be a REST API token, not a PSK token)'
 
         merged = {}
-        from django.utils import timezone as tz
-        from datetime import datetime
-
         for msg in inbound + outbound:
-            sid = msg.get('sid', f"tmp-{id(msg)}")
-            msg_from = _to_e164(msg.get('from', ''))
-            msg_to = _to_e164(msg.get('to', ''))
-            direction = 'Outbound' if msg_from == sw_number else 'Inbound'
-
-            # Parse date
-            date_str = msg.get('date_sent') or msg.get('date_created') or ''
-            try:
-                created_at = datetime.strptime(date_str, '%a, %d %b %Y %H:%M:%S %z') if date_str else tz.now()
-            except (ValueError, TypeError):
-                created_at = tz.now()
-
-            merged[sid] = {
-                'sid': sid,
-                'from_number': msg_from,
-                'to_number': msg_to,
-                'direction': direction,
-                'status': (msg.get('status', '') or '').title(),
-                'body': msg.get('body', '') or '',
-                'created_at': created_at,
-                'gateway_number': sw_number,
-            }
+            item = parse_signalwire_message(msg, sw_number)
+            merged[item['sid'] or f"tmp-{id(msg)}"] = item
 
         feed = sorted(merged.values(), key=lambda x: x['created_at'], reverse=True)
         return feed, None
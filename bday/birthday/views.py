@@ -2,17 +2,26 @@ import pytz
 from datetime import datetime, timedelta
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from .models import Patient, MessageTemplate, ScheduledWish, SavedRecipient, PatientStatus, EmailSignature, clean_phone_number, PlanHistory, Practice
+from .models import Patient, MessageTemplate, ScheduledWish, SavedRecipient, PatientStatus, EmailSignature, clean_phone_number, to_e164 as _to_e164, birthday_for_year, Practice, SyncJob, ImportJob, ImportJobRow
 from .forms import PatientForm, UploadFileForm, MessageTemplateForm, ScheduledWishForm, SavedRecipientForm, EmailSignatureForm
-from datetime import datetime, date, timedelta, time
-from django.db.models.functions import ExtractMonth, ExtractDay
-import re
+from . import smo_sync
+from .dashboard import get_dashboard_stats
+from . import importer
+from . import sms_inbox
+from .importer import parse_pasted_patient_data
+from .rendering import PlaceholderContext, html_to_sms_text, render_text
+from .pagination import keyset_paginate
+from .search import search_patients
+from .smo_sync import get_smo_config
+from datetime import datetime, date, timedelta
+from django.db.models.functions import ExtractDay
+import csv
 import os
 import requests
 from email.utils import formataddr
 from urllib.parse import quote_plus
 from django.conf import settings
-from django.db.models import Q, Sum, Exists, OuterRef, Max, Count
+from django.db.models import Q, Sum, Exists, OuterRef, Count, Prefetch
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
@@ -24,173 +33,90 @@ def index(request):
     Renders the dashboard index page with comprehensive statistics.
     """
     today = date.today()
-    total_patients = Patient.objects.count()
-    
-    # Membership statistics
-    active_count = Patient.objects.filter(
-        enrollment_date__gte=today - timedelta(days=365)
-    ).count()
-    
-    expiring_soon_count = Patient.objects.filter(
-        enrollment_date__lt=today - timedelta(days=335),
-        enrollment_date__gte=today - timedelta(days=365)
-    ).count()
-    
-    just_expired_count = Patient.objects.filter(
-        enrollment_date__lt=today - timedelta(days=365),
-        enrollment_date__gte=today - timedelta(days=395)
-    ).count()
-    
-    expired_total_count = Patient.objects.filter(
-        enrollment_date__lt=today - timedelta(days=365)
-    ).count()
 
-    proceed_count = Patient.objects.filter(patient_type='Proceed').count()
-    regular_count = Patient.objects.filter(patient_type='Regular').count()
+    # Membership counters and plan-transition chart (2 queries, cached briefly)
+    stats = get_dashboard_stats(today)
 
-    # Card Types statistics (Active Plans only)
-    gold_count = Patient.objects.filter(
-        membership_plan='Gold',
-        enrollment_date__gte=today - timedelta(days=365)
-    ).count()
-    
-    silver_count = Patient.objects.filter(
-        membership_plan='Silver',
-        enrollment_date__gte=today - timedelta(days=365)
-    ).count()
-    
-    bronze_count = Patient.objects.filter(
-        membership_plan='Bronze',
-        enrollment_date__gte=today - timedelta(days=365)
-    ).count()
+    # Get upcoming birthdays (Top 5), ordered by the indexed birthday ordinal in SQL
+    upcoming_patients = list(
+        Patient.objects.upcoming_birthdays(today).annotate(
+            has_scheduled=Exists(ScheduledWish.objects.filter(patient_id=OuterRef('pk'), status='Pending'))
+        )[:5]  # Show only 5 for a compact dashboard
+    )
 
-    # Get upcoming birthdays (Top 5)
-    all_patients = Patient.objects.all()
-    
-    # Sort by upcoming birthdays logic
-    def days_until_next_birthday(patient):
-        if not patient.dob:
-            return 9999
-        bday = patient.dob
-        try:
-            this_year_bday = date(today.year, bday.month, bday.day)
-        except ValueError: # Leap year case
-            this_year_bday = date(today.year, 3, 1)
-            
-        if this_year_bday < today:
-            try:
-                next_year_bday = date(today.year + 1, bday.month, bday.day)
-            except ValueError:
-                next_year_bday = date(today.year + 1, 3, 1)
-            return (next_year_bday - today).days
-        return (this_year_bday - today).days
-
-    # Convert to list and sort
-    patient_list_sorted = sorted(list(all_patients), key=days_until_next_birthday)
-    upcoming_patients = patient_list_sorted[:5] # Show only 5 for a compact dashboard
-    
-    # For each patient, check if they have a pending scheduled wish
     for p in upcoming_patients:
-        p.has_scheduled = ScheduledWish.objects.filter(patient=p, status='Pending').exists()
         # Calculate age turning
         if p.dob:
-            bday = p.dob
-            this_year_bday = date(today.year, bday.month, bday.day)
-            if this_year_bday < today:
-                p.age_turning = today.year + 1 - bday.year
+            if birthday_for_year(p.dob, today.year) < today:
+                p.age_turning = today.year + 1 - p.dob.year
             else:
-                p.age_turning = today.year - bday.year
+                p.age_turning = today.year - p.dob.year
 
-    # Analytics: Plan Upgrades & Downgrades (Last 6 Months)
     import json
-    chart_months = []
-    upgrades_data = []
-    downgrades_data = []
-    renewals_data = []
-    
-    for i in range(5, -1, -1):
-        first_of_month = (today.replace(day=1) - timedelta(days=i*30)).replace(day=1)
-        month_label = first_of_month.strftime('%b')
-        chart_months.append(month_label)
-        
-        if first_of_month.month == 12:
-            next_month = first_of_month.replace(year=first_of_month.year + 1, month=1)
-        else:
-            next_month = first_of_month.replace(month=first_of_month.month + 1)
-            
-        up_count = PlanHistory.objects.filter(
-            change_type='Upgrade',
-            created_at__gte=first_of_month,
-            created_at__lt=next_month
-        ).count()
-        
-        down_count = PlanHistory.objects.filter(
-            change_type='Downgrade',
-            created_at__gte=first_of_month,
-            created_at__lt=next_month
-        ).count()
-
-        ren_count = PlanHistory.objects.filter(
-            change_type='Renewal',
-            created_at__gte=first_of_month,
-            created_at__lt=next_month
-        ).count()
-        
-        upgrades_data.append(up_count)
-        downgrades_data.append(down_count)
-        renewals_data.append(ren_count)
-
-    # Total Transition Stats for Pie Chart
-    total_up = PlanHistory.objects.filter(change_type='Upgrade').count()
-    total_down = PlanHistory.objects.filter(change_type='Downgrade').count()
-    total_ren = PlanHistory.objects.filter(change_type='Renewal').count()
-
     context = {
-        'total_patients': total_patients,
-        'proceed_count': proceed_count,
-        'regular_count': regular_count,
-        'active_count': active_count,
-        'expiring_soon_count': expiring_soon_count,
-        'just_expired_count': just_expired_count,
-        'expired_total_count': expired_total_count,
-        'gold_count': gold_count,
-        'silver_count': silver_count,
-        'bronze_count': bronze_count,
+        'total_patients': stats['total_patients'],
+        'proceed_count': stats['proceed_count'],
+        'regular_count': stats['regular_count'],
+        'active_count': stats['active_count'],
+        'expiring_soon_count': stats['expiring_soon_count'],
+        'just_expired_count': stats['just_expired_count'],
+        'expired_total_count': stats['expired_total_count'],
+        'gold_count': stats['gold_count'],
+        'silver_count': stats['silver_count'],
+        'bronze_count': stats['bronze_count'],
         'upcoming_birthdays': upcoming_patients,
-        'chart_labels': json.dumps(chart_months),
-        'chart_upgrades': json.dumps(upgrades_data),
-        'chart_downgrades': json.dumps(downgrades_data),
-        'chart_renewals': json.dumps(renewals_data),
-        'total_up': total_up,
-        'total_down': total_down,
-        'total_ren': total_ren,
+        'chart_labels': json.dumps(stats['chart_labels']),
+        'chart_upgrades': json.dumps(stats['chart_upgrades']),
+        'chart_downgrades': json.dumps(stats['chart_downgrades']),
+        'chart_renewals': json.dumps(stats['chart_renewals']),
+        'total_up': stats['total_up'],
+        'total_down': stats['total_down'],
+        'total_ren': stats['total_ren'],
     }
     return render(request, 'index.html', context)
 
-from django.core.paginator import Paginator
+
+def birthday_popup_api(request):
+    """JSON payload for the birthday popup, loaded lazily by base.html."""
+    from django.template.loader import render_to_string
+    from .context_processors import get_birthday_popup
+
+    try:
+        payload = get_birthday_popup()
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e), 'count': 0}, status=500)
+
+    count = payload['todays_birthdays_popup_count']
+    return JsonResponse({
+        'status': 'success',
+        'date': payload['todays_birthdays_popup_date'],
+        'is_tomorrow': payload['is_tomorrow'],
+        'count': count,
+        'patients': payload['todays_birthdays_popup'],
+        'html': render_to_string('birthday/partials/_birthday_popup.html', payload) if count else '',
+    })
+
 from django.db.models import Q
 
 # ... (existing imports)
 
+# Activities shown in the patient_list Timeline dropdown
+TIMELINE_PREVIEW_LIMIT = 5
+
+def _per_page(request, default=10):
+    try:
+        per_page = int(request.GET.get('per_page', default))
+    except ValueError:
+        return default
+    return per_page if per_page > 0 else default
+
 def patient_list(request):
     patients = Patient.objects.all()
     
     # 1. Search Logic
+    # Trigram-indexed and ranked on PostgreSQL, plain icontains elsewhere
     search_query = request.GET.get('q', '')
-    if search_query:
-        from django.db.models import Value
-        from django.db.models.functions import Concat
-
-        patients = patients.annotate(
-            full_name=Concat('first_name', Value(' '), 'last_name')
-        ).filter(
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(full_name__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(phone__icontains=search_query) |
-            Q(city__icontains=search_query)
-        )
+    patients, ranked = search_patients(patients, search_query)
 
     # 2. Month Filter Logic
     month_filter = request.GET.get('month', '')
@@ -204,23 +130,18 @@ def patient_list(request):
     # 3. Status Filter Logic (Proceed Status)
     status_filter = request.GET.get('status', '')
     today = date.today()
+    # Plan status in SQL (plan_progress reuses the annotated plan length per row)
+    patients = patients.with_plan_status(today)
 
     if status_filter == 'proceed_active':
-        patients = patients.filter(
-            patient_type='Proceed',
-            enrollment_date__gte=today - timedelta(days=365)
-        )
+        patients = patients.filter(patient_type='Proceed', plan_is_expired=False, enrollment_date__isnull=False)
     elif status_filter == 'proceed_inactive':
         patients = patients.filter(patient_type='Proceed').filter(
-            Q(enrollment_date__lt=today - timedelta(days=365)) |
+            Q(plan_is_expired=True) |
             Q(enrollment_date__isnull=True)
         )
     elif status_filter == 'expiring_soon':
-        patients = patients.filter(
-            patient_type='Proceed',
-            enrollment_date__lt=today - timedelta(days=335),
-            enrollment_date__gte=today - timedelta(days=365)
-        )
+        patients = patients.filter(patient_type='Proceed', plan_status_label='Expiring Soon')
     elif status_filter == 'not_registered':
         patients = patients.filter(patient_type='Regular')
 
@@ -257,59 +178,57 @@ def patient_list(request):
             sort_mode = 'day'
     else:
         if not sort_mode:
-            sort_mode = 'recent'
+            # Best matches first when searching
+            sort_mode = 'relevance' if ranked else 'recent'
 
-    per_page = request.GET.get('per_page', 10)
-    try:
-        per_page = int(per_page)
-    except ValueError:
-        per_page = 10
+    per_page = _per_page(request)
 
+    # Every ordering ends with the pk so keyset cursors are unambiguous
     if sort_mode == 'upcoming':
-        today = date.today()
-        # Convert to list for complex sorting
-        items_list = list(patients)
-        
-        def days_until_next_birthday(patient):
-            if not patient.dob:
-                return 9999
-            bday = patient.dob
-            try:
-                this_year_bday = bday.replace(year=today.year)
-            except ValueError:
-                this_year_bday = bday.replace(month=3, day=1, year=today.year)
-
-            if this_year_bday < today:
-                try:
-                    next_bday = bday.replace(year=today.year + 1)
-                except ValueError:
-                     next_bday = bday.replace(month=3, day=1, year=today.year + 1)
-                return (next_bday - today).days
-            else:
-                return (this_year_bday - today).days
-
-        items_list.sort(key=days_until_next_birthday)
-        patients = items_list
+        patients = patients.upcoming_birthdays(date.today())
+        ordering = ['birthday_sort_key', 'first_name', 'last_name', 'pk']
     elif sort_mode == 'recent':
         # Combined sort for Recently Added and Recently Updated (plan/details)
-        patients = patients.order_by('-updated_at')
+        ordering = ['-updated_at', '-pk']
     elif sort_mode == 'day':
         # Sort by day of month (useful when filtering by specific month)
-        patients = patients.annotate(day=ExtractDay('dob')).order_by('day')
+        patients = patients.annotate(day=ExtractDay('dob'))
+        ordering = ['day', 'pk']
+    elif sort_mode == 'relevance' and ranked:
+        ordering = ['-search_rank', '-updated_at', '-pk']
     else:
         # Default sort
-        patients = patients.order_by('-updated_at')
+        ordering = ['-updated_at', '-pk']
 
-    # Prefetch activities for the Timeline column
-    if isinstance(patients, list):
-        # Already a list (from upcoming sort), prefetching is different or handled manually if needed
-        pass
-    else:
-        patients = patients.prefetch_related('activities')
+    # Latest few activities for the Timeline column (full history loads on demand)
+    patients = patients.prefetch_related(Prefetch(
+        'activities',
+        queryset=PatientStatus.objects.defer('full_content').order_by('-created_at', '-pk')[:TIMELINE_PREVIEW_LIMIT],
+        to_attr='recent_activities',
+    ))
+
+    page_obj = keyset_paginate(
+        patients, ordering, per_page,
+        after=request.GET.get('after'), before=request.GET.get('before'), with_total=True,
+    ).with_query(request.GET)
 
-    paginator = Paginator(patients, per_page)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'patients': [{
+                'id': patient.pk,
+                'first_name': patient.first_name,
+                'last_name': patient.last_name,
+                'email': patient.email,
+                'phone': patient.phone,
+                'dob': patient.dob,
+                'patient_type': patient.patient_type,
+                'membership_plan': patient.membership_plan,
+                'plan_status': patient.plan_status_label,
+                'updated_at': patient.updated_at,
+            } for patient in page_obj],
+            'page': page_obj.as_dict(),
+        })
     
     # Get objects for the send message modal
     templates = MessageTemplate.objects.all().select_related('signature')
@@ -346,9 +265,29 @@ def patient_list(request):
         'current_sort': sort_mode,
         'per_page': per_page,
         'today': date.today(),
+        'timeline_preview_limit': TIMELINE_PREVIEW_LIMIT,
     }
     return render(request, 'birthday/patient_list.html', context)
 
+def patient_activity_history(request, pk):
+    """Full activity history of a patient, newest first, paged by cursor (JSON)."""
+    patient = get_object_or_404(Patient, pk=pk)
+    page = keyset_paginate(
+        patient.activities.all(), ['-created_at', '-pk'], _per_page(request, default=50),
+        after=request.GET.get('after'), before=request.GET.get('before'),
+    )
+    return JsonResponse({
+        'status': 'success',
+        'activities': [{
+            'id': activity.pk,
+            'activity_type': activity.activity_type,
+            'description': activity.description or '',
+            'full_content': activity.full_content or '',
+            'created_at': activity.created_at,
+        } for activity in page],
+        'page': page.as_dict(),
+    })
+
 def patient_detail(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
     return render(request, 'birthday/patient_detail.html', {
@@ -356,212 +295,6 @@ def patient_detail(request, pk):
         'today': date.today()
     })
 
-def parse_patient_file(file):
-    """
-    Parses the uploaded text file and returns a dictionary of patient data.
-    """
-    data = {}
-    content = file.read().decode('utf-8')
-    lines = content.splitlines()
-
-    # Mapping from file keys to model fields
-    field_map = {
-        'patient': 'first_name',
-        'middle_name': 'middle_name',
-        'last_name': 'last_name',
-        'dob': 'dob',
-        'PatientPhone': 'phone',
-        'PatientEmail': 'email',
-        'PUT_Address': 'address',
-        'PUT_City': 'city',
-        'PUT_State': 'state',
-        'PUT_ZipCode': 'zip_code',
-        'PUT_TodaysDate': 'enrollment_date',
-        # 'Result': 'payment_amount', # Removed as we use payment_method now
-    }
-    
-    membership_plan = None
-    payment_method = None
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Try to match key-value pair pattern: TYPE^KEY VALUE or just remaining text
-        parts = line.split(' ', 1)
-        if len(parts) < 2:
-            continue
-            
-        key_part = parts[0]
-        value = parts[1].strip()
-        
-        if '^' in key_part:
-            _, key = key_part.split('^', 1)
-        else:
-            continue # Skip lines that don't match format
-
-        # Handle specific fields
-        if key in field_map:
-            model_field = field_map[key]
-            
-            # Date conversion
-            if model_field in ['dob', 'enrollment_date']:
-                try:
-                    date_obj = datetime.strptime(value, '%m/%d/%Y')
-                    value = date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    pass # Keep original string or handle error
-            
-            data[model_field] = value
-        
-        # Handle Radio Buttons
-        if key_part.startswith('RB^') and value == 'True':
-            # Membership Plan: e.g. PUT_BronzePlan_SFYS -> Bronze
-            if 'Plan_SFYS' in key:
-                plan_name = key.replace('PUT_', '').replace('Plan_SFYS', '').replace('_', ' ')
-                # Ensure it matches choices if possible, capitalize
-                membership_plan = plan_name.capitalize()
-            
-            # Payment Method: e.g. PUT_CreditCard_SFYS -> Credit Card
-            if 'CreditCard' in key:
-                payment_method = 'Credit Card'
-            elif 'Cash' in key: # Assuming PUT_Cash_SFYS
-                payment_method = 'Cash'
-
-    if membership_plan:
-        data['membership_plan'] = membership_plan
-        data['patient_type'] = 'Proceed'
-    else:
-        # Default Regular if no plan found
-        data['patient_type'] = 'Regular'
-        # Ensure membership_plan is not set to avoid validation errors if model enforced choices strictly (it allows blank though)
-
-    if payment_method:
-        data['payment_method'] = payment_method
-        
-    return data
-
-def parse_pasted_patient_data(text):
-    """
-    Parses pasted text content in specific User-provided format (Key:Value)
-    Supports both line-separated and comma-separated formats.
-    """
-    data = {}
-    
-    # Normalize separators: if many commas and few newlines, likely comma-separated export
-    if ',' in text and (text.count(',') > text.count('\n')):
-        # Split by comma, but be wary of commas in values (less likely in this specific export)
-        items = text.replace('\n', ',').split(',')
-    else:
-        items = text.splitlines()
-
-    membership_plan = None
-    payment_method = None
-    
-    for item in items:
-        if ':' not in item:
-            continue
-            
-        key, value = item.split(':', 1)
-        key = key.strip().lower()
-        value = value.strip()
-        
-        if not value or value.lower() in ['none', 'null', '']:
-            continue
-            
-        # Full Name (Old format)
-        if key == 'name':
-            parts = value.split()
-            if len(parts) >= 2:
-                data['first_name'] = parts[0]
-                data['last_name'] = " ".join(parts[1:])
-            else:
-                data['first_name'] = value
-                data['last_name'] = ""
-        
-        # Split Name (New format)
-        elif key == 'first_name':
-            data['first_name'] = value
-        elif key == 'last_name':
-            data['last_name'] = value
-        elif key == 'middle_name':
-            data['middle_name'] = value
-            
-        # Email
-        elif key in ['email', 'email address']:
-            data['email'] = value
-            
-        # Phone
-        elif key in ['phone', 'phone number', 'mobile_number', 'mobile phone', 'mobile']:
-            data['phone'] = value
-            
-        # DOB
-        elif key in ['dob', 'date of birth', 'birth date', 'date_of_birth']:
-            # Handle multiple date formats
-            date_formats = ['%Y-%m-%d', '%m/%d/%Y', '%m-%d-%Y', '%d/%m/%Y']
-            for fmt in date_formats:
-                try:
-                    date_obj = datetime.strptime(value, fmt)
-                    data['dob'] = date_obj.strftime('%Y-%m-%d')
-                    break
-                except ValueError:
-                    continue
-        
-        # New Fields (Gender, Notes)
-        elif key == 'gender':
-            # Normalize to choices: Male, Female, Other
-            val_lower = value.lower()
-            if val_lower.startswith('f'): data['gender'] = 'Female'
-            elif val_lower.startswith('m'): data['gender'] = 'Male'
-            else: data['gender'] = 'Other'
-        elif key == 'notes':
-            data['notes'] = value
-                
-        # Address Fields
-        elif key == 'address':
-            data['address'] = value
-        elif key == 'city':
-            data['city'] = value
-        elif key == 'state':
-            data['state'] = value
-        elif key == 'zip code':
-            data['zip_code'] = value
-        
-        # Enrollment Date
-        elif key == 'todays date':
-            try:
-                date_obj = datetime.strptime(value, '%m/%d/%Y')
-                data['enrollment_date'] = date_obj.strftime('%Y-%m-%d')
-            except ValueError:
-                pass
-
-        # Membership and Payment checks (value is 'Yes' - old format)
-        elif str(value).lower() == 'yes':
-             if 'bronze plan' in key:
-                 membership_plan = 'Bronze'
-             elif 'silver plan' in key:
-                 membership_plan = 'Silver'
-             elif 'gold plan' in key:
-                 membership_plan = 'Gold'
-             elif 'cash' in key:
-                 payment_method = 'Cash'
-             elif 'credit' in key:
-                 payment_method = 'Credit Card'
-                 
-    if membership_plan:
-        data['membership_plan'] = membership_plan
-        data['patient_type'] = 'Proceed'
-    else:
-        # Default Regular if no plan found but allow logic to proceed
-        if 'patient_type' not in data:
-            data['patient_type'] = 'Regular'
-
-    if payment_method:
-        data['payment_method'] = payment_method
-        
-    return data
-
 def patient_create(request):
     if request.method == 'POST':
         form = PatientForm(request.POST)
@@ -573,125 +306,9 @@ def patient_create(request):
                     messages.error(request, "No files selected.")
                     return redirect('patient_list')
 
-                success_count = 0
-                error_count = 0
-                duplicate_count = 0
-                errors = []
-                duplicates = []
-
-                for file in files:
-                    try:
-                        patient_data = parse_patient_file(file)
-                        
-                        # Check for existing patient
-                        email = patient_data.get('email')
-                        phone = clean_phone_number(patient_data.get('phone', ''))
-                        fname = patient_data.get('first_name')
-                        lname = patient_data.get('last_name')
-                        dob = patient_data.get('dob')
-                        new_enrollment_date = patient_data.get('enrollment_date')
-                        
-                        existing_patient = None
-                        if email:
-                            existing_patient = Patient.objects.filter(email=email).first()
-                        
-                        if not existing_patient and phone:
-                            existing_patient = Patient.objects.filter(phone=phone).first()
-
-                        # Fallback: Check for Name + DOB if no email/phone match found
-                        if not existing_patient and fname and lname and dob:
-                            existing_patient = Patient.objects.filter(
-                                first_name__iexact=fname,
-                                last_name__iexact=lname,
-                                dob=dob
-                            ).first()
-
-                        if existing_patient:
-                            name = f"{existing_patient.first_name} {existing_patient.last_name}"
-                            
-                            # Determine if plan was upgraded, downgraded or renewed
-                            old_plan = existing_patient.membership_plan
-                            new_plan = patient_data.get('membership_plan')
-                            
-                            plan_ranks = {'Bronze': 1, 'Silver': 2, 'Gold': 3}
-                            old_rank = plan_ranks.get(old_plan, 0)
-                            new_rank = plan_ranks.get(new_plan, 0)
-                            
-                            if new_rank > old_rank:
-                                update_desc = f"Plan upgraded from {old_plan} to {new_plan}"
-                            elif new_rank < old_rank:
-                                update_desc = f"Plan downgraded from {old_plan} to {new_plan}"
-                            else:
-                                update_desc = f"Plan renewed to {new_plan}"
-                            # Convert existing date for comparison if it's a date object
-                            existing_enrollment_date = str(existing_patient.enrollment_date) if existing_patient.enrollment_date else None
-
-                            # If enrollment date is different, update the patient (Renewal/Update)
-                            if new_enrollment_date and new_enrollment_date != existing_enrollment_date:
-                                # Update fields
-                                for key, val in patient_data.items():
-                                    setattr(existing_patient, key, val)
-                                existing_patient.save()
-                                
-                                # Log update activity
-                                PatientStatus.objects.create(
-                                    patient=existing_patient,
-                                    activity_type='Plan Updated',
-                                    description=update_desc,
-                                    full_content=f"Patient automatically updated during import. New Enrollment Date: {new_enrollment_date}"
-                                )
-                                success_count += 1
-                                continue
-                            else:
-                                # Truly a duplicate (same enrollment date or no new date)
-                                duplicate_count += 1
-                                duplicates.append(f"<strong>{name}</strong> - Email: {email or 'N/A'}")
-                                continue
-
-                        # Create a form with the parsed data to validate it
-                        patient_form = PatientForm(data=patient_data)
-                        if patient_form.is_valid():
-                            new_patient = patient_form.save()
-                            PatientStatus.objects.create(
-                                patient=new_patient,
-                                activity_type='Added',
-                                description=f"Patient imported via file: {file.name}"
-                            )
-                            success_count += 1
-                        else:
-                            error_count += 1
-                            # Collect formatted errors
-                            err_msg = []
-                            for field, error_list in patient_form.errors.items():
-                                err_msg.append(f"{field}: {', '.join(error_list)}")
-                            errors.append(f"{file.name}: {'; '.join(err_msg)}")
-                    except Exception as e:
-                        error_count += 1
-                        errors.append(f"{file.name}: {str(e)}")
-                
-                # Report results
-                if success_count > 0:
-                    messages.success(request, f'Successfully imported {success_count} patient(s).')
-                
-                if duplicate_count > 0:
-                     # Create a formatted list of duplicates
-                     dup_list = "<ul class='mb-0 text-start'>"
-                     for d in duplicates[:5]:  # Show first 5
-                         dup_list += f"<li>{d}</li>"
-                     if len(duplicates) > 5:
-                         dup_list += f"<li>...and {len(duplicates)-5} others</li>"
-                     dup_list += "</ul>"
-                     
-                     messages.warning(request, f'Skipped {duplicate_count} duplicate patient(s):<br>{dup_list}', extra_tags='safe')
-
-                if error_count > 0:
-                    # Show first few errors to avoid screen clutter
-                    errors_display = "<br>".join(errors[:5])
-                    if len(errors) > 5:
-                        errors_display += f"<br>...and {len(errors)-5} more."
-                    messages.error(request, f'Failed to import {error_count} file(s):<br>{errors_display}', extra_tags='safe')
-                
-                return redirect('patient_list')
+                # Stage the files and import them in the background; the job page reports per-file outcomes
+                job = _start_import_job(files)
+                return redirect('import_job_detail', pk=job.pk)
         
         elif 'paste_content' in request.POST:
             raw_content = request.POST.get('raw_content', '')
@@ -730,32 +347,14 @@ def patient_create(request):
 
                 if existing_patient:
                     # Update Logic
-                    old_plan = existing_patient.membership_plan
-                    new_plan = patient_data.get('membership_plan')
-                    
-                    plan_ranks = {'Bronze': 1, 'Silver': 2, 'Gold': 3}
-                    old_rank = plan_ranks.get(old_plan, 0)
-                    new_rank = plan_ranks.get(new_plan, 0)
-                    
-                    if new_rank > old_rank:
-                        update_desc = f"Plan upgraded from {old_plan} to {new_plan}"
-                    elif new_rank < old_rank:
-                        update_desc = f"Plan downgraded from {old_plan} to {new_plan}"
-                    else:
-                        update_desc = f"Plan renewed to {new_plan}"
-
                     existing_enrollment_date = str(existing_patient.enrollment_date) if existing_patient.enrollment_date else None
 
                     if new_enrollment_date and new_enrollment_date != existing_enrollment_date:
                         for key, val in patient_data.items():
                             setattr(existing_patient, key, val)
-                        existing_patient.save()
-                        
-                        PatientStatus.objects.create(
-                            patient=existing_patient,
-                            activity_type='Plan Updated',
-                            description=update_desc,
-                            full_content=f"Patient automatically updated via pasted content. New Enrollment Date: {new_enrollment_date}"
+                        # Patient.save() logs the upgrade/downgrade/renewal
+                        existing_patient.save(
+                            audit_note=f"Patient automatically updated via pasted content. New Enrollment Date: {new_enrollment_date}"
                         )
                         messages.success(request, f"Patient {existing_patient} updated successfully (Renewal/Upgrade).")
                     else:
@@ -764,12 +363,8 @@ def patient_create(request):
                     # Create New Logic
                     patient_form = PatientForm(data=patient_data)
                     if patient_form.is_valid():
-                        new_patient = patient_form.save()
-                        PatientStatus.objects.create(
-                            patient=new_patient,
-                            activity_type='Added',
-                            description="Patient imported via text paste"
-                        )
+                        new_patient = patient_form.save(commit=False)
+                        new_patient.save(audit_note="Patient imported via text paste")
                         messages.success(request, f"Patient {new_patient} created successfully!")
                     else:
                         # Error handling
@@ -785,12 +380,8 @@ def patient_create(request):
         
         elif 'save_patient' in request.POST:
             if form.is_valid():
-                new_patient = form.save()
-                PatientStatus.objects.create(
-                    patient=new_patient,
-                    activity_type='Added',
-                    description="Patient created manually"
-                )
+                new_patient = form.save(commit=False)
+                new_patient.save(audit_note="Patient created manually")
                 messages.success(request, 'Patient created successfully!')
                 return redirect('patient_list')
 
@@ -808,24 +399,10 @@ def patient_update(request, pk):
     if request.method == 'POST':
         form = PatientForm(request.POST, instance=patient)
         if form.is_valid():
-            # Check for plan changes
-            old_plan = patient.membership_plan
-            updated_patient = form.save()
-            new_plan = updated_patient.membership_plan
-            
-            activity_type = 'Details Updated'
-            description = "Patient details were updated"
-            
-            if old_plan != new_plan:
-                activity_type = 'Plan Updated'
-                description = f"Plan changed from {old_plan} to {new_plan}"
-                
-            PatientStatus.objects.create(
-                patient=updated_patient,
-                activity_type=activity_type,
-                description=description
-            )
-            
+            # Patient.save() logs one activity: the plan change, or the details update
+            updated_patient = form.save(commit=False)
+            updated_patient.save(audit_note="Patient details were updated")
+
             messages.success(request, 'Patient updated successfully!')
             return redirect('patient_list')
     else:
@@ -867,7 +444,7 @@ def toggle_patient_verification(request, pk):
     """
     patient = get_object_or_404(Patient, pk=pk)
     patient.is_verified = not patient.is_verified
-    patient.save()
+    patient.save(update_fields=['is_verified', 'updated_at'])
     
     return JsonResponse({
         'status': 'success', 
@@ -910,7 +487,7 @@ def toggle_communication_status(request, pk):
         activity_type = 'Opt-in'
         description = "Opted back into communications."
         
-    patient.save()
+    patient.save(update_fields=['accepts_marketing', 'unsubscribe_reason', 'unsubscribed_at', 'updated_at'])
     
     # Log activity
     from .models import PatientStatus
@@ -966,27 +543,40 @@ def template_delete(request, pk):
     return redirect('template_list')
 
 # --- Scheduled Wishes Views ---
-from django.core.paginator import Paginator
 
 def scheduled_list(request):
     # Filter by status if provided
     status_filter = request.GET.get('status')
-    per_page = request.GET.get('per_page', 10)
+    per_page = _per_page(request)
     
-    # Get all wishes ordered by scheduled_for in reverse (newest first)
-    wishes_list = ScheduledWish.objects.all().order_by('-scheduled_for')
+    # Get all wishes, newest scheduled first
+    wishes_list = ScheduledWish.objects.all().select_related('patient')
     
     if status_filter:
         wishes_list = wishes_list.filter(status=status_filter)
         
-    paginator = Paginator(wishes_list, per_page)
-    page_number = request.GET.get('page')
-    wishes = paginator.get_page(page_number)
+    wishes = keyset_paginate(
+        wishes_list, ['-scheduled_for', '-pk'], per_page,
+        after=request.GET.get('after'), before=request.GET.get('before'), with_total=True,
+    ).with_query(request.GET)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'wishes': [{
+                'id': wish.pk,
+                'patient_id': wish.patient_id,
+                'patient': str(wish.patient),
+                'scheduled_for': wish.scheduled_for,
+                'status': wish.status,
+            } for wish in wishes],
+            'page': wishes.as_dict(),
+        })
         
     return render(request, 'birthday/scheduled_list.html', {
         'wishes': wishes, 
         'current_status': status_filter,
-        'per_page': int(per_page),
+        'per_page': per_page,
         'templates': MessageTemplate.objects.all(),
         'saved_cc': SavedRecipient.objects.filter(recipient_type='CC'),
         'saved_bcc': SavedRecipient.objects.filter(recipient_type='BCC'),
@@ -1084,6 +674,13 @@ def quick_send_message(request):
             
             scheduled_dt = tz.localize(datetime.combine(target_date, target_time))
 
+        practice = PracticeSettings.get_settings()
+        placeholder_context = PlaceholderContext(
+            patient,
+            practice_name=practice.practice_name,
+            plan_duration_days=practice.plan_duration_days,
+        )
+
         success_count = 0
         for channel in channels:
             # Find closest matching template for this channel if none provided or if base doesn't match
@@ -1112,8 +709,8 @@ def quick_send_message(request):
                 raw_subject = subject
                 raw_body = body
 
-            chan_subject = (raw_subject or '').replace('{first_name}', patient.first_name).replace('{last_name}', patient.last_name)
-            chan_body = (raw_body or '').replace('{first_name}', patient.first_name).replace('{last_name}', patient.last_name)
+            chan_subject = render_text(raw_subject or '', placeholder_context)
+            chan_body = render_text(raw_body or '', placeholder_context)
 
             # For Scheduled Email wishes, we must bake the signature into the body
             # because ScheduledWish doesn't have a separate signature field, 
@@ -1187,22 +784,9 @@ def quick_send_message(request):
                     success_count += 1
                 else:  # SMS
                     from .utils import send_sms 
-                    import re
-                    import html
                     
                     # Convert HTML structure to plain text
-                    text_content = chan_body.replace('</p>', '\n\n')
-                    text_content = text_content.replace('<br>', '\n').replace('<br/>', '\n').replace('<br />', '\n')
-                    text_content = text_content.replace('</div>', '\n')
-                    
-                    # Strip all other tags
-                    clean_body = re.sub('<[^<]+?>', '', text_content)
-                    
-                    # Decode HTML entities (e.g. &nbsp; -> space)
-                    clean_body = html.unescape(clean_body)
-                    
-                    # Normalize whitespace (limit to 2 consecutive newlines)
-                    clean_body = re.sub(r'\n{3,}', '\n\n', clean_body).strip()
+                    clean_body = html_to_sms_text(chan_body)
                     
                     success, result = send_sms(patient.phone, clean_body)
                     if success:
@@ -1384,12 +968,82 @@ def scheduled_update_ajax(request, pk):
     wish.save()
     return JsonResponse({'status': 'success', 'message': 'Wish updated successfully!'})
 
-def get_smo_config():
-    return {
-        'API_KEY': os.getenv('SMO_API_KEY'),
-        'BASE_URL': os.getenv('SMO_BASE_URL', 'https://smo.dentalhub.cloud'),
-        'CLIENT_ID': os.getenv('SMO_CLIENT_ID', '1'),
-    }
+def _start_sync_job(**fields):
+    """Create a SyncJob and hand it to Celery; the request returns immediately."""
+    from .tasks import run_sync_job_task
+
+    job = SyncJob.objects.create(**fields)
+    try:
+        # Fail fast instead of retrying the broker connection inside the request
+        run_sync_job_task.apply_async((job.pk,), retry=False)
+    except Exception as e:
+        # Never sync inline: SMO calls would hold the worker for the whole sync. The user retries.
+        print(f"Celery unavailable ({e}); sync job #{job.pk} not queued")
+        job.status = 'Failed'
+        job.message = "The sync could not be queued (task queue unavailable). Please try again."
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'message', 'finished_at'])
+    return job
+
+
+def _sync_job_response(request, job, redirect_to='patient_list'):
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or request.content_type == 'application/json':
+        return JsonResponse({
+            'status': 'success',
+            'job_id': job.pk,
+            'status_url': reverse('sync_job_status', args=[job.pk]),
+        })
+    messages.info(request, f"{job.get_kind_display()} started in the background (job #{job.pk}).")
+    return redirect(redirect_to)
+
+
+def _start_import_job(files):
+    """Stage uploaded patient files and hand them to Celery as an ImportJob."""
+    from .tasks import run_import_job_task
+
+    job = ImportJob.objects.create()
+    importer.stage_import_files(job, files)
+    try:
+        # Fail fast instead of retrying the broker connection inside the request
+        run_import_job_task.apply_async((job.pk,), retry=False)
+    except Exception as e:
+        # Never import inline: a large batch would block the worker. The user uploads again.
+        print(f"Celery unavailable ({e}); import job #{job.pk} not queued")
+        importer.fail_unqueued_import_job(job)
+    return job
+
+
+def import_job_detail(request, pk):
+    """Progress and per-file report of a patient file import; ?format=json for polling."""
+    job = get_object_or_404(ImportJob, pk=pk)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'status': 'success', 'job': job.as_dict()})
+
+    rows = job.rows.select_related('patient')
+    outcome = request.GET.get('outcome', '')
+    if outcome:
+        rows = rows.filter(outcome=outcome)
+
+    return render(request, 'birthday/import_job_detail.html', {
+        'job': job,
+        'rows': rows,
+        'outcome': outcome,
+        'outcome_choices': ImportJobRow.OUTCOME_CHOICES,
+    })
+
+
+def import_job_csv(request, pk):
+    """Download the per-file import report as CSV."""
+    job = get_object_or_404(ImportJob, pk=pk)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="import-job-{job.pk}.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['File', 'Outcome', 'Reason', 'Patient'])
+    for row in job.rows.select_related('patient'):
+        patient = f"{row.patient.first_name} {row.patient.last_name}" if row.patient else ''
+        writer.writerow([row.file_name, row.get_outcome_display(), row.reason, patient])
+    return response
+
 
 def sync_practices(request):
     config = get_smo_config()
@@ -1399,107 +1053,15 @@ def sync_practices(request):
         messages.error(request, "SMO_API_KEY not found in .env")
         return redirect('patient_list')
     
-    headers = {"X-API-Key": config['API_KEY']}
-    url = f"{config['BASE_URL']}/review/api/clients/{client_id}/practices"
-    
-    try:
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        practices_data = data.get("practices", [])
-        
-        if not practices_data and isinstance(data, list):
-            practices_data = data
-            
-        count = 0
-        debug_info = ""
-        for p_data in practices_data:
-            p_name = p_data.get('name') or p_data.get('practice_name') or p_data.get('display_name') or 'Unknown Practice'
-            p_loc = p_data.get('location') or p_data.get('city') or p_data.get('office_location') or ''
-            p_ext_id = p_data.get('id') or p_data.get('pk')
-            
-            if not p_ext_id:
-                continue
-
-            if p_name == 'Unknown Practice' and p_data:
-                debug_info = f" Keys found: {list(p_data.keys())}"
-
-            practice, created = Practice.objects.update_or_create(
-                external_id=str(p_ext_id),
-                defaults={
-                    'name': p_name,
-                    'location': p_loc,
-                    'client_id': str(client_id),
-                }
-            )
-            count += 1
-        
-        success_msg = f"Successfully synced {count} practices for Client ID {client_id}."
-        if debug_info:
-            success_msg += debug_info
-        messages.success(request, success_msg)
-    except Exception as e:
-        messages.error(request, f"Error syncing practices for Client ID {client_id}: {str(e)}")
-        
-    return redirect('patient_list')
+    job = _start_sync_job(kind='practices', client_id=str(client_id))
+    return _sync_job_response(request, job)
 
 def sync_practice_patients(request, practice_id):
     practice = get_object_or_404(Practice, pk=practice_id)
-    config = get_smo_config()
-    client_id = practice.client_id or config['CLIENT_ID']
-    headers = {"X-API-Key": config['API_KEY']}
-    
-    params = {}
-    if practice.last_sync:
-        params['updated_since'] = practice.last_sync.strftime('%Y-%m-%dT%H:%M:%SZ')
-    
-    url = f"{config['BASE_URL']}/review/api/clients/{client_id}/practices/{practice.external_id}/patients"
     
-    try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
-        response.raise_for_status()
-        patients_data = response.json().get("patients", [])
-        
-        created_count = 0
-        updated_count = 0
-        
-        for p_data in patients_data:
-            ext_id = str(p_data.get('id'))
-            
-            defaults = {
-                'practice': practice,
-                'first_name': p_data.get('first_name', ''),
-                'last_name': p_data.get('last_name', ''),
-                'email': p_data.get('email', ''),
-                'phone': clean_phone_number(p_data.get('phone', '')),
-                'patient_type': 'Regular',
-            }
-            
-            dob_str = p_data.get('dob')
-            if dob_str:
-                try:
-                    defaults['dob'] = datetime.strptime(dob_str, '%Y-%m-%d').date()
-                except:
-                    pass
-            
-            patient, created = Patient.objects.update_or_create(
-                external_id=ext_id,
-                defaults=defaults
-            )
-            
-            if created:
-                created_count += 1
-            else:
-                updated_count += 1
-                
-        practice.last_sync = datetime.now()
-        practice.save()
-        
-        messages.success(request, f"Practice {practice.name}: Created {created_count}, Updated {updated_count} patients.")
-    except Exception as e:
-        messages.error(request, f"Error syncing patients for {practice.name}: {str(e)}")
-        
-    return redirect('patient_list')
+    # Streams the SMO listing page by page and bulk-upserts each page, in a Celery worker
+    job = _start_sync_job(kind='practice_patients', practice=practice)
+    return _sync_job_response(request, job)
 
 def delete_practice(request, practice_id):
     practice = get_object_or_404(Practice, pk=practice_id)
@@ -1524,6 +1086,8 @@ def preview_sync_patients(request, practice_id):
         data = response.json()
         patients_api = data.get("patients", [])
         
+        # Existing patients are loaded once and matched in memory
+        match_index = smo_sync.PatientMatchIndex.load()
         patients_with_status = []
         for p in patients_api:
             p_id = p.get('id') or p.get('patient_id')
@@ -1538,43 +1102,18 @@ def preview_sync_patients(request, practice_id):
             if not p_dob_str:
                 continue
 
-            exists = False
-            match_reason = ""
-
-            # 1. Match by External ID
-            if p_ext_id:
-                if Patient.objects.filter(external_id=p_ext_id).exists():
-                    exists = True
-                    match_reason = "ID Match"
-            
-            # 2. Match by Email + Name (Prevents mixing family members sharing an email)
-            if not exists and p_email:
-                if Patient.objects.filter(email__iexact=p_email, first_name__iexact=p_fname).exists():
-                    exists = True
-                    match_reason = "Email + Name Match"
-            
-            # 3. Match by Name + Phone (The requested check)
-            if not exists and p_phone and p_fname and p_lname:
-                if Patient.objects.filter(phone=p_phone, first_name__iexact=p_fname, last_name__iexact=p_lname).exists():
-                    exists = True
-                    match_reason = "Phone + Name Match"
-            
-            # 4. Match by Name + DOB (Very reliable fallback)
-            if not exists and p_fname and p_lname and p_dob_str:
+            # Try to parse API DOB
+            p_dob = None
+            for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'):
                 try:
-                    # Try to parse API DOB
-                    p_dob = None
-                    for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'):
-                        try:
-                            p_dob = datetime.strptime(p_dob_str, fmt).date()
-                            break
-                        except: continue
-                    
-                    if p_dob and Patient.objects.filter(first_name__iexact=p_fname, last_name__iexact=p_lname, dob=p_dob).exists():
-                        exists = True
-                        match_reason = "Name + DOB Match"
-                except:
-                    pass
+                    p_dob = datetime.strptime(p_dob_str, fmt).date()
+                    break
+                except: continue
+
+            matched_pk, match_reason = match_index.match(
+                external_id=p_ext_id, email=p_email, first_name=p_fname, last_name=p_lname, phone=p_phone, dob=p_dob,
+            )
+            exists = matched_pk is not None
             
             p['exists'] = exists
             p['match_reason'] = match_reason
@@ -1606,106 +1145,23 @@ def confirm_bulk_sync(request):
         
         practice = get_object_or_404(Practice, pk=practice_id)
         
-        created_count = 0
-        updated_count = 0
-        
-        updated_list = []
-        created_list = []
-
-        for p_data in selected_patients:
-            # 1. Normalize and Extract data
-            api_id = p_data.get('id') or p_data.get('patient_id')
-            api_ext_id = str(api_id) if api_id else None
-            
-            p_fname = (p_data.get('first_name') or '').strip()
-            p_mname = (p_data.get('middle_name') or '').strip()
-            p_lname = (p_data.get('last_name') or '').strip()
-            p_email = (p_data.get('email') or p_data.get('email_address') or '').strip()
-            p_phone = clean_phone_number(p_data.get('phone') or p_data.get('mobile') or p_data.get('phone_number') or '')
-            p_dob_str = p_data.get('date_of_birth') or p_data.get('dob') or p_data.get('birth_date') or ''
-            p_gender = p_data.get('gender') or p_data.get('sex') or ''
-
-            full_name = f"{p_fname} {p_lname}".strip()
-
-            if not p_fname and not p_lname:
-                continue
-
-            # 2. Match with Existing Record
-            existing_patient = None
-            
-            # Try External ID Match
-            if api_ext_id and api_ext_id != 'None':
-                existing_patient = Patient.objects.filter(external_id=api_ext_id).first()
-            
-            # Try Email + Name Match
-            if not existing_patient and p_email:
-                existing_patient = Patient.objects.filter(email__iexact=p_email, first_name__iexact=p_fname).first()
-            
-            # Try Name + Phone Match
-            if not existing_patient and p_phone and p_fname and p_lname:
-                existing_patient = Patient.objects.filter(
-                    phone=p_phone, 
-                    first_name__iexact=p_fname, 
-                    last_name__iexact=p_lname
-                ).first()
-
-            # 3. Prepare the update data
-            defaults = {
-                'practice': practice,
-                'first_name': p_fname,
-                'middle_name': p_mname, # Crucial: Sync middle name to avoid 'Timothy John John Chisser'
-                'last_name': p_lname,
-                'email': p_email,
-                'phone': p_phone,
-                'gender': p_gender if p_gender in ['Male', 'Female', 'Other'] else 'Other',
-                'patient_type': 'Regular',
-            }
-
-            if p_dob_str:
-                for fmt in ('%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y'):
-                    try:
-                        defaults['dob'] = datetime.strptime(p_dob_str, fmt).date()
-                        break
-                    except: continue
-
-            # Final safety check: if we still don't have a DOB, skip this patient (database requires it)
-            if 'dob' not in defaults:
-                continue
-
-            # 4. Save
-            if existing_patient:
-                # Update existing record
-                for attr, value in defaults.items():
-                    setattr(existing_patient, attr, value)
-                if api_ext_id and api_ext_id != 'None':
-                    existing_patient.external_id = api_ext_id
-                existing_patient.save()
-                updated_count += 1
-                updated_list.append({'name': full_name, 'id': existing_patient.pk})
-            else:
-                # Create new record
-                new_patient = Patient.objects.create(external_id=api_ext_id if api_ext_id != 'None' else None, **defaults)
-                created_count += 1
-                created_list.append({'name': full_name, 'id': new_patient.pk})
-        
-        practice.last_sync = datetime.now()
-        practice.save()
-        
-        return JsonResponse({
-            'status': 'success', 
-            'message': f"Sync Complete: {updated_count} updated, {created_count} created.",
-            'updated_patients': updated_list,
-            'created_patients': created_list,
-        })
+        job = _start_sync_job(kind='bulk_sync', practice=practice, payload=selected_patients)
+        return _sync_job_response(request, job)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
+def sync_job_status(request, pk):
+    """Progress of a background SMO sync job, polled by the patient list page."""
+    job = get_object_or_404(SyncJob, pk=pk)
+    return JsonResponse({'status': 'success', 'job': job.as_dict()})
+
+
 # =============================================================================
 # PROCEED PLAN MANAGEMENT SYSTEM - NEW VIEWS
 # =============================================================================
 
-from .models import MembershipPlan, Campaign, CampaignExecution, PracticeSettings, ServicePricing, CommunicationLog
+from .models import MembershipPlan, Campaign, CampaignExecution, PracticeSettings, ServicePricing, CommunicationLog, SmsMirrorState, SmsThread
 from .forms import MembershipPlanForm, CampaignForm, PracticeSettingsForm, ServicePricingForm
 
 
@@ -2021,20 +1477,17 @@ def analytics_dashboard(request):
     silver_count = Patient.objects.filter(membership_plan='Silver', patient_type='Proceed').count()
     bronze_count = Patient.objects.filter(membership_plan='Bronze', patient_type='Proceed').count()
     
-    # Status breakdown
-    active_count = 0
-    expiring_soon_count = 0
-    expired_count = 0
-    
-    proceed_patients_qs = Patient.objects.filter(patient_type='Proceed', enrollment_date__isnull=False)
-    for patient in proceed_patients_qs:
-        progress = patient.plan_progress
-        if progress['is_expired']:
-            expired_count += 1
-        elif progress['days_left'] <= 30:
-            expiring_soon_count += 1
-        else:
-            active_count += 1
+    # Status breakdown (one aggregate over the SQL plan status)
+    status_counts = Patient.objects.filter(
+        patient_type='Proceed', enrollment_date__isnull=False
+    ).with_plan_status(today).aggregate(
+        active_count=Count('pk', filter=Q(plan_status_label='Active')),
+        expiring_soon_count=Count('pk', filter=Q(plan_status_label='Expiring Soon')),
+        expired_count=Count('pk', filter=Q(plan_is_expired=True)),
+    )
+    active_count = status_counts['active_count']
+    expiring_soon_count = status_counts['expiring_soon_count']
+    expired_count = status_counts['expired_count']
     
     # Today's birthdays
     todays_birthdays = Patient.objects.filter(
@@ -2099,8 +1552,6 @@ def analytics_dashboard(request):
 # --- Communication Logs ---
 def communication_log_list(request):
     """Display communication history for all patients."""
-    from django.core.paginator import Paginator
-    
     logs = CommunicationLog.objects.all().select_related('patient', 'campaign')
     
     # Filters
@@ -2112,9 +1563,29 @@ def communication_log_list(request):
     if status:
         logs = logs.filter(status=status)
     
-    paginator = Paginator(logs, 50)
-    page_number = request.GET.get('page', 1)
-    page_obj = paginator.get_page(page_number)
+    # Keyset pages: deep pages cost the same as the first one (total only on request)
+    page_obj = keyset_paginate(
+        logs, ['-created_at', '-pk'], 50,
+        after=request.GET.get('after'), before=request.GET.get('before'),
+        with_total=request.GET.get('count') == '1',
+    ).with_query(request.GET)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'logs': [{
+                'id': log.pk,
+                'patient_id': log.patient_id,
+                'patient': str(log.patient) if log.patient else None,
+                'channel': log.channel,
+                'direction': log.direction,
+                'status': log.status,
+                'recipient': log.recipient,
+                'subject': log.subject,
+                'created_at': log.created_at,
+            } for log in page_obj],
+            'page': page_obj.as_dict(),
+        })
     
     return render(request, 'birthday/communications/communication_log_list.html', {
         'page_obj': page_obj,
@@ -2123,117 +1594,65 @@ def communication_log_list(request):
     })
 
 
-def _to_e164(number):
-    """Normalize phone numbers for comparisons (+1XXXXXXXXXX)."""
-    if not number:
-        return ''
-    raw = str(number).strip()
-    digits = ''.join(ch for ch in raw if ch.isdigit())
-    if len(digits) == 10:
-        return f'+1{digits}'
-    if len(digits) == 11 and digits.startswith('1'):
-        return f'+{digits}'
-    return raw if raw.startswith('+') else f'+{digits}' if digits else raw
-
-
-def _fetch_signalwire_sms_feed(limit=120):
-    """Fetch recent SignalWire SMS messages for UI display via REST API."""
-    sw_number = _to_e164(os.getenv('TWILIO_PHONE_NUMBER', ''))
-    from .utils import fetch_signalwire_messages
-    return fetch_signalwire_messages(sw_number, limit=limit)
+def _sms_log_row(log):
+    """Conversation/feed row for an SMS CommunicationLog."""
+    direction = log.direction or 'Outbound'
+    return {
+        'direction': direction,
+        'status': log.status,
+        'body': log.body,
+        'created_at': log.created_at,
+        'from_number': log.gateway_number if direction == 'Outbound' else log.recipient,
+        'to_number': log.recipient if direction == 'Outbound' else log.gateway_number,
+        'source': 'Local',
+    }
 
 
 def messages_hub(request):
-    """Professional SMS command-center view with patient + raw-number conversations."""
-    local_logs = list(
-        CommunicationLog.objects.filter(channel='SMS')
-        .select_related('patient')
-        .order_by('-created_at')[:500]
-    )
-    twilio_feed, twilio_fetch_error = _fetch_signalwire_sms_feed(limit=120)
-
-    patient_by_phone = {}
-    for patient in Patient.objects.exclude(phone__isnull=True).exclude(phone=''):
-        patient_by_phone[_to_e164(patient.phone)] = patient
-
-    thread_map = {}
-
-    def _thread_key(patient=None, phone=''):
-        if patient:
-            return f"p:{patient.id}"
-        return f"n:{_to_e164(phone)}"
-
-    def _thread_url(patient=None, phone=''):
-        if patient:
-            return f"{reverse('messages_hub')}?patient={patient.id}"
-        return f"{reverse('messages_hub')}?phone={quote_plus(_to_e164(phone))}"
-
-    def _display_name(patient=None, phone=''):
-        if patient:
-            return f"{patient.first_name} {patient.last_name}".strip()
-        return _to_e164(phone) or "Unknown Number"
-
-    def _touch_thread(patient=None, phone='', created_at=None, preview=''):
-        key = _thread_key(patient=patient, phone=phone)
-        if key not in thread_map:
-            thread_map[key] = {
-                'key': key,
-                'patient': patient,
-                'phone': _to_e164(phone or (patient.phone if patient else '')),
-                'display_name': _display_name(patient=patient, phone=phone),
-                'last_message_at': created_at or timezone.now(),
-                'total_messages': 0,
-                'last_preview': '',
-                'url': _thread_url(patient=patient, phone=phone),
-            }
-        thread = thread_map[key]
-        thread['total_messages'] += 1
-        if created_at and created_at >= thread['last_message_at']:
-            thread['last_message_at'] = created_at
-            thread['last_preview'] = preview or thread['last_preview']
-        elif not thread['last_preview'] and preview:
-            thread['last_preview'] = preview
-        return thread
-
-    for log in local_logs:
-        other_phone = log.patient.phone if log.patient_id and log.patient else log.recipient
-        preview = (log.body or '')[:90]
-        if len(log.body or '') > 90:
-            preview += '...'
-        _touch_thread(
-            patient=log.patient if log.patient_id else None,
-            phone=other_phone,
-            created_at=log.created_at,
-            preview=preview
-        )
-
-    for item in twilio_feed:
-        other_number = item['to_number'] if item['direction'] == 'Outbound' else item['from_number']
-        patient = patient_by_phone.get(_to_e164(other_number))
-        preview = (item['body'] or '')[:90]
-        if len(item['body'] or '') > 90:
-            preview += '...'
-        _touch_thread(
-            patient=patient,
-            phone=other_number,
-            created_at=item['created_at'],
-            preview=preview
-        )
-
-    threads = sorted(
-        [t for t in thread_map.values() if t.get('phone')],
-        key=lambda t: t['last_message_at'],
-        reverse=True
-    )
+    """
+    Professional SMS command-center view with patient + raw-number conversations.
+    Reads only the local CommunicationLog; SignalWire traffic is copied in by the
+    mirror task (birthday.sms_mirror).
+    """
+    # Sidebar: one maintained SmsThread row per conversation, paged by cursor
+    page_obj = keyset_paginate(
+        SmsThread.objects.select_related('patient'),
+        ['-last_message_at', '-pk'],
+        _per_page(request, default=30),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    ).with_query(request.GET)
+    threads = page_obj.object_list
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'threads': [{
+                'id': thread.pk,
+                'key': thread.key,
+                'patient_id': thread.patient_id,
+                'display_name': thread.display_name,
+                'phone': thread.phone_e164,
+                'last_message_at': thread.last_message_at,
+                'last_preview': thread.last_preview,
+                'last_direction': thread.last_direction,
+                'message_count': thread.message_count,
+                'unread_count': thread.unread_count,
+                'url': thread.get_absolute_url(),
+            } for thread in threads],
+            'page': page_obj.as_dict(),
+        })
 
     selected_patient_id = request.GET.get('patient', '').strip()
     selected_phone = _to_e164(request.GET.get('phone', '').strip())
-    if not selected_patient_id and not selected_phone and threads:
+    # Only a conversation the user picked counts as read, not the one shown by default
+    explicitly_selected = bool(selected_patient_id or selected_phone)
+    if not explicitly_selected and threads:
         first = threads[0]
-        if first.get('patient'):
-            selected_patient_id = str(first['patient'].id)
+        if first.patient_id:
+            selected_patient_id = str(first.patient_id)
         else:
-            selected_phone = first.get('phone', '')
+            selected_phone = first.phone_e164
 
     selected_patient = None
     conversation = []
@@ -2241,50 +1660,19 @@ def messages_hub(request):
     if selected_patient_id:
         try:
             selected_patient = Patient.objects.get(pk=int(selected_patient_id))
-            selected_target_phone = _to_e164(selected_patient.phone)
+            selected_target_phone = selected_patient.phone_e164
         except (ValueError, Patient.DoesNotExist):
             selected_patient = None
             selected_target_phone = selected_phone
 
     if selected_target_phone:
-        local_q = Q(recipient__icontains=clean_phone_number(selected_target_phone))
+        local_q = Q(counterparty_e164=selected_target_phone)
         if selected_patient:
             local_q = Q(patient=selected_patient) | local_q
-        local_conversation = CommunicationLog.objects.filter(channel='SMS').filter(local_q).order_by('created_at')
-
-        local_external_ids = set()
-        for log in local_conversation:
-            if log.external_message_id:
-                local_external_ids.add(log.external_message_id)
-            direction = log.direction or 'Outbound'
-            conversation.append({
-                'direction': direction,
-                'status': log.status,
-                'body': log.body,
-                'created_at': log.created_at,
-                'from_number': log.gateway_number if direction == 'Outbound' else log.recipient,
-                'to_number': log.recipient if direction == 'Outbound' else log.gateway_number,
-                'source': 'Local',
-            })
-
-        for item in twilio_feed:
-            sid = item.get('sid')
-            if sid and sid in local_external_ids:
-                continue
-            other_number = item['to_number'] if item['direction'] == 'Outbound' else item['from_number']
-            if _to_e164(other_number) != selected_target_phone:
-                continue
-            conversation.append({
-                'direction': item['direction'],
-                'status': item['status'] or 'Unknown',
-                'body': item['body'],
-                'created_at': item['created_at'],
-                'from_number': item['from_number'],
-                'to_number': item['to_number'],
-                'source': 'SignalWire',
-            })
-
-        conversation.sort(key=lambda x: x['created_at'])
+        conversation = [
+            _sms_log_row(log)
+            for log in CommunicationLog.objects.filter(channel='SMS').filter(local_q).order_by('created_at')
+        ]
 
     selected_thread_key = ''
     if selected_patient:
@@ -2292,33 +1680,36 @@ def messages_hub(request):
     elif selected_target_phone:
         selected_thread_key = f"n:{selected_target_phone}"
 
+    # Opening a conversation marks it read
+    read_q = Q(phone_e164=selected_target_phone) if selected_target_phone else Q()
+    if selected_patient:
+        read_q |= Q(patient=selected_patient)
+    if explicitly_selected and read_q:
+        SmsThread.objects.filter(read_q, unread_count__gt=0).update(unread_count=0)
+        for thread in threads:
+            if thread.key == selected_thread_key or thread.phone_e164 == selected_target_phone:
+                thread.unread_count = 0
+
     phone_lookup = request.GET.get('lookup', '').strip()
     found_patient_for_lookup = None
     lookup_phone_normalized = ''
     if phone_lookup:
         lookup_phone_normalized = _to_e164(phone_lookup)
-        found_patient_for_lookup = patient_by_phone.get(lookup_phone_normalized)
-        if not found_patient_for_lookup:
-            found_patient_for_lookup = Patient.objects.filter(phone=clean_phone_number(lookup_phone_normalized)).first()
-            if found_patient_for_lookup:
-                lookup_phone_normalized = _to_e164(found_patient_for_lookup.phone)
+        found_patient_for_lookup = Patient.objects.filter(phone_e164=lookup_phone_normalized).first()
 
     sw_number = _to_e164(os.getenv('TWILIO_PHONE_NUMBER', ''))
     selectable_patients = Patient.objects.order_by('first_name', 'last_name')[:500]
 
-    today = timezone.localdate()
-    def _feed_date(item):
-        dt = item.get('created_at')
-        if not dt:
-            return None
-        if timezone.is_naive(dt):
-            return dt.date()
-        return timezone.localtime(dt).date()
-
-    sent_today = sum(1 for x in twilio_feed if x['direction'] == 'Outbound' and _feed_date(x) == today)
-    received_today = sum(1 for x in twilio_feed if x['direction'] == 'Inbound' and _feed_date(x) == today)
-    delivered_today = sum(1 for x in twilio_feed if (x['status'] or '').lower() in ['delivered', 'sent'])
-    failed_today = sum(1 for x in twilio_feed if (x['status'] or '').lower() in ['failed', 'undelivered'])
+    # Today's counters come from the local log (cl_channel_created_idx), kept current by
+    # delivery receipts, not from the remote feed
+    day_start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    today_stats = CommunicationLog.objects.filter(channel='SMS', created_at__gte=day_start).aggregate(
+        sent_today=Count('pk', filter=Q(direction='Outbound')),
+        received_today=Count('pk', filter=Q(direction='Inbound')),
+        delivered_today=Count('pk', filter=Q(direction='Outbound', status='Delivered')),
+        failed_today=Count('pk', filter=Q(direction='Outbound', status__in=['Failed', 'Undelivered'])),
+    )
+    mirror_state = SmsMirrorState.objects.filter(gateway_number=sw_number).first()
 
     return render(request, 'birthday/communications/messages_hub.html', {
         'threads': threads,
@@ -2328,12 +1719,14 @@ def messages_hub(request):
         'conversation': conversation,
         'signalwire_number': sw_number,
         'selectable_patients': selectable_patients,
-        'signalwire_feed': twilio_feed[:40],
-        'signalwire_fetch_error': twilio_fetch_error,
-        'sent_today': sent_today,
-        'received_today': received_today,
-        'delivered_today': delivered_today,
-        'failed_today': failed_today,
+        'page_obj': page_obj,
+        'signalwire_feed': [
+            _sms_log_row(log)
+            for log in CommunicationLog.objects.filter(channel='SMS').order_by('-created_at')[:40]
+        ],
+        'signalwire_fetch_error': mirror_state.last_error if mirror_state else '',
+        'signalwire_synced_at': mirror_state.last_run_at if mirror_state else None,
+        **today_stats,
         'phone_lookup': phone_lookup,
         'found_patient_for_lookup': found_patient_for_lookup,
         'lookup_phone_normalized': lookup_phone_normalized,
@@ -2358,8 +1751,7 @@ def send_direct_sms(request):
         target_phone = patient.phone or ''
     elif phone_number_input:
         target_phone = phone_number_input
-        normalized = _to_e164(phone_number_input)
-        matched = Patient.objects.filter(phone=clean_phone_number(normalized)).first()
+        matched = Patient.objects.filter(phone_e164=_to_e164(phone_number_input)).first()
         if matched:
             patient = matched
             target_phone = matched.phone
@@ -2416,33 +1808,39 @@ def send_direct_sms(request):
 @csrf_exempt
 def signalwire_sms_webhook(request):
     """
-    SignalWire inbound webhook: records incoming SMS into CommunicationLog.
+    SignalWire inbound webhook: appends the message to the SMS inbox and answers
+    immediately; birthday.sms_inbox logs it into CommunicationLog in the background.
     Configure this URL in your SignalWire dashboard for the messaging number.
     """
     if request.method != 'POST':
         return HttpResponse(status=405)
 
-    from_number = (request.POST.get('From') or '').strip()
-    to_number = (request.POST.get('To') or '').strip()
-    body = (request.POST.get('Body') or '').strip()
-    message_sid = (request.POST.get('MessageSid') or '').strip()
+    from .utils import is_valid_signalwire_request
+    if not is_valid_signalwire_request(request):
+        return HttpResponse(status=403)
 
-    if not from_number or not body:
-        return HttpResponse('<Response></Response>', content_type='text/xml')
+    payload = request.POST.dict()
+    if (payload.get('From') or '').strip() and (payload.get('Body') or '').strip():
+        sms_inbox.enqueue_inbound_sms(payload)
 
-    normalized_from = clean_phone_number(from_number)
-    patient = Patient.objects.filter(phone=normalized_from).first()
+    return HttpResponse('<Response></Response>', content_type='text/xml')
 
-    if patient:
-        CommunicationLog.objects.create(
-            patient=patient,
-            channel='SMS',
-            direction='Inbound',
-            status='Sent',
-            body=body,
-            recipient=from_number,
-            external_message_id=message_sid or None,
-            gateway_number=to_number or os.getenv('TWILIO_PHONE_NUMBER')
-        )
 
-    return HttpResponse('<Response></Response>', content_type='text/xml')
+@csrf_exempt
+def signalwire_status_webhook(request):
+    """
+    SignalWire StatusCallback for outbound SMS (sent via SIGNALWIRE_STATUS_CALLBACK_URL):
+    queues the delivery receipt; birthday.sms_inbox applies it to CommunicationLog.status.
+    """
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    from .utils import is_valid_signalwire_request
+    if not is_valid_signalwire_request(request):
+        return HttpResponse(status=403)
+
+    payload = request.POST.dict()
+    if (payload.get('MessageSid') or '').strip() and (payload.get('MessageStatus') or '').strip():
+        sms_inbox.enqueue_delivery_receipt(payload)
+
+    return HttpResponse(status=204)